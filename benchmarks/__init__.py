@@ -0,0 +1,6 @@
+"""
+    Benchmarks of the protocol implementation.
+
+    Run them with python -m benchmarks, and compare two result files with
+    python -m benchmarks.compare OLD NEW.
+"""
@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+from .suite import BENCHMARKS, ROOT, Skipped
+
+
+def git_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, all by default: " + ", ".join(BENCHMARKS))
+    parser.add_argument("-o", "--output", help="result file, benchmark-<commit>.json by default")
+    parser.add_argument("--scale", type=float, default=1.0, help="iteration count multiplier")
+    parser.add_argument("--quick", action="store_const", const=0.1, dest="scale", help="same as --scale 0.1")
+    args = parser.parse_args(argv)
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {}".format(name))
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "results": {},
+        "skipped": {},
+    }
+    for name in names:
+        print(name, file=sys.stderr)
+        try:
+            result = BENCHMARKS[name](args.scale)
+        except Skipped as e:
+            report["skipped"][name] = str(e)
+            print("    skipped: {}".format(e), file=sys.stderr)
+            continue
+        report["results"][name] = result
+        for metric, value in result.items():
+            print("    {:40} {:14.3f}".format(metric, value), file=sys.stderr)
+    output = args.output or "benchmark-{}.json".format(commit or "unknown")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("results written to {}".format(os.path.abspath(output)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+    Correctness checks of the output arena.
+
+    The benchmarks only measure how fast messages go out.  These check that
+    arena.Arena queues exactly the bytes pack_arguments always produced, and
+    that fds still go with the first byte of their message when a send is
+    cut short.  Run them with python -m benchmarks.checks.
+"""
+
+import sys
+import struct
+import threading
+
+from wayland import client, server
+from wayland.arena import Arena
+
+
+class Connection(object):
+    """ the parts of a display the generated methods use to queue messages """
+    def __init__(self):
+        self.out_queue = Arena(64)
+        self.request_lock = threading.RLock()
+        self.objects = {}
+        self.last_id = 100
+
+    def next_id(self):
+        self.last_id += 1
+        return self.last_id
+
+
+def queued(connection, send):
+    """ the bytes and (offset, fds) send queues on a fresh arena """
+    connection.out_queue = Arena(64)
+    send()
+    return connection.out_queue.pending()
+
+
+def check_packing():
+    """ every argument type, packed in place or not, as pack_arguments does """
+    connection = Connection()
+    surface = client.Surface(connection, 3)
+    buffer = client.Buffer(connection, 4)
+    shell_surface = client.ShellSurface(connection, 5)
+    shm = client.Shm(connection, 6)
+    pointer = server.Pointer(connection, 7)
+    keyboard = server.Keyboard(connection, 8)
+    offer = server.DataOffer(connection, 9)
+    data_offer = client.DataOffer(connection, 10)
+    cases = [
+        ("negative ints", surface, 1, (buffer, -5, -70000), lambda: surface.attach(buffer, -5, -70000)),
+        ("null object", surface, 1, (None, 0, 0), lambda: surface.attach(None, 0, 0)),
+        ("fixed from floats", pointer, 2, (12, -3.5, 100.25), lambda: pointer.send_motion(12, -3.5, 100.25)),
+        ("fixed from ints", pointer, 2, (12, -896, 25664), lambda: pointer.send_motion(12, -896, 25664)),
+        ("uint out of range", pointer, 2, (-1, 1.0, 2.0), lambda: pointer.send_motion(-1, 1.0, 2.0)),
+        ("string", shell_surface, 8, ("title", ), lambda: shell_surface.set_title("title")),
+        ("padded string", shell_surface, 8, ("four", ), lambda: shell_surface.set_title("four")),
+        ("long string", offer, 0, ("text/plain;charset=utf-8", ), lambda: offer.send_offer("text/plain;charset=utf-8")),
+        ("null string", data_offer, 0, (7, None), lambda: data_offer.accept(7, None)),
+        ("array", keyboard, 1, (5, surface, [30, 48, 46]), lambda: keyboard.send_enter(5, surface, [30, 48, 46])),
+        ("empty array", keyboard, 1, (5, surface, []), lambda: keyboard.send_enter(5, surface, [])),
+        ("fd", keyboard, 0, (1, 4096), lambda: keyboard.send_keymap(1, 42, 4096)),
+        ("fd and string", data_offer, 1, ("text/plain", ), lambda: data_offer.receive("text/plain", 44)),
+        ("fd and new id", shm, 0, (connection.last_id + 1, 8192), lambda: shm.create_pool(43, 8192)),
+    ]
+    for name, obj, opcode, args, send in cases:
+        connection.last_id = 100
+        data, fds = queued(connection, send)
+        expected = obj.pack_arguments(opcode, *args)
+        assert data == expected, "{}: {} != {}".format(name, data.hex(), expected.hex())
+        if name.startswith("fd"):
+            assert len(fds) == 1 and fds[0][0] == 0, "{}: fds at {}".format(name, fds)
+        else:
+            assert not fds, "{}: fds at {}".format(name, fds)
+    # and one after the other, across a buffer that has to grow
+    connection.out_queue = Arena(64)
+    connection.last_id = 100
+    for name, obj, opcode, args, send in cases:
+        send()
+    data, fds = connection.out_queue.pending()
+    expected = b"".join(obj.pack_arguments(opcode, *args) for name, obj, opcode, args, send in cases)
+    assert data == expected, "queued together: {} != {}".format(data.hex(), expected.hex())
+    assert connection.out_queue.count == len(cases)
+    return len(cases)
+
+
+def message(obj_id, opcode, body=b""):
+    return struct.pack("II", obj_id, (len(body) + 8) << 16 | opcode) + body
+
+
+def sent(arena, limit):
+    """ send what arena has to send, at most limit bytes at a time, like flush over a full socket
+
+    Returns the bytes sent and the (offset in them, fds) of every send
+    that carried fds.
+
+    """
+    data = b""
+    fds = []
+    remaining = len(arena)
+    while arena:
+        segment, attached = arena.segment()
+        count = min(len(segment), limit)
+        assert count, "nothing to send with {} bytes left".format(len(arena))
+        assert len(data) + count <= remaining, "sent {} bytes of {}".format(len(data) + count, remaining)
+        if attached:
+            fds.append((len(data), attached))
+        data += bytes(segment[:count])
+        arena.consume(count)
+    return data, fds
+
+
+def check_partial_sends():
+    """ fds go with the first byte of their message however the sends are cut """
+    messages = [
+        (message(1, 0, b"a" * 12), ()),
+        (message(2, 1, b"b" * 4), (10, 11)),
+        (message(3, 2), ()),
+        (message(4, 3, b"c" * 20), (12, )),
+        (message(5, 4, b"d" * 8), (13, )),
+        (message(6, 5), ()),
+    ]
+    expected = b"".join(data for data, fds in messages)
+    offsets = []
+    offset = 0
+    for data, fds in messages:
+        if fds:
+            offsets.append((offset, fds))
+        offset += len(data)
+    runs = 0
+    for limit in range(1, len(expected) + 1):
+        arena = Arena(32)
+        for data, fds in messages:
+            arena.write(data, fds)
+        data, fds = sent(arena, limit)
+        assert data == expected, "sending {} bytes at a time: {} != {}".format(limit, data.hex(), expected.hex())
+        assert fds == offsets, "sending {} bytes at a time: fds sent at {}".format(limit, fds)
+        assert arena.count == 0 and not arena.fds
+        runs += 1
+    # a message queued while the first is partly sent
+    arena = Arena(32)
+    arena.write(*messages[1])
+    segment, attached = arena.segment()
+    arena.consume(3)
+    arena.write(*messages[3])
+    assert arena.partly_sent()
+    data, fds = sent(arena, 5)
+    assert data == messages[1][0][3:] + messages[3][0], data.hex()
+    assert fds == [(len(messages[1][0]) - 3, messages[3][1])], fds
+    return runs + 1
+
+
+def check_drop():
+    """ dropping messages keeps the end of a partly sent one and the fds of the others """
+    messages = [
+        (message(1, 0, b"a" * 12), (20, )),
+        (message(2, 1, b"b" * 4), (21, 22)),
+        (message(3, 2), ()),
+        (message(4, 3, b"c" * 20), (23, )),
+        (message(5, 4, b"d" * 8), ()),
+    ]
+    runs = 0
+    for cut in range(len(messages[0][0])):
+        arena = Arena(32)
+        for data, fds in messages:
+            arena.write(data, fds)
+        if cut:
+            segment, attached = arena.segment()
+            arena.consume(cut)
+        chosen = []
+
+        def choose(queued, buffer):
+            chosen.extend(offset for offset, size, fds in queued)
+            # every object id but the last
+            return [offset for offset, size, fds in queued
+                    if struct.unpack_from("I", buffer, offset)[0] != 5]
+        released = arena.drop(choose)
+        expected_released = [fds for data, fds in messages[1 if cut else 0:4]]
+        assert released == expected_released, "cut at {}: released {}".format(cut, released)
+        assert len(chosen) == (4 if cut else 5), "cut at {}: offered {} messages".format(cut, len(chosen))
+        data, fds = sent(arena, 7)
+        expected = (messages[0][0][cut:] if cut else b"") + messages[4][0]
+        assert data == expected, "cut at {}: {} != {}".format(cut, data.hex(), expected.hex())
+        assert fds == [], "cut at {}: fds sent at {}".format(cut, fds)
+        assert arena.count == 0
+        runs += 1
+    return runs
+
+
+CHECKS = {
+    "packing": check_packing,
+    "partial_sends": check_partial_sends,
+    "drop": check_drop,
+}
+
+
+def main():
+    failed = 0
+    for name, check in CHECKS.items():
+        try:
+            runs = check()
+        except AssertionError as e:
+            failed += 1
+            print("{:20} FAILED: {}".format(name, e), file=sys.stderr)
+        else:
+            print("{:20} ok ({} cases)".format(name, runs), file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+    Compare two benchmark result files.
+
+    Usage: python -m benchmarks.compare OLD NEW
+"""
+
+import sys
+import json
+
+
+def better(metric, old, new):
+    """ the relative improvement from old to new, positive when new is better """
+    if not old or not new:
+        return 0
+    if metric.endswith(("_per_second", "_speedup")):
+        return new / old - 1
+    return old / new - 1
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__.strip().splitlines()[-1].strip(), file=sys.stderr)
+        return 2
+    with open(argv[0]) as f:
+        old = json.load(f)
+    with open(argv[1]) as f:
+        new = json.load(f)
+    print("{} -> {}".format(old.get("commit"), new.get("commit")))
+    for name, results in new["results"].items():
+        previous = old["results"].get(name, {})
+        print(name)
+        for metric, value in results.items():
+            if metric not in previous:
+                print("    {:40} {:>14} {:14.3f}".format(metric, "-", value))
+                continue
+            print("    {:40} {:14.3f} {:14.3f} {:+8.1%}".format(
+                metric, previous[metric], value, better(metric, previous[metric], value)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,405 @@
+"""
+    In-process client/server harness for the benchmarks.
+
+    A Session serves a headless compositor from a background thread and
+    connects a client.Display to it over socket.socketpair, so nothing but
+    this package is needed to exercise both ends of the protocol.
+"""
+
+import os
+import mmap
+import socket
+import tempfile
+import threading
+import time
+
+from wayland import client, server, subsurface
+from wayland.configure import Configurer
+
+
+class Compositor(object):
+    name = "wl_compositor"
+    version = 4
+    proxy = server.CompositorProxy
+
+    def __init__(self, display, surface_class=None):
+        self.display = display
+        self.surface_class = surface_class or Surface
+        self.surfaces = []
+        self.commits = 0
+        # area of the surface trees repainted, for TreeSurface
+        self.damaged_pixels = 0
+
+    def create_surface(self, proxy, obj_id):
+        surface = self.surface_class(proxy.display, obj_id, self)
+        self.surfaces.append(surface)
+        proxy.display.objects[obj_id] = surface
+
+    def create_region(self, proxy, obj_id):
+        proxy.display.objects[obj_id] = Region(proxy.display, obj_id)
+
+    def setup(self, proxy):
+        pass
+
+    def update(self):
+        pass
+
+    def destroy(self, proxy):
+        pass
+
+
+class Surface(server.Surface):
+    """ copies every committed buffer that has damage, like a compositor would """
+    def __init__(self, display, obj_id, compositor):
+        super().__init__(display, obj_id)
+        self.compositor = compositor
+        self.pending_buffer = None
+        self.pending_damage = []
+        self.pending_scale = None
+        self.scale = 1
+        self.role = None
+        self.buffer = None
+        self.frames = []
+        self.contents = None
+        # the compositor's count is shared by clients on different threads
+        self.commits = 0
+
+    def handle_attach(self, buffer, x, y):
+        self.pending_buffer = buffer
+
+    def handle_damage(self, x, y, width, height):
+        self.pending_damage.append((x, y, width, height))
+
+    def handle_set_buffer_scale(self, scale):
+        self.pending_scale = scale
+
+    def handle_frame(self, callback):
+        frame = server.Callback(self.display, callback)
+        self.display.objects[callback] = frame
+        self.frames.append(frame)
+
+    def handle_commit(self):
+        self.compositor.commits += 1
+        self.commits += 1
+        if self.pending_buffer is not None:
+            self.buffer = self.pending_buffer
+            self.pending_buffer = None
+            if self.pending_damage:
+                self.contents = self.buffer.read()
+            self.buffer.send_release()
+        self.pending_damage = []
+        if self.pending_scale is not None:
+            self.scale = self.pending_scale
+            self.pending_scale = None
+        if self.role is not None:
+            self.role.committed()
+        for frame in self.frames:
+            frame.send_done(int(time.monotonic() * 1000) & 0xffffffff)
+            self.display.send_delete_id(frame.obj_id)
+        self.frames = []
+
+    def handle_destroy(self):
+        self.destroy()
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        if self in self.compositor.surfaces:
+            self.compositor.surfaces.remove(self)
+
+
+class TreeSurface(subsurface.Surface):
+    """ a Surface that may have sub-surfaces, counting the area it repaints """
+    def __init__(self, display, obj_id, compositor):
+        super().__init__(display, obj_id)
+        self.compositor = compositor
+        self.role = None
+        self.contents = None
+        self.commits = 0
+
+    def applied(self, state):
+        self.compositor.commits += 1
+        self.commits += 1
+        if state.attached and state.buffer is not None:
+            if state.damage or state.buffer_damage:
+                self.contents = state.buffer.read()
+            state.buffer.send_release()
+        if self.role is not None:
+            self.role.committed()
+        for frame in state.frames:
+            frame.send_done(int(time.monotonic() * 1000) & 0xffffffff)
+            self.display.send_delete_id(frame.obj_id)
+
+    def damaged(self, rectangles):
+        self.compositor.damaged_pixels += sum(width * height for x, y, width, height in rectangles)
+
+    def destroy(self):
+        super().destroy()
+        if self in self.compositor.surfaces:
+            self.compositor.surfaces.remove(self)
+
+
+class Region(server.Region):
+    def handle_add(self, x, y, width, height):
+        pass
+
+    def handle_destroy(self):
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        pass
+
+
+class Shm(object):
+    name = "wl_shm"
+    version = 1
+    proxy = server.ShmProxy
+
+    def __init__(self, display):
+        self.display = display
+
+    def create_pool(self, proxy, obj_id, fd, size):
+        proxy.display.objects[obj_id] = ShmPool(proxy.display, obj_id, fd, size)
+
+    def setup(self, proxy):
+        proxy.send_format(proxy.ARGB8888)
+        proxy.send_format(proxy.XRGB8888)
+
+    def update(self):
+        pass
+
+    def destroy(self, proxy):
+        pass
+
+
+class ShmPool(server.ShmPool):
+    def __init__(self, display, obj_id, fd, size):
+        super().__init__(display, obj_id)
+        self.fd = fd
+        self.data = mmap.mmap(fd, size)
+
+    def handle_create_buffer(self, obj_id, offset, width, height, stride, format):
+        self.display.objects[obj_id] = Buffer(self.display, obj_id, self, offset, width, height, stride)
+
+    def handle_resize(self, size):
+        self.data.close()
+        self.data = mmap.mmap(self.fd, size)
+
+    def handle_destroy(self):
+        self.destroy()
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        if not self.data.closed:
+            self.data.close()
+            os.close(self.fd)
+
+
+class Buffer(server.Buffer):
+    def __init__(self, display, obj_id, pool, offset, width, height, stride):
+        super().__init__(display, obj_id)
+        self.pool = pool
+        self.offset = offset
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.size = height * stride
+
+    def read(self):
+        return self.pool.data[self.offset:self.offset+self.size]
+
+    def handle_destroy(self):
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        pass
+
+
+class Pointer(server.Pointer):
+    def handle_release(self):
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        pass
+
+
+class Seat(object):
+    name = "wl_seat"
+    version = 1
+    proxy = server.SeatProxy
+
+    def __init__(self, display):
+        self.display = display
+        self.pointers = []
+
+    def setup(self, proxy):
+        proxy.send_capabilities(proxy.POINTER)
+
+    def update(self):
+        pass
+
+    def destroy(self, proxy):
+        pass
+
+    def get_pointer(self, proxy, obj_id):
+        pointer = Pointer(proxy.display, obj_id)
+        self.pointers.append(pointer)
+        proxy.display.objects[obj_id] = pointer
+
+
+class Output(object):
+    """ a monitor, for hotplug with Display.add_global """
+    name = "wl_output"
+    version = 2
+    proxy = server.OutputProxy
+
+    def __init__(self, display, width=1920, height=1080):
+        self.display = display
+        self.width = width
+        self.height = height
+
+    def setup(self, proxy):
+        proxy.send_geometry(0, 0, 520, 290, proxy.UNKNOWN, "python-wayland", "headless", proxy.NORMAL)
+        proxy.send_mode(proxy.CURRENT, self.width, self.height, 60000)
+        proxy.send_done()
+
+    def update(self):
+        pass
+
+    def destroy(self, proxy):
+        pass
+
+
+class XdgShell(object):
+    name = "zxdg_shell_v6"
+    version = 1
+    proxy = server.ZxdgShellV6Proxy
+
+    def __init__(self, display):
+        self.display = display
+
+    def get_xdg_surface(self, proxy, obj_id, surface):
+        proxy.display.objects[obj_id] = XdgSurface(proxy.display, obj_id, surface)
+
+    def setup(self, proxy):
+        pass
+
+    def update(self):
+        pass
+
+    def destroy(self, proxy):
+        pass
+
+
+class XdgSurface(server.ZxdgSurfaceV6):
+    def __init__(self, display, obj_id, surface):
+        super().__init__(display, obj_id)
+        self.surface = surface
+
+    def handle_get_toplevel(self, obj_id):
+        toplevel = Toplevel(self.display, obj_id, self)
+        self.surface.role = toplevel
+        self.display.objects[obj_id] = toplevel
+
+    def handle_ack_configure(self, serial):
+        if self.surface.role is not None:
+            self.surface.role.configurer.ack(serial)
+
+    def handle_set_window_geometry(self, x, y, width, height):
+        pass
+
+    def handle_destroy(self):
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        pass
+
+
+class Toplevel(server.ZxdgToplevelV6):
+    """ configured to a fixed size on its surface's first commit, then resized by the benchmark """
+    def __init__(self, display, obj_id, xdg_surface):
+        super().__init__(display, obj_id)
+        self.xdg_surface = xdg_surface
+        self.configured = False
+        self.configurer = Configurer(display, self.send_state)
+
+    def send_state(self, serial, width=640, height=480, states=(server.ZxdgToplevelV6.ACTIVATED,)):
+        self.send_configure(width, height, states)
+        self.xdg_surface.send_configure(serial)
+
+    def committed(self):
+        if not self.configured:
+            # the initial commit asks for the first configure
+            self.configured = True
+            self.configurer.configure()
+        else:
+            self.configurer.commit()
+
+    def handle_set_title(self, title):
+        pass
+
+    def handle_destroy(self):
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        pass
+
+
+class Display(server.Display):
+    """ the headless compositor, with sub-surfaces when tree is true """
+    def __init__(self, tree=False, **kwargs):
+        self.compositor = Compositor(self, TreeSurface if tree else Surface)
+        self.shm = Shm(self)
+        self.seat = Seat(self)
+        global_objects = [self.compositor, self.shm, self.seat, XdgShell(self)]
+        if tree:
+            global_objects.append(subsurface.Subcompositor(self))
+        super().__init__(*global_objects, **kwargs)
+
+
+class Session(object):
+    """ a headless compositor thread and a client connected to it
+
+    The server thread holds lock while it handles requests; take it to
+    call into server objects from the benchmark thread.  coalesce is passed
+    to the client Display, the other arguments to the server one.
+
+    """
+    def __init__(self, coalesce=False, **kwargs):
+        self.runtime_dir = tempfile.TemporaryDirectory()
+        os.environ["XDG_RUNTIME_DIR"] = self.runtime_dir.name
+        self.server = Display(**kwargs)
+        self.lock = threading.Lock()
+        # called by the server thread after every turn, with lock held
+        self.idle = None
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        self.display = self.connect(coalesce=coalesce)
+        self.display.roundtrip()
+
+    def connect(self, **kwargs):
+        """ a new client.Display of the compositor, created with kwargs """
+        server_end, client_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        with self.lock:
+            self.server.add_client(server_end)
+        return client.Display(client_end, **kwargs)
+
+    def serve(self):
+        while self.running:
+            with self.lock:
+                self.server.handle_requests(0.001)
+                if self.idle is not None:
+                    self.idle()
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.display.disconnect()
+        self.server.close()
+        self.runtime_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,942 @@
+"""
+    The protocol benchmarks.
+
+    Every benchmark takes a scale factor for its iteration counts and returns
+    a dict of metrics.  Metric names end in their unit: _per_second or
+    _speedup (higher is better), _us, _seconds or _per_1000_<thing> counts
+    (lower is better).
+"""
+
+import io
+import os
+import sys
+import time
+import struct
+import socket
+import tempfile
+import sysconfig
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from wayland import capture, server as wayland_server
+from wayland.grab import BOTTOM, RIGHT, Grabber
+from wayland.output import Layout, Output as LayoutOutput
+
+from .harness import Display, Output, Session
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Skipped(Exception):
+    """ raised by a benchmark that cannot run here, with the reason """
+
+
+def require_numpy():
+    """ skip the benchmark unless NumPy, which wayland.scene needs, can be imported """
+    try:
+        import numpy
+    except ImportError:
+        raise Skipped("NumPy is not installed")
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "mean_us": statistics.mean(samples) * 1e6,
+        "median_us": statistics.median(samples) * 1e6,
+        "p99_us": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6,
+    }
+
+
+def queue_buffer(display, width, height):
+    """ request a new shm buffer, without waiting for it """
+    shm = display.globals["wl_shm"]
+    size = width * height * 4
+    fd = os.memfd_create("benchmark", os.MFD_CLOEXEC)
+    os.ftruncate(fd, size)
+    pool = shm.create_pool(fd, size)
+    return pool.create_buffer(0, width, height, width * 4, shm.ARGB8888)
+
+
+def create_buffer(display, width, height):
+    buffer = queue_buffer(display, width, height)
+    display.roundtrip()
+    return buffer
+
+
+def wait_frame(display, surface):
+    done = False
+
+    def handle_done(data):
+        nonlocal done
+        done = True
+    callback = surface.frame()
+    callback.handle_done = handle_done
+    surface.commit()
+    while not done:
+        display.dispatch()
+
+
+def roundtrip(scale):
+    """ wl_display.sync latency """
+    count = int(2000 * scale)
+    with Session() as session:
+        samples = []
+        for i in range(count):
+            start = time.perf_counter()
+            session.display.roundtrip()
+            samples.append(time.perf_counter() - start)
+    result = timings(samples)
+    result["roundtrips_per_second"] = count / sum(samples)
+    return result
+
+
+def commit_cycle(scale):
+    """ attach, damage and commit requests, with a roundtrip every batch """
+    count = int(20000 * scale)
+    batch = 256
+    with Session() as session:
+        display = session.display
+        surface = display.globals["wl_compositor"].create_surface()
+        buffer = create_buffer(display, 1, 1)
+        server_client = session.server.clients[0]
+        reads = server_client.reads
+        start = time.perf_counter()
+        for i in range(count):
+            surface.attach(buffer, 0, 0)
+            surface.damage(0, 0, 1, 1)
+            surface.commit()
+            if i % batch == batch - 1:
+                display.roundtrip()
+        display.roundtrip()
+        elapsed = time.perf_counter() - start
+        commits = session.server.compositor.commits
+        reads = server_client.reads - reads
+    return {
+        "seconds": elapsed,
+        "commits": commits,
+        "requests_per_second": count * 3 / elapsed,
+        "commits_per_second": count / elapsed,
+        "server_reads_per_1000_requests": reads * 1000 / (count * 3),
+    }
+
+
+def pointer_flood(scale):
+    """ motion events encoded by the server and dispatched by the client """
+    count = int(50000 * scale)
+    with Session() as session:
+        display = session.display
+        pointer = display.globals["wl_seat"].pointer
+        received = 0
+
+        def handle_motion(time, x, y):
+            nonlocal received
+            received += 1
+        pointer.handle_motion = handle_motion
+        display.roundtrip()
+        server_pointer = session.server.seat.pointers[0]
+        reads = display.reads
+        start = time.perf_counter()
+        with session.lock:
+            for i in range(count):
+                server_pointer.send_motion(i, i % 800 + 0.5, i % 600 + 0.25)
+        while received < count:
+            display.dispatch()
+        elapsed = time.perf_counter() - start
+        reads = display.reads - reads
+    return {
+        "seconds": elapsed,
+        "events_per_second": count / elapsed,
+        "reads_per_1000_events": reads * 1000 / count,
+    }
+
+
+def pointer_decode(scale):
+    """ client decode and dispatch of motion events, without the socket """
+    count = int(100000 * scale)
+    with Session() as session:
+        display = session.display
+        pointer = display.globals["wl_seat"].pointer
+        pointer.handle_motion = lambda time, x, y: None
+        display.roundtrip()
+        message = struct.pack("IIIii", pointer.obj_id, 20 << 16 | 2, 0, 100 * 256, 200 * 256)
+        data = message * count
+        chunk_size = 4096 // len(message) * len(message)
+        start = time.perf_counter()
+        for offset in range(0, len(data), chunk_size):
+            display.decode(data[offset:offset+chunk_size])
+            display.dispatch_pending()
+        elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "events_per_second": count / elapsed}
+
+
+def shm_commit(scale):
+    """ full-damage frames of several buffer sizes, each waiting for its frame callback """
+    result = {}
+    with Session() as session:
+        display = session.display
+        for width, height in ((64, 64), (256, 256), (1024, 768), (1920, 1080)):
+            size = width * height * 4
+            frames = max(10, int(scale * 2e8 / size))
+            surface = display.globals["wl_compositor"].create_surface()
+            buffer = create_buffer(display, width, height)
+            start = time.perf_counter()
+            for i in range(frames):
+                surface.attach(buffer, 0, 0)
+                surface.damage(0, 0, width, height)
+                wait_frame(display, surface)
+            elapsed = time.perf_counter() - start
+            name = "{}x{}".format(width, height)
+            result[name + "_frames_per_second"] = frames / elapsed
+            result[name + "_megabytes_per_second"] = frames * size / elapsed / 1e6
+    return result
+
+
+def startup(scale):
+    """ import time in a fresh interpreter and connection setup time """
+    runs = max(3, int(10 * scale))
+    code = ("import time; start = time.perf_counter(); import wayland.client, wayland.server; "
+            "print(time.perf_counter() - start)")
+    imports = []
+    for i in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True)
+        imports.append(float(output.stdout))
+    connects = []
+    for i in range(runs):
+        start = time.perf_counter()
+        session = Session()
+        connects.append(time.perf_counter() - start)
+        session.close()
+    return {
+        "import_seconds": statistics.median(imports),
+        "connect_seconds": statistics.median(connects),
+    }
+
+
+def create_window(display):
+    """ a toplevel surface, committed without a buffer to be configured """
+    surface = display.globals["wl_compositor"].create_surface()
+    xdg_surface = display.globals["zxdg_shell_v6"].get_xdg_surface(surface)
+    xdg_surface.get_toplevel().set_title("benchmark")
+    surface.commit()
+    return surface
+
+
+def show_window(display, surface, buffer):
+    surface.attach(buffer, 0, 0)
+    surface.damage(0, 0, 64, 64)
+    surface.commit()
+    # the compositor has the frame once this returns
+    display.roundtrip()
+
+
+def first_frame(scale):
+    """ connecting and showing a window, waiting at each step and with Display(setup=...) """
+    runs = max(10, int(200 * scale))
+    needs = ("wl_compositor", "wl_shm", "zxdg_shell_v6")
+    sequential = []
+    pipelined = []
+    with Session() as session:
+        for i in range(runs):
+            start = time.perf_counter()
+            display = session.connect()
+            display.roundtrip()
+            surface = create_window(display)
+            display.roundtrip()
+            show_window(display, surface, create_buffer(display, 64, 64))
+            sequential.append(time.perf_counter() - start)
+            display.disconnect()
+
+            start = time.perf_counter()
+            windows = []
+            display = session.connect(needs=needs, setup=lambda display: windows.append(create_window(display)))
+            show_window(display, windows[0], queue_buffer(display, 64, 64))
+            pipelined.append(time.perf_counter() - start)
+            display.disconnect()
+    return {
+        "sequential_median_us": statistics.median(sequential) * 1e6,
+        "pipelined_median_us": statistics.median(pipelined) * 1e6,
+        "pipelined_speedup": statistics.median(sequential) / statistics.median(pipelined),
+    }
+
+
+def replay(scale):
+    """ server decode and dispatch of a recorded session, single threaded """
+    count = int(5000 * scale)
+    recording = io.BytesIO()
+    recorder = capture.Recorder(recording)
+    with Session(record=recorder) as session:
+        display = session.display
+        surface = display.globals["wl_compositor"].create_surface()
+        buffer = create_buffer(display, 16, 16)
+        for i in range(count):
+            surface.attach(buffer, 0, 0)
+            surface.damage(0, 0, 16, 16)
+            surface.commit()
+            if i % 256 == 255:
+                display.roundtrip()
+        display.roundtrip()
+    recorder.close()
+    recording.seek(0)
+    session_capture = capture.Capture(recording)
+    messages = sum(1 for m in session_capture.messages() if m[0])
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        os.environ["XDG_RUNTIME_DIR"] = runtime_dir
+        server = Display()
+        start = time.perf_counter()
+        client, peer = capture.replay_server(server, session_capture)
+        elapsed = time.perf_counter() - start
+        peer.close()
+        server.close()
+    return {"seconds": elapsed, "requests_per_second": messages / elapsed}
+
+
+def draw_widgets(coalesce, frames):
+    """ (seconds, bytes sent) for frames of a grid of widgets, a third of them redrawn each frame """
+    columns, rows = 8, 6
+    width, height = 100, 30
+    with Session(coalesce=coalesce) as session:
+        display = session.display
+        surface = display.globals["wl_compositor"].create_surface()
+        buffer = create_buffer(display, 1, 1)
+        sent = display.out_queue.sent
+        start = time.perf_counter()
+        for frame in range(frames):
+            surface.attach(buffer, 0, 0)
+            surface.set_buffer_scale(1)
+            for i in range(frame % 3, columns * rows, 3):
+                x, y = i % columns * width, i // columns * height
+                # background, border and label, like a toolkit redrawing a button
+                surface.damage(x, y, width, height)
+                surface.damage(x, y, width, 1)
+                surface.damage(x, y + height - 1, width, 1)
+                surface.damage(x, y, 1, height)
+                surface.damage(x + width - 1, y, 1, height)
+                surface.damage(x + 10, y + 8, width - 20, 14)
+            surface.commit()
+            if frame % 16 == 15:
+                display.roundtrip()
+        display.roundtrip()
+        elapsed = time.perf_counter() - start
+        sent = display.out_queue.sent - sent
+    return elapsed, sent
+
+
+def widget_frames(scale):
+    """ damage-heavy frames of a widget toolkit, sent as is and coalesced by the client """
+    frames = int(2000 * scale)
+    plain, plain_sent = draw_widgets(False, frames)
+    coalesced, coalesced_sent = draw_widgets(True, frames)
+    return {
+        "plain_frames_per_second": frames / plain,
+        "coalesced_frames_per_second": frames / coalesced,
+        "coalesced_speedup": plain / coalesced,
+        "plain_sent_bytes_per_1000_frames": plain_sent * 1000 / frames,
+        "coalesced_sent_bytes_per_1000_frames": coalesced_sent * 1000 / frames,
+    }
+
+
+def animate_sprite(frames):
+    """ (seconds, pixels repainted) for frames of a sprite moving over a static window
+
+    The window is an 800x600 surface drawn once, the sprite a 64x64
+    desynchronized sub-surface of it redrawn and moved every frame.
+
+    """
+    with Session(tree=True) as session:
+        display = session.display
+        compositor = display.globals["wl_compositor"]
+        window = compositor.create_surface()
+        sprite = compositor.create_surface()
+        subsurface = display.globals["wl_subcompositor"].get_subsurface(sprite, window)
+        subsurface.set_desync()
+        background = create_buffer(display, 800, 600)
+        window.attach(background, 0, 0)
+        window.damage(0, 0, 800, 600)
+        window.commit()
+        buffers = [create_buffer(display, 64, 64) for i in range(2)]
+        display.roundtrip()
+        repainted = session.server.compositor.damaged_pixels
+        start = time.perf_counter()
+        for frame in range(frames):
+            sprite.attach(buffers[frame % 2], 0, 0)
+            sprite.damage(0, 0, 64, 64)
+            sprite.commit()
+            # the position is the window's state, applied by its commit
+            subsurface.set_position(frame * 7 % 736, frame * 3 % 536)
+            window.commit()
+            if frame % 16 == 15:
+                display.roundtrip()
+        display.roundtrip()
+        elapsed = time.perf_counter() - start
+        repainted = session.server.compositor.damaged_pixels - repainted
+    return elapsed, repainted
+
+
+def subsurface_frames(scale):
+    """ an animated sub-surface over a static window, repainting only what changed in the tree """
+    frames = int(2000 * scale)
+    elapsed, repainted = animate_sprite(frames)
+    window = 800 * 600 * frames
+    return {
+        "frames_per_second": frames / elapsed,
+        "subtree_repainted_kilopixels_per_1000_frames": repainted / frames,
+        "window_repainted_kilopixels_per_1000_frames": window / frames,
+        "repainted_area_speedup": window / repainted,
+    }
+
+
+def resize_window(throttle, collapse, steps, motions=8):
+    """ (seconds, buffers drawn, configures sent) for an interactive resize
+
+    The compositor asks for a new size on each of motions pointer motions
+    per step, the client drawing a buffer of the size it is configured to
+    and the compositor copying it.  throttle sends configures through the
+    toplevel's Configurer, collapse has the client skip superseded ones.
+
+    """
+    with Session() as session:
+        display = session.display
+        surface = display.globals["wl_compositor"].create_surface()
+        xdg_surface = display.globals["zxdg_shell_v6"].get_xdg_surface(surface)
+        toplevel = xdg_surface.get_toplevel()
+        xdg_surface.collapse_configures = toplevel.collapse_configures = collapse
+        size = [640, 480]
+        drawn = [None]
+        count = 0
+
+        def handle_toplevel_configure(width, height, states):
+            size[:] = width, height
+
+        def handle_configure(serial):
+            nonlocal count
+            xdg_surface.ack_configure(serial)
+            width, height = size
+            buffer = queue_buffer(display, width, height)
+            surface.attach(buffer, 0, 0)
+            surface.damage(0, 0, width, height)
+            surface.commit()
+            count += 1
+            # the compositor has read the previous buffer by now
+            if drawn[0] is not None:
+                drawn[0].destroy()
+            drawn[0] = buffer
+        toplevel.handle_configure = handle_toplevel_configure
+        xdg_surface.handle_configure = handle_configure
+        surface.commit()
+        display.roundtrip()
+        display.roundtrip()
+        with session.lock:
+            role = session.server.compositor.surfaces[0].role
+            client = session.server.clients[0]
+        count = 0
+        sent = 0
+        start = time.perf_counter()
+        for step in range(steps):
+            with session.lock:
+                for motion in range(motions):
+                    i = step * motions + motion
+                    width, height = 400 + i * 3 % 400, 300 + i * 2 % 300
+                    if throttle:
+                        role.configurer.configure(width=width, height=height)
+                    else:
+                        role.send_state(client.get_serial(), width, height)
+                        sent += 1
+                client.flush()
+            display.roundtrip()
+        display.roundtrip()
+        elapsed = time.perf_counter() - start
+        if throttle:
+            sent = role.configurer.sent - 1
+    return elapsed, count, sent
+
+
+def resize_storm(scale):
+    """ an interactive resize sending a configure per pointer motion, throttled and collapsed """
+    steps = int(200 * scale)
+    motions = steps * 8
+    plain, plain_drawn, plain_sent = resize_window(False, False, steps)
+    collapsed, collapsed_drawn, collapsed_sent = resize_window(False, True, steps)
+    throttled, throttled_drawn, throttled_sent = resize_window(True, True, steps)
+    return {
+        "plain_seconds": plain,
+        "collapsed_seconds": collapsed,
+        "throttled_seconds": throttled,
+        "plain_buffers_per_1000_motions": plain_drawn * 1000 / motions,
+        "collapsed_buffers_per_1000_motions": collapsed_drawn * 1000 / motions,
+        "throttled_buffers_per_1000_motions": throttled_drawn * 1000 / motions,
+        "throttled_configures_per_1000_motions": throttled_sent * 1000 / motions,
+        "collapsed_speedup": plain / collapsed,
+        "throttled_speedup": plain / throttled,
+    }
+
+
+def request(obj_id, opcode, body=b""):
+    return struct.pack("II", obj_id, (8 + len(body)) << 16 | opcode) + body
+
+
+def bind(name, interface, version, obj_id):
+    """ wl_registry.bind on registry 2 """
+    string = interface.encode() + b"\0"
+    string += b"\0" * (-len(string) % 4)
+    return request(2, 0, struct.pack("II", name, len(interface) + 1) + string + struct.pack("II", version, obj_id))
+
+
+def connect_clients(server, count, setup):
+    """ count raw clients of server, each sending setup after wl_display.get_registry(2) """
+    peers = []
+    for i in range(count):
+        server_end, client_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.add_client(server_end)
+        client_end.sendall(request(1, 1, struct.pack("I", 2)) + setup)
+        peers.append(client_end)
+    return peers
+
+
+def serve_clients(count, bursts, burst, executor=None):
+    """ seconds for a Display to decode bursts of damage and commit requests from count clients """
+    setup = bind(0, "wl_compositor", 4, 3) + request(3, 0, struct.pack("I", 4))
+    commits = (request(4, 2, struct.pack("iiii", 0, 0, 1, 1)) + request(4, 6)) * burst
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        os.environ["XDG_RUNTIME_DIR"] = runtime_dir
+        server = Display()
+        peers = connect_clients(server, count, setup)
+        while len(server.compositor.surfaces) < count:
+            server.handle_requests(0.1, executor)
+        start = time.perf_counter()
+        for i in range(bursts):
+            for peer in peers:
+                peer.sendall(commits)
+            expected = (i + 1) * burst
+            while any(surface.commits < expected for surface in server.compositor.surfaces):
+                server.handle_requests(0.1, executor)
+        elapsed = time.perf_counter() - start
+        for peer in peers:
+            peer.close()
+        server.close()
+    return elapsed
+
+
+def busy_clients(scale):
+    """ 64 clients decoded on one thread, then on a thread pool
+
+    Threads only add throughput on a free-threaded interpreter, where
+    free_threaded is 1.
+
+    """
+    count = 64
+    burst = 100
+    bursts = max(2, int(20 * scale))
+    workers = min(count, os.cpu_count() or 1)
+    requests = count * bursts * burst * 2
+    single = serve_clients(count, bursts, burst)
+    with ThreadPoolExecutor(workers) as executor:
+        threaded = serve_clients(count, bursts, burst, executor)
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    return {
+        "free_threaded": int(bool(sysconfig.get_config_var("Py_GIL_DISABLED")) and not gil),
+        "threads": workers,
+        "single_thread_requests_per_second": requests / single,
+        "thread_pool_requests_per_second": requests / threaded,
+        "thread_pool_speedup": single / threaded,
+    }
+
+
+def broadcast(scale):
+    """ a new global announced to 256 clients, packed per client and by Display.broadcast """
+    count = 256
+    rounds = max(10, int(200 * scale))
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        os.environ["XDG_RUNTIME_DIR"] = runtime_dir
+        server = Display()
+        peers = connect_clients(server, count, b"")
+        while sum(2 in c.objects for c in server.clients) < count:
+            server.handle_requests(0.1)
+        registries = [c.objects[2] for c in server.clients]
+        each = 0
+        once = 0
+        for i in range(rounds):
+            start = time.perf_counter()
+            for registry in registries:
+                registry.send_global(i + 3, "wl_output", 3)
+            each += time.perf_counter() - start
+            for c in server.clients:
+                c.out_queue.clear()
+            start = time.perf_counter()
+            # distinct names, so no round reuses the last one's encoding
+            server.broadcast(registries, "global", i + 3 + rounds, "wl_output", 3)
+            once += time.perf_counter() - start
+            for c in server.clients:
+                c.out_queue.clear()
+        for peer in peers:
+            peer.close()
+        server.close()
+    events = count * rounds
+    return {
+        "per_client_events_per_second": events / each,
+        "broadcast_events_per_second": events / once,
+        "broadcast_speedup": each / once,
+    }
+
+
+def hotplug(scale):
+    """ an output added and removed with 128 clients of 100 surfaces each
+
+    Announced with add_global and remove_global, and for comparison by
+    looking for registries through the objects of every client.
+
+    """
+    count = 128
+    rounds = max(10, int(200 * scale))
+    setup = bind(0, "wl_compositor", 4, 3) + b"".join(request(3, 0, struct.pack("I", i)) for i in range(4, 104))
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        os.environ["XDG_RUNTIME_DIR"] = runtime_dir
+        server = Display()
+        peers = connect_clients(server, count, setup)
+        while len(server.compositor.surfaces) < count * 100:
+            server.handle_requests(0.1)
+        output = Output(server)
+        tracked = 0
+        scanned = 0
+        for i in range(rounds):
+            start = time.perf_counter()
+            server.add_global(output)
+            server.remove_global(output)
+            tracked += time.perf_counter() - start
+            start = time.perf_counter()
+            for event, args in (("global", (i, "wl_output", 2)), ("global_remove", (i,))):
+                for c in server.clients:
+                    for obj in list(c.objects.values()):
+                        if isinstance(obj, wayland_server.Registry):
+                            getattr(obj, "send_" + event)(*args)
+            scanned += time.perf_counter() - start
+            for c in server.clients:
+                c.out_queue.clear()
+        for peer in peers:
+            peer.close()
+        server.close()
+    return {
+        "tracked_hotplug_us": tracked / rounds * 1e6,
+        "scanned_hotplug_us": scanned / rounds * 1e6,
+        "tracked_speedup": scanned / tracked,
+    }
+
+
+class Framebuffer(LayoutOutput):
+    """ an output that fills its damage in memory, row by row like a software renderer """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        x, y, width, height = self.area()
+        self.pixels = bytearray(width * height * 4)
+        self.rendered = 0
+
+    def render(self, damage):
+        x, y, width, height = self.area()
+        for left, top, w, h in damage:
+            row = b"\xff" * (w * 4)
+            for line in range(top - y, top - y + h):
+                offset = (line * width + left - x) * 4
+                self.pixels[offset:offset+w*4] = row
+            self.rendered += w * h
+
+
+def show_outputs(refreshes, seconds):
+    """ (video frames drawn, pixels rendered, seconds) for a simulated run of two outputs
+
+    A video plays on the first, 1920x1080 output, its client drawing a
+    frame for every frame callback, and a clock ticks on the second,
+    2560x1440 one.  Time is simulated, so only the work is measured.
+
+    """
+    setup = bind(0, "wl_compositor", 4, 3) + request(3, 0, struct.pack("I", 4))
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        os.environ["XDG_RUNTIME_DIR"] = runtime_dir
+        server = Display()
+        peers = connect_clients(server, 2, setup)
+        while len(server.compositor.surfaces) < 2:
+            server.handle_requests(0.1)
+        video, clock = server.compositor.surfaces
+        # simulated from the monotonic time the layout uses when it is not given one
+        now = time.monotonic()
+        end = now + seconds
+        layout = Layout(server)
+        first = Framebuffer(layout, 1920, 1080, refreshes[0])
+        second = Framebuffer(layout, 2560, 1440, refreshes[1], x=1920)
+        layout.add_output(first)
+        layout.add_output(second)
+        layout.place(video, 320, 180, 1280, 720)
+        layout.place(clock, 1920 + 2400, 20, 120, 40)
+        frames = 0
+        ids = iter(range(1000, 0xff000000))
+
+        class VideoFrame(wayland_server.Callback):
+            def send_done(self, callback_data):
+                nonlocal frames
+                super().send_done(callback_data)
+                frames += 1
+                layout.damage_surface(video, 0, 0, 1280, 720, now)
+                request_frame()
+
+        def request_frame():
+            callback = VideoFrame(video.display, next(ids))
+            video.display.objects[callback.obj_id] = callback
+            layout.add_frame(video, callback, now)
+        request_frame()
+        tick = now
+        start = time.perf_counter()
+        while now < end:
+            if now >= tick:
+                layout.damage_surface(clock, 0, 0, 120, 40, now)
+                tick += 1
+            timeout = layout.timeout(now)
+            now += tick - now if timeout is None else min(timeout, tick - now)
+            layout.repaint(now)
+            for c in server.clients:
+                c.out_queue.clear()
+        elapsed = time.perf_counter() - start
+        for peer in peers:
+            peer.close()
+        server.close()
+    return frames, first.rendered + second.rendered, elapsed
+
+
+def mixed_refresh(scale):
+    """ a 60Hz and a 144Hz output, repainted on one 144Hz timer and each on its own """
+    seconds = max(2, 10 * scale)
+    single_frames, single_pixels, single = show_outputs((144000, 144000), seconds)
+    frames, pixels, scheduled = show_outputs((60000, 144000), seconds)
+    return {
+        "single_timer_video_frames": single_frames,
+        "scheduled_video_frames": frames,
+        "single_timer_rendered_megapixels": single_pixels / 1e6,
+        "scheduled_rendered_megapixels": pixels / 1e6,
+        "single_timer_seconds": single,
+        "scheduled_seconds": scheduled,
+        "scheduled_speedup": single / scheduled,
+    }
+
+
+def drag_window(grabbed, seconds, windows=50):
+    """ (pixels rendered, configures sent, seconds) for a simulated drag of a window
+
+    A 1000Hz mouse moves the first of windows for the first half of the
+    run, then resizes it from its bottom right corner, over a 1920x1080
+    60Hz output.  Without a grab every motion is hit-tested against the
+    windows, repaints the whole output like the example compositor does,
+    and asks for a new size.  Time is simulated, so only the work is
+    measured.
+
+    """
+    setup = bind(0, "wl_compositor", 4, 3) + request(3, 0, struct.pack("I", 4))
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        os.environ["XDG_RUNTIME_DIR"] = runtime_dir
+        server = Display()
+        peers = connect_clients(server, windows, setup)
+        while len(server.compositor.surfaces) < windows:
+            server.handle_requests(0.1)
+        surfaces = server.compositor.surfaces
+        now = time.monotonic()
+        end = now + seconds
+        layout = Layout(server)
+        output = Framebuffer(layout, 1920, 1080)
+        layout.add_output(output)
+        for i, surface in enumerate(surfaces):
+            layout.place(surface, i * 37 % 1500, i * 23 % 700, 400, 300)
+        window = surfaces[0]
+        grabber = Grabber(layout)
+        configures = 0
+
+        def configure(width, height):
+            nonlocal configures
+            configures += 1
+            # the client answers right away, and the compositor places what it commits
+            if not grabber.committed(window, width, height):
+                x, y = layout.surfaces[window][0][:2]
+                layout.place(window, x, y, width, height)
+        layout.repaint(now)
+        x, y = 10, 10
+        serial = 1
+        grabber.motion(x, y, now)
+        grabber.pressed(window.display, serial)
+        if grabbed:
+            grabber.move(window.display, window, serial)
+        resizing = False
+        start = time.perf_counter()
+        while now < end:
+            now += 0.001
+            if not resizing and now > end - seconds / 2:
+                resizing = True
+                grabber.button(False, now)
+                serial += 1
+                grabber.pressed(window.display, serial)
+                if grabbed:
+                    grabber.resize(window.display, window, serial, BOTTOM | RIGHT, configure)
+            x += 1
+            y += 1 if x % 2 else 0
+            if not grabber.motion(x, y, now):
+                # hit-test from the top, as the example compositor does for every motion
+                for surface in reversed(surfaces):
+                    area = layout.surfaces[surface][0]
+                    if area[0] <= x < area[0] + area[2] and area[1] <= y < area[1] + area[3]:
+                        break
+                area = layout.surfaces[window][0]
+                if resizing:
+                    configure(area[2] + 1, area[3] + 1)
+                else:
+                    layout.place(window, area[0] + 1, area[1] + (1 if x % 2 else 0), area[2], area[3])
+                layout.damage(*output.area(), now=now)
+            grabber.update(now)
+            layout.repaint(now)
+            for c in server.clients:
+                c.out_queue.clear()
+        grabber.button(False, now)
+        elapsed = time.perf_counter() - start
+        for peer in peers:
+            peer.close()
+        server.close()
+    return output.rendered, configures, elapsed
+
+
+def window_drag(scale):
+    """ moving and resizing a window with an interactive grab, and by hand on every motion """
+    seconds = max(1, 4 * scale)
+    plain_pixels, plain_configures, plain = drag_window(False, seconds)
+    pixels, configures, grabbed = drag_window(True, seconds)
+    return {
+        "plain_rendered_megapixels": plain_pixels / 1e6,
+        "grabbed_rendered_megapixels": pixels / 1e6,
+        "plain_configures_per_1000_motions": plain_configures / seconds,
+        "grabbed_configures_per_1000_motions": configures / seconds,
+        "plain_seconds": plain,
+        "grabbed_seconds": grabbed,
+        "grabbed_speedup": plain / grabbed,
+    }
+
+
+def composite_scene(threaded, roundtrips):
+    """ (roundtrip latencies, scenes composited per second) while the compositor redraws a 4K scene nonstop
+
+    The scene is eight 1920x1080 client buffers.  Inline, the server
+    thread composites it after every turn of handling requests, threaded
+    it only publishes it to a scene.Renderer.
+
+    """
+    # NumPy is only needed by this benchmark
+    from wayland.scene import Layer, Renderer, Scene, shm_pixels
+    with Session() as session:
+        display = session.display
+        compositor = display.globals["wl_compositor"]
+        for i in range(8):
+            surface = compositor.create_surface()
+            surface.attach(queue_buffer(display, 1920, 1080), 0, 0)
+            surface.damage(0, 0, 1920, 1080)
+            surface.commit()
+        display.roundtrip()
+        renderer = Renderer(3840, 2160)
+        with session.lock:
+            buffers = [surface.buffer for surface in session.server.compositor.surfaces]
+        # opaque, like XRGB8888 buffers, so every scene is a full blit
+        layers = tuple(Layer(buffer, shm_pixels(buffer.pool.data, buffer.offset, buffer.width, buffer.height,
+                                                buffer.stride), i % 3 * 960, i // 3 * 540, True)
+                       for i, buffer in enumerate(buffers))
+        scene = Scene(layers, ((0, 0, 3840, 2160),))
+        composited = 0
+
+        def composite():
+            nonlocal composited
+            renderer.composite(scene)
+            composited += 1
+        samples = []
+        start = time.perf_counter()
+        with session.lock:
+            session.idle = (lambda: renderer.publish(scene)) if threaded else composite
+        for i in range(roundtrips):
+            sent = time.perf_counter()
+            display.roundtrip()
+            samples.append(time.perf_counter() - sent)
+        with session.lock:
+            session.idle = None
+        renderer.wait()
+        elapsed = time.perf_counter() - start
+        renderer.close()
+        frames = renderer.frames if threaded else composited
+        # the pool memory can only be unmapped once nothing views it
+        del layers
+        scene = None
+    return samples, frames / elapsed
+
+
+def render_thread(scale):
+    """ request latency while compositing a large scene, inline and on a render thread """
+    require_numpy()
+    roundtrips = max(20, int(200 * scale))
+    inline, inline_frames = composite_scene(False, roundtrips)
+    threaded, threaded_frames = composite_scene(True, roundtrips)
+    inline = timings(inline)
+    threaded = timings(threaded)
+    return {
+        "inline_roundtrip_median_us": inline["median_us"],
+        "inline_roundtrip_p99_us": inline["p99_us"],
+        "threaded_roundtrip_median_us": threaded["median_us"],
+        "threaded_roundtrip_p99_us": threaded["p99_us"],
+        "inline_scenes_per_second": inline_frames,
+        "threaded_scenes_per_second": threaded_frames,
+        "threaded_latency_speedup": inline["median_us"] / threaded["median_us"],
+    }
+
+
+def tile_scaling(scale):
+    """ compositing 20 surfaces on a 4K output, its tiles split over 1, 2, 4 and 8 threads """
+    # NumPy is only needed by this benchmark
+    require_numpy()
+    import numpy
+    from wayland.scene import Layer, Renderer, Scene
+    frames = max(3, int(30 * scale))
+    random = numpy.random.default_rng(0)
+    layers = []
+    for i in range(20):
+        width, height = 640 + i * 97 % 1280, 360 + i * 53 % 720
+        pixels = random.integers(0, 256, (height, width, 4), dtype=numpy.uint8)
+        opaque = i % 2 == 0
+        if not opaque:
+            # ARGB8888 is premultiplied
+            pixels[..., :3] = pixels[..., :3] * (pixels[..., 3:4] / 255)
+        layers.append(Layer(None, pixels, i * 173 % (3840 - width), i * 101 % (2160 - height), opaque))
+    scene = Scene(tuple(layers), ((0, 0, 3840, 2160),))
+    results = {}
+    for threads in (1, 2, 4, 8):
+        with ThreadPoolExecutor(threads) as executor:
+            renderer = Renderer(3840, 2160, executor)
+            start = time.perf_counter()
+            for frame in range(frames):
+                renderer.composite(scene)
+            elapsed = time.perf_counter() - start
+            renderer.close()
+        results["threads_{}_frames_per_second".format(threads)] = frames / elapsed
+    for threads in (2, 4, 8):
+        results["threads_{}_speedup".format(threads)] = (results["threads_{}_frames_per_second".format(threads)] /
+                                                         results["threads_1_frames_per_second"])
+    return results
+
+
+BENCHMARKS = {
+    "roundtrip": roundtrip,
+    "commit_cycle": commit_cycle,
+    "pointer_flood": pointer_flood,
+    "pointer_decode": pointer_decode,
+    "shm_commit": shm_commit,
+    "startup": startup,
+    "first_frame": first_frame,
+    "replay": replay,
+    "busy_clients": busy_clients,
+    "broadcast": broadcast,
+    "hotplug": hotplug,
+    "mixed_refresh": mixed_refresh,
+    "widget_frames": widget_frames,
+    "subsurface_frames": subsurface_frames,
+    "resize_storm": resize_storm,
+    "window_drag": window_drag,
+    "render_thread": render_thread,
+    "tile_scaling": tile_scaling,
+}
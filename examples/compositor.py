@@ -1,24 +1,83 @@
 import pygame
-from wayland import server
+from wayland import server, output, grab, scene
+from wayland.configure import Configurer
+from wayland.coalesce import add_damage
 import time
-import numpy
 import mmap
 import sys
 from xkbcommon import xkb
 import os
 
 
+class Layout(output.Layout):
+    """ keeps the position of the surfaces it places in their x and y
+
+    Damage goes in the next scene published, and reaches the outputs once
+    the renderer has drawn it.
+
+    """
+    def __init__(self, display):
+        super().__init__(display)
+        self.scene_damage = []
+
+    def place(self, surface, x, y, width, height):
+        surface.x = x
+        surface.y = y
+        super().place(surface, x, y, width, height)
+
+    def damage(self, x, y, width, height, now=None):
+        with self.lock:
+            add_damage(self.scene_damage, (x, y, width, height), output.Output.max_rectangles)
+
+
+class Renderer(scene.Renderer):
+    """ keeps the damage of the scenes drawn, for the outputs to show """
+    def __init__(self, width, height):
+        super().__init__(width, height)
+        self.drawn = []
+
+    def presented(self, scene):
+        with self.condition:
+            self.drawn.extend(scene.damage)
+
+    def take_drawn(self):
+        with self.condition:
+            drawn, self.drawn = self.drawn, []
+        return drawn
+
+    def release_unused(self, buffer):
+        """ release a buffer replaced before any scene showed it """
+        with self.condition:
+            if buffer not in self.users:
+                self.release(buffer)
+
+
 class Display(server.Display):
-    def __init__(self):
-        self.screen = pygame.display.set_mode((800, 600))
+    def __init__(self, modes):
+        # the outputs side by side in one window, modes are (width, height, refresh)
+        width, height = sum(mode[0] for mode in modes), max(mode[1] for mode in modes)
+        self.screen = pygame.display.set_mode((width, height))
+        # composites on its own thread, shown through a view of its framebuffer
+        self.renderer = Renderer(width, height)
+        self.frame = pygame.image.frombuffer(self.renderer.framebuffer, (width, height), "BGRA")
+        self.layout = Layout(self)
+        # interactive moves and resizes
+        self.grabber = grab.Grabber(self.layout)
         self.windows = []
         self.start_time = time.time()
         self.cursor = None
+        self.hotspot_x = 0
+        self.hotspot_y = 0
         self.mx = 0
         self.my = 0
-        self.moving = None
-        super().__init__(Output(self), Compositor(self), Subcompositor(self), Shm(self), XdgShellV6(self),
-                         XdgShellV5(self), Seat(self), Shell(self))
+        self.seat = Seat(self)
+        self.data_device_manager = server.DataDeviceManager(self)
+        super().__init__(Compositor(self), Subcompositor(self), Shm(self), XdgShellV6(self),
+                         XdgShellV5(self), self.seat, Shell(self), self.data_device_manager)
+        x = 0
+        for width, height, refresh in modes:
+            self.layout.add_output(Output(self.layout, width, height, refresh, x=x))
+            x += width
         print(self.path)
         self.next_serial = 0
 
@@ -26,6 +85,42 @@ class Display(server.Display):
         self.next_serial += 1
         return self.next_serial
 
+    def cursor_area(self):
+        """ where the cursor is drawn, None if there is none """
+        cursor = self.cursor
+        if cursor is None or cursor.buffer is None:
+            return None
+        return (cursor.x + self.mx - self.hotspot_x, cursor.y + self.my - self.hotspot_y,
+                cursor.buffer.width, cursor.buffer.height)
+
+    def damage_cursor(self):
+        area = self.cursor_area()
+        if area is not None:
+            self.layout.damage(*area)
+
+    def move_pointer(self, x, y):
+        """ the pointer moved to (x, y), repainting the cursor where it was and where it is """
+        self.damage_cursor()
+        self.mx = x
+        self.my = y
+        self.damage_cursor()
+
+    def publish(self):
+        """ give the renderer the windows and cursor as they are now, with the damage since the last scene """
+        with self.layout.lock:
+            damage, self.layout.scene_damage = self.layout.scene_damage, []
+            layers = [c.layer(c.x, c.y) for c in self.windows if c.buffer is not None and c in self.layout.surfaces]
+        cursor = self.cursor_area()
+        if cursor is not None:
+            layers.append(self.cursor.layer(*cursor[:2]))
+        self.renderer.publish(scene.Scene(tuple(layers), tuple(damage)))
+
+    def show_drawn(self):
+        """ repaint the outputs where the renderer drew """
+        for rectangle in self.renderer.take_drawn():
+            for o in self.layout.outputs:
+                o.add_damage(rectangle)
+
 
 class Compositor(object):
     name = "wl_compositor"
@@ -35,7 +130,6 @@ class Compositor(object):
     def __init__(self, display):
         self.display = display
         self.surfaces = self.display.windows
-        self.last_rectangles = [(0, 0, self.display.screen.get_width(), self.display.screen.get_height())]
 
     def create_surface(self, proxy, obj_id):
         surface = Surface(proxy.display, obj_id, self)
@@ -50,30 +144,20 @@ class Compositor(object):
         proxy.surfaces = []
 
     def update(self):
-        rectangles = []
-        self.display.screen.fill((16, 32, 96))
-        for c in self.surfaces:
-            if c.surface is not None:
-                rectangles.append(pygame.draw.rect(self.display.screen, (255, 0, 0), self.display.screen.blit(c.surface, (c.x, c.y)), 1))
-            if c.frame is not None:
-                c.frame.send_done(int((time.time()-self.display.start_time)*1000))
-        if self.display.cursor is not None:
-            rectangles.append(self.display.screen.blit(self.display.cursor.surface,
-                                                       (self.display.cursor.x+self.display.mx-self.display.hotspot_x,
-                                                        self.display.cursor.y+self.display.my-self.display.hotspot_y)))
-        pygame.display.update(self.last_rectangles + rectangles)
-        self.last_rectangles = rectangles
+        pass
 
     def destroy(self, proxy):
         for c in proxy.surfaces:
             if c in self.surfaces:
                 self.surfaces.remove(c)
+            self.display.grabber.forget(c)
+            self.display.layout.remove(c)
 
 
 class Surface(server.Surface):
     def __init__(self, display, obj_id, compositor):
         super().__init__(display, obj_id)
-        self.frame = None
+        self.frames = []
         self.pending_buffer = None
         self.pending_x = 0
         self.pending_y = 0
@@ -85,45 +169,68 @@ class Surface(server.Surface):
         self.pending_input_region = None
         self.opaque_region = None
         self.input_region = None
-        self.surface = None
+        # whether attach was called since the last commit
+        self.attached = False
         self.compositor = compositor
         self.scale = 1
         self.transform = None
+        # the xdg surface or toplevel that configures it
+        self.role = None
 
     def handle_commit(self):
-        if (self.pending_buffer is not None and
-                (self.buffer is None or
-                 self.buffer.width != self.pending_buffer.width or
-                 self.buffer.height != self.pending_buffer.height or
-                 self.pending_x != 0 or self.pending_y != 0)):
-            surface = pygame.Surface((self.pending_buffer.width, self.pending_buffer.height), pygame.SRCALPHA)
-            if self.surface is not None:
-                surface.blit(self.surface, (self.pending_x, self.pending_y))
-            self.surface = surface
-        self.buffer = self.pending_buffer
+        display = self.compositor.display
+        if self is display.cursor:
+            # where it was, as its size may change
+            display.damage_cursor()
+        # the buffer is read by the renderer, which releases it once it is not drawn anymore
+        if self.attached:
+            if self.buffer is not None and self.buffer is not self.pending_buffer:
+                display.renderer.release_unused(self.buffer)
+            self.buffer = self.pending_buffer
+            self.attached = False
         self.pending_buffer = None
         self.x += self.pending_x
         self.y += self.pending_y
         self.pending_x = 0
         self.pending_y = 0
-        if self.buffer is not None:
-            pixels = pygame.surfarray.pixels3d(self.surface)
-            alpha = pygame.surfarray.pixels_alpha(self.surface)
+        if self is display.cursor:
+            display.damage_cursor()
+        elif self.buffer is None:
+            display.grabber.forget(self)
+            display.layout.remove(self)
+        else:
+            width, height = self.buffer.width, self.buffer.height
+            # the configure this commit answers, which may end a resize
+            acked = self.role.configurer.acked if self.role is not None else None
+            if not display.grabber.committed(self, width, height, acked):
+                area = (self.x, self.y, width, height)
+                entry = display.layout.surfaces.get(self)
+                if entry is None or entry[0] != area:
+                    display.layout.place(self, *area)
             for r in self.pending_damage.rectangles:
-                pixels[r[0]:r[0]+r[2], r[1]:r[1]+r[3], ::] = self.buffer.pixels[r[0]:r[0]+r[2], r[1]:r[1]+r[3], 2::-1]
-                if self.buffer.format == server.ShmProxy.ARGB8888:
-                    alpha[r[0]:r[0] + r[2], r[1]:r[1] + r[3]] = self.buffer.pixels[r[0]:r[0] + r[2], r[1]:r[1] + r[3], 3]
-                else:
-                    alpha[r[0]:r[0] + r[2], r[1]:r[1] + r[3]] = 255
-            self.buffer.send_release()
+                display.layout.damage_surface(self, *r)
+        # sent by the output showing the surface once it is repainted
+        for frame in self.frames:
+            display.layout.add_frame(self, frame)
+        self.frames = []
         self.pending_damage = Region(self.display, -1)
+        if self.role is not None:
+            self.role.configurer.commit()
+        display.publish()
+
+    def layer(self, x, y):
+        """ the buffer shown at (x, y), for a scene """
+        buffer = self.buffer
+        return scene.Layer(buffer, buffer.pixels, x, y, buffer.format == server.ShmProxy.XRGB8888)
 
     def handle_frame(self, callback):
-        self.frame = server.Callback(self.display, callback)
-        self.display.objects[callback] = self.frame
+        frame = server.Callback(self.display, callback)
+        self.display.objects[callback] = frame
+        self.frames.append(frame)
 
     def handle_attach(self, buffer, x, y):
         self.pending_buffer = buffer
+        self.attached = True
         self.pending_x = x
         self.pending_y = y
 
@@ -139,6 +246,8 @@ class Surface(server.Surface):
     def handle_destroy(self):
         if self in self.compositor.surfaces:
             self.compositor.surfaces.remove(self)
+        self.compositor.display.grabber.forget(self)
+        self.compositor.display.layout.remove(self)
 
     def handle_set_buffer_scale(self, scale):
         self.scale = scale
@@ -160,24 +269,17 @@ class Region(server.Region):
         self.display.send_delete_id(self)
 
 
-class Output(object):
-    name = "wl_output"
-    version = 1
-    proxy = server.OutputProxy
-
-    def __init__(self, display):
-        self.display = display
-
-    def setup(self, proxy):
-        proxy.width = self.display.screen.get_width()
-        proxy.height = self.display.screen.get_height()
-        proxy.send_geometry(self.display.screen.get_width(), self.display.screen.get_height(), self.display.screen.get_width(), self.display.screen.get_height(), proxy.UNKNOWN, "None", "None", proxy.NORMAL)
-
-    def update(self):
-        pass
-
-    def destroy(self, proxy):
-        pass
+class Output(output.Output):
+    """ the part of the window at the output's position in the layout """
+    def render(self, damage):
+        display = self.display
+        screen = display.screen
+        rectangles = [pygame.Rect(rectangle) for rectangle in damage]
+        for rectangle in rectangles:
+            # where nothing is drawn the framebuffer is transparent
+            screen.fill((0, 0, 0), rectangle)
+            screen.blit(display.frame, rectangle, rectangle)
+        pygame.display.update(rectangles)
 
 
 class Subcompositor(object):
@@ -255,8 +357,7 @@ class Buffer(server.Buffer):
         super().__init__(display, obj_id)
         self.pool = pool
         self.pool.buffers.append(self)
-        data = numpy.ndarray(buffer=data, offset=offset, shape=(height, width, 4), dtype=numpy.uint8)
-        self.pixels = numpy.swapaxes(data, 0, 1)
+        self.pixels = scene.shm_pixels(data, offset, width, height, stride)
         self.width = width
         self.height = height
         self.stride = stride
@@ -300,10 +401,12 @@ class XdgSurfaceV6(server.ZxdgSurfaceV6):
         self.geometry = None
 
     def handle_ack_configure(self, serial):
-        pass
+        if self.surface.role is not None:
+            self.surface.role.configurer.ack(serial)
 
     def handle_get_toplevel(self, id):
         xdg_surface = XdgToplevelV6(self.display, id, self, self.shell)
+        self.surface.role = xdg_surface
         self.display.objects[id] = xdg_surface
 
     def handle_get_popup(self, id, parent, positioner):
@@ -354,9 +457,14 @@ class XdgToplevelV6(server.ZxdgToplevelV6):
         self.surface = surface
         self.app_id = ""
         self.title = ""
-        self.send_configure(0, 0, (self.ACTIVATED,))
-        self.surface.send_configure(0)
         self.shell = shell
+        # one configure outstanding at a time, see wayland.configure
+        self.configurer = Configurer(display, self.send_state)
+        self.configurer.configure()
+
+    def send_state(self, serial, width=0, height=0, states=(server.ZxdgToplevelV6.ACTIVATED,)):
+        self.send_configure(width, height, states)
+        self.surface.send_configure(serial)
 
     def handle_set_app_id(self, app_id):
         self.app_id = app_id
@@ -365,10 +473,14 @@ class XdgToplevelV6(server.ZxdgToplevelV6):
         self.title = title
 
     def handle_destroy(self):
-        pass
+        self.surface.surface.role = None
 
     def handle_move(self, seat, serial):
-        self.shell.display.moving = self.surface.surface
+        self.shell.display.grabber.move(self.display, self.surface.surface, serial)
+
+    def handle_resize(self, seat, serial, edges):
+        self.shell.display.grabber.resize(self.display, self.surface.surface, serial, edges,
+                                          lambda width, height: self.configurer.configure(width=width, height=height))
 
 
 class XdgPopupV6(server.ZxdgPopupV6):
@@ -431,8 +543,10 @@ class XdgSurfaceV5(server.XdgSurface):
     def __init__(self, display, obj_id, surface, shell):
         super().__init__(display, obj_id)
         self.surface = surface
-        self.send_configure(0, 0, [self.ACTIVATED], 0)
         self.shell = shell
+        surface.role = self
+        self.configurer = Configurer(display, self.send_state)
+        self.configurer.configure()
         self.parent = None
         self.geometry = None
         self.old_x = 0
@@ -443,13 +557,14 @@ class XdgSurfaceV5(server.XdgSurface):
         self.app_id = ""
 
     def handle_destroy(self):
-        pass
+        self.surface.role = None
 
     def handle_resize(self, seat, serial, edges):
-        pass
+        self.shell.display.grabber.resize(self.display, self.surface, serial, edges,
+                                          lambda width, height: self.configurer.configure(width=width, height=height))
 
     def handle_move(self, seat, serial):
-        self.shell.display.moving = self.surface
+        self.shell.display.grabber.move(self.display, self.surface, serial)
 
     def handle_set_parent(self, parent):
         self.parent = parent
@@ -458,19 +573,25 @@ class XdgSurfaceV5(server.XdgSurface):
         self.geometry = x, y, width, height
 
     def handle_ack_configure(self, serial):
-        pass
+        self.configurer.ack(serial)
+
+    def send_state(self, serial, width=0, height=0, states=(server.XdgSurface.ACTIVATED,)):
+        self.send_configure(width, height, states, serial)
 
     def handle_set_maximized(self):
         self.old_x = self.surface.x
         self.old_y = self.surface.y
         self.old_width = self.surface.buffer.width
         self.old_height = self.surface.buffer.height
-        self.send_configure(self.shell.display.screen.get_width(), self.shell.display.screen.get_height(), (self.MAXIMIZED, self.ACTIVATED), 0)
-        self.surface.x = 0
-        self.surface.y = 0
+        layout = self.shell.display.layout
+        # the output the window is on, placed there at its next commit
+        x, y, width, height = next(iter(layout.outputs_of(self.surface)), layout.outputs[0]).area()
+        self.configurer.configure(width=width, height=height, states=(self.MAXIMIZED, self.ACTIVATED))
+        self.surface.x = x
+        self.surface.y = y
 
     def handle_unset_maximized(self):
-        self.send_configure(self.old_width, self.old_height, (self.ACTIVATED,), 0)
+        self.configurer.configure(width=self.old_width, height=self.old_height, states=(self.ACTIVATED,))
         self.surface.x = self.old_x
         self.surface.y = self.old_y
 
@@ -530,9 +651,12 @@ class Pointer(server.Pointer):
         del self.display.pointer
 
     def handle_set_cursor(self, serial, surface, hotspot_x, hotspot_y):
-        self.seat.display.cursor = surface
-        self.seat.display.hotspot_x = hotspot_x
-        self.seat.display.hotspot_y = hotspot_y
+        display = self.seat.display
+        display.damage_cursor()
+        display.cursor = surface
+        display.hotspot_x = hotspot_x
+        display.hotspot_y = hotspot_y
+        display.damage_cursor()
 
 
 class Keyboard(server.Keyboard):
@@ -544,17 +668,16 @@ class Keyboard(server.Keyboard):
             ctx = xkb.Context()
             Keyboard.keymap = ctx.keymap_new_from_names()
         keymap = self.keymap.get_as_bytes()
-        self.fd = os.open("/tmp", os.O_RDWR | os.O_TMPFILE)
-        os.set_inheritable(self.fd, True)
+        fd = os.open("/tmp", os.O_RDWR | os.O_TMPFILE)
+        os.set_inheritable(fd, True)
         written = 0
         while written < len(keymap):
-            written += os.write(self.fd, keymap[written:])
-        self.send_keymap(self.XKB_V1, self.fd, len(keymap))
-        # os.close(self.fd)
+            written += os.write(fd, keymap[written:])
+        # closed by the display once it is sent
+        self.send_keymap(self.XKB_V1, fd, len(keymap))
         self.seat = seat
 
     def handle_release(self):
-        os.close(self.fd)
         del self.display.keyboard
 
 
@@ -591,29 +714,16 @@ class ShellSurface(server.ShellSurface):
         self.toplevel = True
 
     def handle_set_maximized(self, output):
-        self.send_configure(self.NONE, output.width, output.height)
+        x, y, width, height = output.output.area()
+        self.send_configure(self.NONE, width, height)
+        self.surface.x = x
+        self.surface.y = y
 
     def handle_set_title(self, title):
         self.title = title
 
 
-class DataDeviceManager(object):
-    name = "wl_data_device_manager"
-    version = 1
-    proxy = server.DataDeviceManagerProxy
-
-    def __init__(self, display):
-        self.display = display
-
-    def setup(self, proxy):
-        pass
-
-    def update(self):
-        pass
-
-    def destroy(self, proxy):
-        pass
-
+poll = 0.01
 
 keys = {pygame.K_UP: 103, pygame.K_DOWN: 108, pygame.K_RIGHT: 106, pygame.K_LEFT: 105, pygame.K_SPACE: 57,
         pygame.K_PERIOD: 52, pygame.K_COMMA: 51, pygame.K_SLASH: 53, pygame.K_LSHIFT: 34, pygame.K_RSHIFT: 46,
@@ -624,11 +734,15 @@ for key, code in zip("qwertyuiopasdfghjklzxcvbnm", range(16, 50)):
 
 
 def main():
-    display = Display()
+    # an output per argument, e.g. 1280x720 800x600@144, refresh in Hz
+    modes = []
+    for argument in sys.argv[1:] or ["800x600"]:
+        size, _, refresh = argument.partition("@")
+        width, height = size.split("x")
+        modes.append((int(width), int(height), int(float(refresh or 60) * 1000)))
+    display = Display(modes)
     buttons = [0, 272, 274, 273]
     try:
-        last_time = 0.0
-        last_button_down = 0, 0
         last_window = None
         while True:
             for event in pygame.event.get():
@@ -638,15 +752,23 @@ def main():
                     sys.exit()
                 elif event.type == pygame.MOUSEMOTION:
                     x, y = event.pos
-                    display.mx = x
-                    display.my = y
-                    if display.moving is not None:
-                        lx, ly = last_button_down
-                        last_button_down = x, y
-                        display.moving.x += x - lx
-                        display.moving.y += y - ly
+                    display.move_pointer(x, y)
+                    # a window being moved or resized takes the pointer
+                    if display.grabber.motion(x, y):
+                        continue
+                    if display.data_device_manager.drags:
+                        target = None
+                        for c in display.windows:
+                            if c.buffer is not None and c.x <= x < c.x + c.buffer.width and c.y <= y < c.y + c.buffer.height:
+                                target = c
+                                break
+                        if target is None:
+                            display.data_device_manager.drag_motion(display.seat, None, 0, 0, 0)
+                        else:
+                            display.data_device_manager.drag_motion(display.seat, target, x - target.x, y - target.y,
+                                                                    int((time.time()-display.start_time)*1000))
                         continue
-                    elif last_window is not None:
+                    if last_window is not None:
                         if last_window.buffer is not None and hasattr(last_window.display, "pointer") and last_window.x <= x < last_window.x + last_window.buffer.width and last_window.y <= y < last_window.y + last_window.buffer.height:
                             last_window.display.pointer.send_motion(time.time()-display.start_time, (x-c.x)*256, (y-c.y)*256)
                             continue
@@ -664,7 +786,9 @@ def main():
                             break
                 elif event.type == pygame.MOUSEBUTTONUP:
                     x, y = event.pos
-                    display.moving = None
+                    if display.grabber.button(False):
+                        continue
+                    display.data_device_manager.drag_drop(display.seat)
                     for c in display.windows:
                         if c.buffer is not None and hasattr(c.display, "pointer") and c.x <= x < c.x + c.buffer.width and c.y <= y < c.y + c.buffer.height:
                             # print("Detected Motion!")
@@ -672,23 +796,33 @@ def main():
                             break
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     x, y = event.pos
-                    last_button_down = x, y
+                    if display.grabber.button(True):
+                        continue
                     for c in display.windows:
                         if c.buffer is not None and hasattr(c.display, "pointer") and c.x <= x < c.x + c.buffer.width and c.y <= y < c.y + c.buffer.height:
                             # print("Detected Button!")
-                            c.display.pointer.send_button(display.serial(), time.time()-display.start_time, buttons[event.button], c.display.pointer.PRESSED)
+                            serial = display.serial()
+                            c.display.pointer.send_button(serial, time.time()-display.start_time, buttons[event.button], c.display.pointer.PRESSED)
+                            # a move or resize request must name it
+                            display.grabber.pressed(c.display, serial)
+                            break
                 elif event.type == pygame.KEYDOWN:
                     if last_window is not None and hasattr(last_window.display, "keyboard") and last_window.display.keyboard is not None:
                         last_window.display.keyboard.send_key(display.serial(), time.time()-display.start_time, keys[event.key], Keyboard.PRESSED)
                 elif event.type == pygame.KEYUP:
                     if last_window is not None and hasattr(last_window.display, "keyboard") and last_window.display.keyboard is not None:
                         last_window.display.keyboard.send_key(display.serial(), time.time()-display.start_time, keys[event.key], Keyboard.RELEASED)
-            display.handle_requests()
-            if time.time() - last_time > 0.05:
-                for o in display.global_objects:
-                    o.update()
-                last_time = time.time()
+            # pygame events are polled at least every poll seconds
+            timeouts = [t for t in (display.layout.timeout(), display.grabber.timeout()) if t is not None]
+            display.handle_requests(min(timeouts + [poll]))
+            display.grabber.update()
+            # the damage of pointer motion and grabs, commits publish their own scenes
+            if display.layout.scene_damage:
+                display.publish()
+            display.show_drawn()
+            display.layout.repaint()
     finally:
+        display.renderer.close()
         import os
         os.remove(display.path)
 
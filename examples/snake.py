@@ -103,50 +103,33 @@ class Snake(object):
                 print(keysym)
 
     def setup_wayland(self):
-        self.display = client.Display("wayland-0")
-        compositor = self.display.globals["wl_compositor"]
-        shell = self.display.globals["zxdg_shell_v6"]
+        # the window is created and configured while connecting, see client.Display
+        self.display = client.Display("wayland-0", needs=("wl_compositor", "zxdg_shell_v6", "wl_seat", "wl_shm"),
+                                      setup=self.create_window)
         seat = self.display.globals["wl_seat"]
         self.shm = self.display.globals["wl_shm"]
-        output = self.display.globals["wl_output"]
-        self.display.roundtrip()
-        '''for obj in self.display.objects.values():
-            if isinstance(obj, client.Seat):
-                seat = obj
-            elif isinstance(obj, client.Shm):
-                shm = obj
-            elif isinstance(obj, client.Compositor):
-                compositor = obj
-            elif isinstance(obj, client.Shell):
-                shell = obj
-        if compositor is None:
-            raise Exception("No Compositor")
-        elif shell is None:
-            raise Exception("No Shell")
-        elif seat is None:
-            raise Exception("No Input seat")
-        elif shm is None:
-            raise Exception("Shared Memory is unavailible")'''
         if self.shm.ARGB8888 not in self.shm.available:
             raise Exception("Shared Memory Format is unavailible")
-        self.surface = compositor.create_surface()
-        self.surface.set_buffer_scale(1)
-        self.shell_surface = shell.get_xdg_surface(self.surface)
-        toplevel = self.shell_surface.get_toplevel()
-        toplevel.set_maximized()
-        toplevel.handle_configure = self.resize
-        self.display.roundtrip()
         print(self.width, self.height)
         self.path = tempfile.mktemp("dat", "win")
         self.data_file = open(self.path, "wb+")
         self.fd = self.data_file.fileno()
-        self.pool = self.shm.create_pool(self.fd, self.width*self.height*400)
+        self.pool = self.shm.create_pool(client.keep(self.fd), self.width*self.height*400)
         self.buffer = self.pool.create_buffer(0, self.width*10, self.height*10, self.width*40, self.shm.ARGB8888)
         self.pixels = numpy.memmap(self.path, shape=(self.height*10, self.width*10, 4))
-        self.display.roundtrip()
         seat.handle_button = lambda *args: self.quit()
         seat.handle_key = self.handle_key
 
+    def create_window(self, display):
+        self.surface = display.globals["wl_compositor"].create_surface()
+        self.surface.set_buffer_scale(1)
+        self.shell_surface = display.globals["zxdg_shell_v6"].get_xdg_surface(self.surface)
+        toplevel = self.shell_surface.get_toplevel()
+        toplevel.set_maximized()
+        toplevel.handle_configure = self.resize
+        # the first commit, without a buffer, asks for the first configure
+        self.surface.commit()
+
     def quit(self):
         self.buffer.destroy()
         self.surface.destroy()
@@ -0,0 +1,275 @@
+"""
+    The output arena of a connection.
+
+    The messages a client.Display or a server.Client sends are packed one
+    after the other into a bytearray the connection keeps reusing.  The
+    generated request and event methods write fixed size messages straight
+    into it with struct.pack_into, and flushing sends the packed bytes with
+    one sendmsg per run of messages, starting a new one only at a message
+    that carries fds.
+"""
+
+import struct
+import threading
+from collections import deque
+
+from . import protocol
+
+HEADER = struct.Struct("II")
+
+
+def message_struct(signature):
+    """ (Struct, object argument indexes, fixed argument indexes) of a signature, or None
+
+    None if the message has strings or arrays, whose size is only known
+    once they are encoded.  fd arguments do not go in the message.
+
+    """
+    codes = protocol.argument_types(signature).replace("h", "")
+    if "s" in codes or "a" in codes:
+        return None
+    packer = struct.Struct("II" + "".join("I" if code in "uon" else "i" for code in codes))
+    objects = tuple(i for i, code in enumerate(codes) if code == "o")
+    fixed = tuple(i for i, code in enumerate(codes) if code == "f")
+    return packer, objects, fixed
+
+
+def message_structs(cls):
+    """ the message_struct of every message objects of cls send, by opcode
+
+    Client classes list the requests they send in requests, server ones
+    the events, so either is matched against both directions of protocol.
+
+    """
+    structs = cls.__dict__.get("message_structs")
+    if structs is None:
+        structs = ()
+        for messages in protocol.interfaces.get(getattr(cls, "interface", None), ()):
+            if [name for name, signature in messages] == list(cls.requests):
+                structs = tuple(message_struct(signature) for name, signature in messages)
+        cls.message_structs = structs
+    return structs
+
+
+class Arena(object):
+    """ the packed messages of a connection that were not sent yet
+
+    The bytes from start to end are still to be sent.  fds holds the
+    offset of every queued message carrying fds along with them, since
+    they have to be sent with its first byte.  head is the offset of a
+    message known to start there, from which the others can be found,
+    and count is the number of messages starting after it, which are
+    still wholly to be sent.
+    Any thread may queue messages while another flushes: lock guards the
+    offsets, and the buffer is replaced rather than moved in place, so
+    bytes being sent stay put.
+
+    """
+    def __init__(self, size=4096):
+        self.lock = threading.Lock()
+        self.buffer = bytearray(size)
+        self.start = 0
+        self.end = 0
+        self.head = 0
+        self.count = 0
+        self.fds = deque()
+        # bytes sent so far
+        self.sent = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __bool__(self):
+        return self.end != self.start
+
+    def pack(self, obj, opcode, *args):
+        """ queue message opcode of obj, packing it in place if its size is fixed """
+        structs = type(obj).__dict__.get("message_structs")
+        if structs is None:
+            structs = message_structs(type(obj))
+        entry = structs[opcode] if opcode < len(structs) else None
+        if entry is None:
+            return self.write(obj.pack_arguments(opcode, *args))
+        packer, objects, fixed = entry
+        if objects or fixed:
+            args = list(args)
+            for i in objects:
+                argument = args[i]
+                if argument is None:
+                    args[i] = 0
+                elif not isinstance(argument, int):
+                    args[i] = argument.obj_id
+            for i in fixed:
+                # ints are taken as already fixed point, like pack_arguments does
+                if type(args[i]) is float:
+                    args[i] = int(args[i] * 256)
+        size = packer.size
+        with self.lock:
+            end = self.end
+            if end + size > len(self.buffer):
+                self.grow(size)
+                end = self.end
+            try:
+                packer.pack_into(self.buffer, end, obj.obj_id, size << 16 | opcode, *args)
+            except struct.error:
+                # out of range or not ints: let pack_arguments convert them as it always did
+                pass
+            else:
+                self.end = end + size
+                self.count += 1
+                return
+        self.write(obj.pack_arguments(opcode, *args))
+
+    def write(self, data, fds=()):
+        """ queue a packed message, and the fds that go with it
+
+        data is one whole message, as it is counted as one.
+
+        """
+        size = len(data)
+        with self.lock:
+            end = self.end
+            if end + size > len(self.buffer):
+                self.grow(size)
+                end = self.end
+            self.buffer[end:end+size] = data
+            if fds:
+                self.fds.append((end, tuple(fds)))
+            self.end = end + size
+            self.count += 1
+
+    def append(self, message):
+        """ queue a (data, fds) pair, like out_queue did when it was a list """
+        self.write(*message)
+
+    def grow(self, size):
+        """ make room for size more bytes, with the lock held
+
+        The unsent bytes move to the front of a new buffer, twice as large
+        if they would not leave room otherwise.
+
+        """
+        start = self.start
+        head = self.first_message()
+        capacity = len(self.buffer)
+        while capacity < self.end - start + size:
+            capacity *= 2
+        buffer = bytearray(capacity)
+        buffer[:self.end-start] = memoryview(self.buffer)[start:self.end]
+        self.buffer = buffer
+        self.fds = deque((offset - start, fds) for offset, fds in self.fds)
+        self.head = head - start
+        self.end -= start
+        self.start = 0
+
+    def first_message(self):
+        """ the offset of the first queued message that was not partly sent, with the lock held """
+        offset = self.head
+        while offset < self.start:
+            offset += HEADER.unpack_from(self.buffer, offset)[1] >> 16
+            self.count -= 1
+        self.head = offset
+        return offset
+
+    def partly_sent(self):
+        """ whether the first bytes queued are the end of a message that was cut """
+        with self.lock:
+            return self.first_message() > self.start
+
+    def segment(self):
+        """ the bytes to send next and the fds to send with them
+
+        That is up to the next message carrying fds, or with the fds of
+        the first message up to the one after.
+
+        """
+        with self.lock:
+            end = self.end
+            fds = ()
+            if self.fds:
+                offset, attached = self.fds[0]
+                if offset == self.start:
+                    fds = attached
+                    if len(self.fds) > 1:
+                        end = self.fds[1][0]
+                else:
+                    end = offset
+            return memoryview(self.buffer)[self.start:end], fds
+
+    def consume(self, count):
+        """ drop count bytes sent from the front, the fds of the first went with them """
+        with self.lock:
+            if count and self.fds and self.fds[0][0] == self.start:
+                self.fds.popleft()
+            self.start += count
+            self.sent += count
+            if self.start == self.end:
+                self.start = self.end = self.head = self.count = 0
+            else:
+                self.first_message()
+
+    def pending(self):
+        """ the unsent bytes, and the (offset in them, fds) of the messages with fds """
+        with self.lock:
+            return bytes(self.buffer[self.start:self.end]), [(offset - self.start, fds) for offset, fds in self.fds]
+
+    def queued_fds(self):
+        """ the fds of every queued message, in order """
+        with self.lock:
+            return [fd for offset, fds in self.fds for fd in fds]
+
+    def messages(self):
+        """ (offset, size, fds) of every queued message that was not partly sent, with the lock held """
+        attached = dict(self.fds)
+        offset = self.first_message()
+        messages = []
+        while offset < self.end:
+            size = HEADER.unpack_from(self.buffer, offset)[1] >> 16
+            messages.append((offset, size, attached.get(offset, ())))
+            offset += size
+        return messages
+
+    def drop(self, choose):
+        """ drop some of the queued messages, returning the fds they carried
+
+        choose is given the list of messages, and the buffer to read them
+        from, and returns the offsets of those to drop.  It is called with
+        the lock held, so it must not queue anything.  The end of a
+        partly sent message is always kept.
+
+        """
+        with self.lock:
+            messages = self.messages()
+            dropped = set(choose(messages, self.buffer))
+            if not dropped:
+                return []
+            first = self.first_message()
+            buffer = bytearray(len(self.buffer))
+            view = memoryview(self.buffer)
+            end = first - self.start
+            buffer[:end] = view[self.start:first]
+            fds = deque()
+            released = []
+            for offset, size, attached in messages:
+                if offset in dropped:
+                    released.append(attached)
+                    continue
+                if attached:
+                    fds.append((end, attached))
+                buffer[end:end+size] = view[offset:offset+size]
+                end += size
+            self.head = first - self.start
+            self.count -= len(released)
+            self.buffer = buffer
+            self.fds = fds
+            self.start = 0
+            self.end = end
+            return released
+
+    def clear(self):
+        """ drop every queued byte, returning the fds that were to go with them """
+        with self.lock:
+            released = [fds for offset, fds in self.fds]
+            self.fds = deque()
+            self.start = self.end = self.head = self.count = 0
+            return released
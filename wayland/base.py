@@ -1,11 +1,257 @@
+import os
+import dis
 import struct
+import inspect
+
+from . import protocol
+
+
+def does_nothing(function):
+    """ whether function only returns None, like the generated handlers whose body is pass """
+    code = getattr(function, "__code__", None)
+    if code is None or code.co_flags & (inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR):
+        return False
+    instructions = [(i.opname, i.argval) for i in dis.get_instructions(code) if i.opname not in ("RESUME", "NOP")]
+    return instructions in ([("LOAD_CONST", None), ("RETURN_VALUE", None)], [("RETURN_CONST", None)])
+
+
+def ignored(*args):
+    """ stands in for handlers that do nothing, their messages are dropped undecoded """
+
+
+class Fd(int):
+    """ a file descriptor passed over a connection
+
+    Whoever owns an fd closes it.  The library owns the fds queued with a
+    request or an event, and closes them once the kernel has them, and the
+    received fds no handler was given.  A handler owns the fds it is given.
+    To send an fd and go on using it, queue keep(fd) instead.
+
+    """
+    # whether the library closes it once it is sent
+    owned = True
+    closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.close(self)
+
+
+def keep(fd):
+    """ fd, to be sent without handing it over: the caller still closes it """
+    fd = Fd(fd)
+    fd.owned = False
+    return fd
+
+
+def release_fds(fds):
+    """ close those of fds the library owns, returning how many it closed """
+    closed = 0
+    for fd in fds:
+        if type(fd) is not Fd:
+            fd = Fd(fd)
+        if fd.owned and not fd.closed:
+            fd.close()
+            closed += 1
+    return closed
+
+
+def discard_fds(interface, direction, op, fds):
+    """ close the fds a dropped message carried, from the front of fds
+
+    Returns how many were closed.
+
+    """
+    entry = protocol.message(interface, direction, op)
+    count = protocol.count_fds(entry[1]) if entry else 0
+    dropped = fds[:count]
+    del fds[:count]
+    return release_fds(dropped)
+
+
+def take_fds(interface, direction, op, fds):
+    """ remove the fds of one message from the front of fds """
+    entry = protocol.message(interface, direction, op)
+    count = protocol.count_fds(entry[1]) if entry else 0
+    taken = fds[:count]
+    del fds[:count]
+    return taken
+
+
+def lazy(function):
+    """ make a handler take one Event instead of the decoded arguments
+
+    On the client the arguments are then only decoded if the handler reads
+    them, e.g. a pointer that ignores most motion:
+
+        @lazy
+        def handle_motion(self, event):
+            if self.dragging:
+                self.move(event.surface_x, event.surface_y)
+
+    """
+    function.lazy = True
+    return function
+
+
+class Event(object):
+    """ the arguments of a message, decoded on first access
+
+    Arguments are read by position from args or by the parameter names of
+    the handler the lazy one overrides.
+
+    """
+    def __init__(self, names, args=None, obj=None, op=None, data=None, fds=None):
+        self.names = names
+        self.decoded = args
+        self.obj = obj
+        self.op = op
+        self.data = data
+        self.fds = fds
+
+    @property
+    def args(self):
+        if self.decoded is None:
+            # client objects unpack to (obj, op, args)
+            self.decoded = tuple(self.obj.unpack_event(self.op, self.data, self.fds)[2])
+            self.obj = self.data = self.fds = None
+        return self.decoded
+
+    def __getattr__(self, name):
+        try:
+            index = self.names.index(name)
+        except ValueError:
+            raise AttributeError(name) from None
+        return self.args[index]
+
+    def __repr__(self):
+        return "Event({})".format(", ".join("{}={!r}".format(n, a) for n, a in zip(self.names, self.args)))
+
+
+class LazyHandler(object):
+    """ a bound lazy handler in a handlers tuple """
+    def __init__(self, handler, names):
+        self.handler = handler
+        self.names = names
+
+    def __call__(self, *args):
+        if len(args) == 1 and type(args[0]) is Event:
+            event = args[0]
+            try:
+                return self.handler(event)
+            finally:
+                if event.fds:
+                    # never decoded, so no handler was given them
+                    event.obj.display.closed_fds += release_fds(event.fds)
+        # decoded by a connection that does not know about lazy handlers
+        return self.handler(Event(self.names, args))
+
+
+def argument_names(cls, name):
+    """ the parameter names of the nearest handler called name that is not lazy """
+    for klass in cls.__mro__:
+        function = vars(klass).get(name)
+        if isinstance(function, Handler):
+            function = function.function
+        if function is not None and not getattr(function, "lazy", False):
+            return tuple(inspect.signature(function).parameters)[1:]
+    return ()
+
+
+class Handler(object):
+    """ a handle_* method of a WaylandObject subclass
+
+    Every object dispatches through a tuple of its bound handlers, indexed
+    by opcode and built on first use.  Handlers assigned on an instance,
+    like callback.handle_done = ..., go through this descriptor so the
+    tuple can be rebuilt.
+
+    """
+    def __init__(self, function):
+        self.function = function
+        self.name = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self.function
+        if self.name in obj.__dict__:
+            return obj.__dict__[self.name]
+        return self.function.__get__(obj, objtype)
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+        obj.__dict__.pop("handlers", None)
+
+    def __delete__(self, obj):
+        del obj.__dict__[self.name]
+        obj.__dict__.pop("handlers", None)
+
+
+def noop_handlers(cls):
+    """ the names of the handlers of cls that do nothing and may be skipped
+
+    Messages creating objects are always decoded, since unpack_event makes
+    the new object.  So are those of interfaces protocol does not know.
+
+    """
+    signatures = {}
+    for messages in protocol.interfaces.get(getattr(cls, "interface", None), ()):
+        if [name for name, signature in messages] == list(cls.events):
+            signatures = dict(messages)
+    return frozenset("handle_" + name for name, signature in signatures.items()
+                     if "n" not in signature and does_nothing(getattr(cls, "handle_" + name, None)))
 
 
 class WaylandObject(object):
+    # bound handlers by opcode, see bind_handlers
+    handlers = None
+    # client.EventQueue receiving the events, None for the default one
+    queue = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, value in list(vars(cls).items()):
+            if name.startswith("handle_") and inspect.isfunction(value):
+                setattr(cls, name, Handler(value))
+
     def __init__(self, display, obj_id):
         self.display = display
         self.obj_id = obj_id
 
+    def bind_handlers(self):
+        """ build the tuple of bound handlers, indexed by incoming opcode
+
+        Handlers the class leaves doing nothing are replaced by ignored, and
+        decode drops their messages without unpacking them.  A traced object
+        has its own unpack_event and sees every message decoded.
+
+        """
+        cls = type(self)
+        noops = cls.__dict__.get("noop_handlers")
+        if noops is None:
+            noops = cls.noop_handlers = noop_handlers(cls)
+        traced = "unpack_event" in self.__dict__
+        handlers = []
+        for name in self.events:
+            name = "handle_" + name
+            handler = getattr(self, name, None)
+            if handler is None:
+                # resolved on every call, so it fails like a missing method would
+                def handler(*args, name=name):
+                    return getattr(self, name)(*args)
+            elif getattr(handler, "lazy", False):
+                handler = LazyHandler(handler, argument_names(cls, name))
+            elif name in noops and not traced and name not in self.__dict__:
+                handler = ignored
+            handlers.append(handler)
+        self.handlers = tuple(handlers)
+        return self.handlers
+
     def unpack_event(self, op, data, fds):
         return self, op, data
 
@@ -15,7 +261,7 @@ class WaylandObject(object):
             if isinstance(argument, WaylandObject):
                 argument = argument.obj_id
             if isinstance(argument, int):
-                message += struct.pack("i", argument)
+                message += struct.pack("I", argument & 0xffffffff)
             elif isinstance(argument, float):
                 message += struct.pack("i", int(argument*256))
             elif isinstance(argument, str):
@@ -0,0 +1,392 @@
+"""
+    Wire capture of a wayland connection, and replay of captured sessions.
+
+    A Recorder attached to a client Display or a server Client appends every
+    chunk of bytes the connection receives or sends to a capture file, with
+    the connection it crossed, the time since recording started and the
+    type and size of every fd that came with it.  The chunks are stored exactly as they crossed the socket,
+    so replaying them runs the decoder on the same input as the original
+    session.
+
+    Usage: python -m wayland.capture info FILE
+           python -m wayland.capture serve FILE [DISPLAY] [--speed SPEED] [--connection N]
+"""
+
+import os
+import sys
+import stat
+import time
+import array
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+
+from . import protocol
+
+MAGIC = b"WLCAP"
+VERSION = 2
+# magic, version, recording side
+HEADER = struct.Struct("<5sBB")
+# direction, connection, nanoseconds since the start of the recording, size, fd count
+RECORD = struct.Struct("<BIQIH")
+# version 1 captures held a single connection
+RECORD_V1 = struct.Struct("<BQIH")
+# st_mode and st_size of a passed fd
+FD_INFO = struct.Struct("<IQ")
+
+CLIENT = 0
+SERVER = 1
+SIDES = {"client": CLIENT, "server": SERVER}
+
+RECEIVED = 0
+SENT = 1
+
+
+def fd_info(fd):
+    try:
+        info = os.fstat(fd)
+    except OSError:
+        return 0, 0
+    return info.st_mode, info.st_size
+
+
+def substitute_fd(mode, size):
+    """ a new fd standing in for a recorded one
+
+    Regular files (shm pools and keymaps) are replaced by an anonymous file of
+    the same size, anything else by /dev/null.
+
+    """
+    if stat.S_ISREG(mode):
+        if hasattr(os, "memfd_create"):
+            fd = os.memfd_create("wayland-replay", os.MFD_CLOEXEC)
+        else:
+            with tempfile.TemporaryFile() as f:
+                fd = os.dup(f.fileno())
+        os.ftruncate(fd, size)
+        return fd
+    return os.open(os.devnull, os.O_RDWR | os.O_CLOEXEC)
+
+
+class Recorder(object):
+    """ append the traffic of connections to a capture file
+
+    target is a path or a binary file object.  All connections attached to
+    one recorder must be on the same side, client or server.  Each is
+    numbered in the order it was attached.  They may be dispatched on
+    different threads, so records are written under lock.
+
+    """
+    def __init__(self, target):
+        if isinstance(target, (str, bytes, os.PathLike)):
+            self.file = open(target, "wb")
+            self.owned = True
+        else:
+            self.file = target
+            self.owned = False
+        self.side = None
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.start = time.monotonic_ns()
+
+    def attach(self, connection):
+        """ record a client.Display or a server.Client from now on
+
+        The connection's decode and flush methods are wrapped, so a
+        connection without a recorder is not slowed down.
+
+        """
+        side = SIDES[connection.side]
+        with self.lock:
+            if self.side is None:
+                self.side = side
+                self.file.write(HEADER.pack(MAGIC, VERSION, side))
+            elif self.side != side:
+                raise ValueError("a capture holds connections of one side only")
+            number = self.connections
+            self.connections += 1
+        decode = connection.decode
+        flush = connection.flush
+        recorded_fds = len(connection.incoming_fds)
+
+        def recording_decode(data):
+            nonlocal recorded_fds
+            self.write(RECEIVED, data, [fd_info(fd) for fd in connection.incoming_fds[recorded_fds:]], number)
+            decode(data)
+            recorded_fds = len(connection.incoming_fds)
+
+        def recording_flush():
+            out_queue = connection.out_queue
+            # the fds may be closed once they are sent
+            data, attached = out_queue.pending()
+            attached = [(offset, [fd_info(fd) for fd in fds]) for offset, fds in attached]
+            sent = out_queue.sent
+            result = flush()
+            sent = out_queue.sent - sent
+            # one record for each run of messages sent together, which breaks where fds were attached
+            offsets = [offset for offset, fds in attached if 0 < offset < sent]
+            fds = dict(attached)
+            for start, end in zip([0] + offsets, offsets + [sent]):
+                if end > start:
+                    self.write(SENT, data[start:end], fds.get(start, []), number)
+            return result
+
+        connection.decode = recording_decode
+        connection.flush = recording_flush
+
+    def write(self, direction, data, fds=(), connection=0):
+        record = RECORD.pack(direction, connection, time.monotonic_ns() - self.start, len(data), len(fds))
+        record += bytes(data) + b"".join(FD_INFO.pack(mode, size) for mode, size in fds)
+        with self.lock:
+            self.file.write(record)
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class Capture(object):
+    """ a recorded session
+
+    records is a list of (direction, time, data, fds, connection) tuples
+    in recording order, with time in seconds, fds as (st_mode, st_size)
+    pairs and connection the number the recorder gave the connection.
+    Directions are those seen by the recorded side.
+
+    """
+    def __init__(self, source):
+        if isinstance(source, (str, bytes, os.PathLike)):
+            with open(source, "rb") as f:
+                content = f.read()
+        else:
+            content = source.read()
+        magic, version, self.side = HEADER.unpack_from(content)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError("not a wayland capture")
+        record = RECORD if version == VERSION else RECORD_V1
+        self.records = []
+        offset = HEADER.size
+        while offset + record.size <= len(content):
+            if version == VERSION:
+                direction, connection, nanoseconds, size, fd_count = record.unpack_from(content, offset)
+            else:
+                connection = 0
+                direction, nanoseconds, size, fd_count = record.unpack_from(content, offset)
+            offset += record.size
+            data = content[offset:offset+size]
+            offset += size
+            fds = [FD_INFO.unpack_from(content, offset + i * FD_INFO.size) for i in range(fd_count)]
+            offset += fd_count * FD_INFO.size
+            if len(data) < size or offset > len(content):
+                # the recording was cut short
+                break
+            self.records.append((direction, nanoseconds / 1e9, data, fds, connection))
+
+    @property
+    def duration(self):
+        return self.records[-1][1] if self.records else 0
+
+    def from_client(self, record):
+        return (record[0] == SENT) == (self.side == CLIENT)
+
+    def connections(self):
+        """ the numbers of the recorded connections, in order """
+        return sorted({r[4] for r in self.records})
+
+    def requests(self, connection=None):
+        return [r for r in self.records if self.from_client(r) and connection in (None, r[4])]
+
+    def events(self, connection=None):
+        return [r for r in self.records if not self.from_client(r) and connection in (None, r[4])]
+
+    def messages(self, connection=None):
+        """ iterate over (from_client, time, obj_id, opcode, body) of every message, or of one connection's
+
+        The chunks of each connection are put back together on their own.
+
+        """
+        pending = {}
+        for record in self.records:
+            if connection is not None and record[4] != connection:
+                continue
+            from_client = self.from_client(record)
+            key = (record[4], from_client)
+            data = pending.get(key, b"") + record[2]
+            offset = 0
+            while offset + 8 <= len(data):
+                obj_id, sizeop = struct.unpack_from("II", data, offset)
+                size = sizeop >> 16
+                if size < 8 or offset + size > len(data):
+                    break
+                yield from_client, record[1], obj_id, sizeop & 0xffff, data[offset+8:offset+size]
+                offset += size
+            pending[key] = data[offset:]
+
+    def statistics(self):
+        """ message counts by interface.message, following object creation """
+        counts = {}
+        for connection in self.connections():
+            self.count_messages(connection, counts)
+        return counts
+
+    def count_messages(self, connection, counts):
+        # object ids are per connection
+        interfaces = {1: "wl_display"}
+        for from_client, _, obj_id, opcode, body in self.messages(connection):
+            interface = interfaces.get(obj_id, "[unknown]")
+            entry = protocol.message(interface, protocol.REQUESTS if from_client else protocol.EVENTS, opcode)
+            if entry is None:
+                name = "{}.[{}]".format(interface, opcode)
+            else:
+                name = "{}.{}".format(interface, entry[0])
+                if "n" in entry[1]:
+                    try:
+                        args = protocol.unpack_arguments(entry[1], body, [])
+                    except struct.error:
+                        args = ()
+                    new_ids = [a for c, a in zip(protocol.argument_types(entry[1]), args) if c == "n"]
+                    if new_ids and (interface, entry[0]) == ("wl_registry", "bind"):
+                        interfaces[new_ids[0]] = args[1]
+                    elif new_ids:
+                        interfaces[new_ids[0]] = protocol.new_ids.get((interface, entry[0]), "[unknown]")
+            key = ("->" if from_client else "<-", name)
+            counts[key] = counts.get(key, 0) + 1
+
+
+def wait_until(start, at, speed):
+    if speed:
+        delay = start + at / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def replay_server(display, capture, speed=None, connection=None):
+    """ feed the requests of a recorded connection to a new client of a server.Display
+
+    connection is the number of the connection in the capture, the first
+    one by default.  Requests are decoded in the chunks they were received in, as fast as
+    possible or, given a speed, at the recorded pace scaled by it.  Events
+    the server sends back are read and dropped.  Returns the server.Client
+    and our end of its connection.
+
+    """
+    if connection is None:
+        connection = min(capture.connections(), default=0)
+    requests = capture.requests(connection)
+    connection, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.setblocking(False)
+    peer.setblocking(False)
+    client = display.add_client(connection)
+    start = time.monotonic()
+    for direction, at, data, fds, number in requests:
+        wait_until(start, at, speed)
+        client.incoming_fds.extend(substitute_fd(mode, size) for mode, size in fds)
+        client.decode(data)
+        client.flush()
+        drain(peer)
+    return client, peer
+
+
+def drain(connection):
+    while True:
+        try:
+            data, ancdata, flags, address = connection.recvmsg(protocol.MAX_READ, protocol.CONTROL_SIZE)
+        except BlockingIOError:
+            return
+        close_fds(ancdata)
+        if not data:
+            return
+
+
+def close_fds(ancdata):
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+            fds = array.array("i")
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+            for fd in fds:
+                os.close(fd)
+
+
+def serve(capture, connection, speed=None, recorded=None):
+    """ play the recorded compositor to a live client on connection
+
+    recorded is the number of the connection to play in the capture, the
+    first one by default.  Each recorded event is sent once the client has sent as many bytes as it
+    had before that event in the recording, so a client making the same
+    requests sees the same session regardless of its own speed.  Stops when
+    the capture ends or the client disconnects.
+
+    """
+    if recorded is None:
+        recorded = min(capture.connections(), default=0)
+    connection.setblocking(True)
+    start = time.monotonic()
+    expected = 0
+    received = 0
+    for record in capture.records:
+        direction, at, data, fds, number = record
+        if number != recorded:
+            continue
+        if capture.from_client(record):
+            expected += len(data)
+            continue
+        while received < expected:
+            chunk, ancdata, flags, address = connection.recvmsg(protocol.MAX_READ, protocol.CONTROL_SIZE)
+            close_fds(ancdata)
+            if not chunk:
+                return
+            received += len(chunk)
+        wait_until(start, at, speed)
+        substitutes = [substitute_fd(mode, size) for mode, size in fds]
+        try:
+            connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", substitutes))]
+                               if substitutes else [])
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        finally:
+            for fd in substitutes:
+                os.close(fd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m wayland.capture")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="summarise a capture")
+    info.add_argument("file")
+    play = commands.add_parser("serve", help="play the recorded compositor to one client")
+    play.add_argument("file")
+    play.add_argument("display", nargs="?", default="wayland-replay")
+    play.add_argument("--speed", type=float, default=None, help="recorded pace multiplier, default as fast as possible")
+    play.add_argument("--connection", type=int, default=None, help="recorded connection to play, default the first")
+    args = parser.parse_args(argv)
+    capture = Capture(args.file)
+    if args.command == "info":
+        requests = capture.requests()
+        events = capture.events()
+        print("recorded on the {} side, {:.3f}s, {} connections".format(
+            "server" if capture.side == SERVER else "client", capture.duration, len(capture.connections())))
+        print("requests: {} chunks, {} bytes".format(len(requests), sum(len(r[2]) for r in requests)))
+        print("events: {} chunks, {} bytes".format(len(events), sum(len(r[2]) for r in events)))
+        for (arrow, name), count in sorted(capture.statistics().items(), key=lambda item: -item[1]):
+            print("{:8d} {} {}".format(count, arrow, name))
+    else:
+        path = os.path.join(os.getenv("XDG_RUNTIME_DIR", "/tmp"), args.display)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        print("waiting for a client on {}".format(path), file=sys.stderr)
+        try:
+            connection = listener.accept()[0]
+            serve(capture, connection, args.speed, args.connection)
+            connection.close()
+        finally:
+            listener.close()
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -28,32 +28,128 @@
 
 import os
 import socket
+import select
 import struct
 import array
-from .base import WaylandObject
+import sys
+import threading
+from collections import deque
+from . import protocol
+from .arena import Arena
+from .coalesce import Coalescer
+# keep is re-exported for clients: shm.create_pool(client.keep(fd), size)
+from .base import WaylandObject, Event, LazyHandler, Fd, keep, ignored, release_fds, discard_fds, take_fds
+from .trace import get_tracer, ignore
+from .transfer import TransferManager
 
 
 class Display(WaylandObject):
-    def __init__(self, display=None, *custom_globals):
+    """ a connection to a compositor
+
+    display is the name of the socket in XDG_RUNTIME_DIR, or an already
+    connected socket.  Events are queued as they are decoded and handled by
+    dispatch_pending, unless direct is set: then each handler runs as soon
+    as its event is decoded, and handlers must not dispatch themselves (no
+    roundtrip from inside a handler).
+
+    dispatch blocks reading the socket.  To wait in another event loop,
+    follow libwayland:
+
+        while display.prepare_read() != 0:
+            display.dispatch_pending()
+        display.flush()
+        # wait until display.get_fd() is readable, then
+        display.read_events()  # or display.cancel_read()
+        display.dispatch_pending()
+
+    Objects may be assigned to other event queues, see EventQueue.  Requests
+    can be made from any thread.
+
+    With coalesce set (True or a Coalescer), damage and other
+    double-buffered state requests are held back until the next commit and
+    merged, see wayland.coalesce.  display.coalescer counts what it saved.
+
+    Connecting takes two roundtrips: one for the globals, which are bound
+    as they are announced, and one for their first events, like the shm
+    formats.  needs lists the interfaces of the globals to bind, all the
+    known ones if None, and connecting fails if one is missing.  setup is
+    called with the display in between, so the requests a client makes
+    before its first frame, like creating its window, are answered by the
+    second roundtrip instead of more of their own:
+
+        def create_window(display):
+            surface = display.globals["wl_compositor"].create_surface()
+            toplevel = display.globals["zxdg_shell_v6"].get_xdg_surface(surface).get_toplevel()
+            toplevel.handle_configure = resize
+            surface.commit()
+        display = client.Display(needs=("wl_compositor", "wl_shm", "zxdg_shell_v6"),
+                                 setup=create_window)
+        # configured and acknowledged: attach a buffer and commit
+
+    """
+    interface = "wl_display"
+    side = "client"
+
+    def __init__(self, display=None, *custom_globals, trace=None, record=None, direct=False,
+                 coalesce=False, needs=None, setup=None):
+        self.tracer = get_tracer("client", trace)
+        self.debug = ignore if self.tracer is None else self.tracer.debug
         known_globals = (Compositor, Shell, Shm, Seat, Output, Subcompositor, DataDeviceManager, ZxdgShellV6) + custom_globals
-        self.global_templates = {c.interface: c for c in known_globals}
-        print(self.global_templates, custom_globals)
-        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
-        path = os.path.join(os.getenv("XDG_RUNTIME_DIR"), display or os.getenv("WAYLAND_DISPLAY") or "wayland-0")
-        self.connection.connect(path)
+        self.global_templates = {c.interface: c for c in known_globals if needs is None or c.interface in needs}
+        self.debug(self.global_templates, custom_globals)
+        if isinstance(display, socket.socket):
+            # an already connected socket, e.g. one end of a socketpair
+            self.connection = display
+        else:
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
+            path = os.path.join(os.getenv("XDG_RUNTIME_DIR"), display or os.getenv("WAYLAND_DISPLAY") or "wayland-0")
+            self.connection.connect(path)
         self.connected = True
+        # held from allocating a new id until the request carrying it is queued
+        self.request_lock = threading.RLock()
         self.open_ids = []
         self.ids = iter(range(1, 0xffffffff))
         WaylandObject.__init__(self, self, self.next_id())
-        self.objects = {self.obj_id: self}
+        if self.tracer is None:
+            self.objects = {self.obj_id: self}
+            self.out_queue = Arena()
+        else:
+            self.out_queue = self.tracer.queue(protocol.REQUESTS)
+            self.objects = self.tracer.objects(protocol.EVENTS, {self.obj_id: self}, self.out_queue)
+        self.coalescer = None
+        if coalesce:
+            self.coalescer = Coalescer() if coalesce is True else coalesce
+            self.coalescer.attach(self)
         self.dead_objects = []
-        self.out_queue = []
-        self.event_queue = []
+        self.default_queue = EventQueue(self)
+        self.event_queue = self.default_queue.events
+        # threads between prepare_read and read_events, the last one reads
+        self.read_lock = threading.Condition()
+        self.readers = 0
+        self.read_serial = 0
+        self.direct = direct
+        self.queue_event = self.dispatch_event if direct else self.event_queue.append
         self.incoming_fds = []
         self.previous_data = ""
+        self.read_buffer = memoryview(bytearray(protocol.MIN_READ))
+        # recvmsg calls that returned something
+        self.reads = 0
+        # fds received, sent and closed by the library, see open_fds
+        self.received_fds = 0
+        self.sent_fds = 0
+        self.closed_fds = 0
+        self.transfers = TransferManager(self)
         self.globals = {}
+        if record is not None:
+            record.attach(self)
         self.registry = self.get_registry()
-        self.dispatch()
+        self.roundtrip()
+        missing = [interface for interface in needs or () if interface not in self.globals]
+        if missing:
+            self.disconnect()
+            raise IOError("Error: the compositor has no {}".format(", ".join(missing)))
+        if setup is not None:
+            setup(self)
         self.roundtrip()
 
     def next_id(self):
@@ -61,36 +157,137 @@ class Display(WaylandObject):
             return self.open_ids.pop(0)
         return next(self.ids)
 
+    def create_queue(self):
+        return EventQueue(self)
+
     def dispatch(self):
-        self.flush()
-        while not self.event_queue:
-            self.recv()
-        self.dispatch_pending()
+        return self.dispatch_queue(self.default_queue)
 
     def dispatch_pending(self):
-        while self.event_queue:
-            obj, event, args = self.event_queue.pop(0)
-            method_name = "handle_" + obj.events[event]
-            getattr(obj, method_name)(*args)
+        """ handle the queued events, returning how many there were """
+        return self.dispatch_queue_pending(self.default_queue)
 
-    def recv(self):
+    def dispatch_queue(self, queue):
+        """ wait for events on queue, then handle them
+
+        Threads may each dispatch their own queue at the same time: the
+        events read by any of them are routed to the queues of their
+        objects.
+
+        """
+        self.flush()
+        while not queue.events:
+            if self.prepare_read(queue) != 0:
+                break
+            if self.transfers:
+                readable = self.transfers.poll(None, (self.connection,))
+            else:
+                readable = select.select((self.connection,), (), ())[0]
+            if not readable:
+                self.cancel_read()
+                continue
+            if self.read_events() != 0:
+                raise IOError("Error: the compositor closed the connection")
+            if self.direct and queue is self.default_queue:
+                break
+        return self.dispatch_queue_pending(queue)
+
+    def dispatch_queue_pending(self, queue):
+        events = queue.events
+        count = 0
+        while events:
+            obj, op, args = events.popleft()
+            (obj.handlers or obj.bind_handlers())[op](*args)
+            count += 1
+        return count
+
+    def dispatch_event(self, event):
+        obj, op, args = event
+        (obj.handlers or obj.bind_handlers())[op](*args)
+
+    def get_fd(self):
+        """ the connection's file descriptor, to wait on for events """
+        return self.connection.fileno()
+
+    def prepare_read(self, queue=None):
+        """ announce the intention to read events
+
+        Returns 0, or -1 when events are already on queue, the default one
+        if None: dispatch them and try again.  Every successful call must be
+        followed by read_events or cancel_read.
+
+        """
+        if queue is None:
+            queue = self.default_queue
+        with self.read_lock:
+            if queue.events:
+                return -1
+            self.readers += 1
+            return 0
+
+    def cancel_read(self):
+        """ give up a read announced by prepare_read """
+        with self.read_lock:
+            self.readers -= 1
+            if self.readers == 0:
+                self.read_serial += 1
+                self.read_lock.notify_all()
+
+    def read_events(self):
+        """ read and queue the events available on the socket, without blocking on it
+
+        Only the last of the threads that called prepare_read reads, the
+        others wait for it to finish.  Returns 0, or -1 once the compositor
+        has closed the connection.
+
+        """
+        with self.read_lock:
+            self.readers -= 1
+            if self.readers == 0:
+                try:
+                    # a short read means the socket is empty, no need to wait for EAGAIN
+                    while self.recv(socket.MSG_DONTWAIT):
+                        pass
+                finally:
+                    self.read_serial += 1
+                    self.read_lock.notify_all()
+            else:
+                serial = self.read_serial
+                while serial == self.read_serial:
+                    self.read_lock.wait()
+        return 0 if self.connected else -1
+
+    def recv(self, flags=0):
+        """ read from the socket once, returning whether the read filled the buffer """
+        buffer = self.read_buffer
         try:
-            fds = array.array("i")
-            data, ancdata, msg_flags, address = self.connection.recvmsg(1024, socket.CMSG_SPACE(16 * fds.itemsize))
-            for cmsg_level, cmsg_type, cmsg_data in ancdata:
-                if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
-                    fds.fromstring(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
-            self.incoming_fds.extend(fds)
-            if data:
-                self.decode(data)
+            size, fds, truncated = protocol.receive(self.connection, buffer, flags)
         except socket.error as e:
             if e.errno == 11:
-                return
+                return False
             raise
+        self.reads += 1
+        if fds:
+            self.received_fds += len(fds)
+            self.incoming_fds.extend(map(Fd, fds))
+        if truncated:
+            raise IOError("Error: more than {} fds in one read, some were lost".format(protocol.MAX_FDS))
+        if not size:
+            self.connected = False
+            return False
+        self.decode(bytes(buffer[:size]))
+        # fds sent with a partly sent flush come before the events owning
+        # them, so they are kept until they are claimed or disconnect
+        if size < len(buffer):
+            return False
+        if len(buffer) < protocol.MAX_READ:
+            self.read_buffer = memoryview(bytearray(len(buffer) * 2))
+        return True
 
     def decode(self, data):
         if self.previous_data:
             data = self.previous_data + data
+        queue_event = self.queue_event
         while len(data) >= 8:
             obj_id, sizeop = struct.unpack("II", data[:8])
             size = sizeop >> 16
@@ -99,44 +296,81 @@ class Display(WaylandObject):
             if len(data) < size:
                 break
             if obj_id in self.dead_objects:
+                if self.incoming_fds:
+                    interface = getattr(self.objects.get(obj_id), "interface", None)
+                    self.closed_fds += discard_fds(interface, protocol.EVENTS, op, self.incoming_fds)
                 data = data[size:]
                 continue
             obj = self.objects.get(obj_id, None)
             if obj is not None:
-                event = obj.unpack_event(op, data[8:size], self.incoming_fds)
-                if event is None:
-                    print("Bad object", obj, op)
-                self.event_queue.append(event)
+                handlers = obj.handlers or obj.bind_handlers()
+                handler = handlers[op] if op < len(handlers) else None
+                if handler is ignored:
+                    if self.incoming_fds:
+                        self.closed_fds += discard_fds(obj.interface, protocol.EVENTS, op, self.incoming_fds)
+                    data = data[size:]
+                    continue
+                if type(handler) is LazyHandler:
+                    fds = take_fds(obj.interface, protocol.EVENTS, op, self.incoming_fds)
+                    event = (obj, op, (Event(handler.names, None, obj, op, data[8:size], fds),))
+                else:
+                    event = obj.unpack_event(op, data[8:size], self.incoming_fds)
                 data = data[size:]
+                if event is None:
+                    self.debug("Bad object", obj, op)
+                    continue
+                if obj.queue is None:
+                    queue_event(event)
+                else:
+                    obj.queue.events.append(event)
             else:
                 raise IOError("Error: Bad object: {} {}".format(obj_id, self.objects))
         self.previous_data = data
 
     def flush(self):
-        while self.out_queue:
-            data, fds = self.out_queue.pop(0)
-            try:
-                sent = self.connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
-                while sent < len(data):
-                    sent += self.connection.send(data[sent:])
-                # for fd in fds:
-                #     os.close(fd)
-            except socket.error as e:
-                if e.errno == 11:
-                    self.out_queue.insert(0, (data, fds))
-                    break
-                raise
+        """ send the queued requests
+
+        Returns the number of bytes sent, or -1 if the socket would block
+        before all of them were: wait until it is writable and flush again.
+
+        """
+        total = 0
+        out_queue = self.out_queue
+        with self.request_lock:
+            while out_queue:
+                data, fds = out_queue.segment()
+                try:
+                    sent = self.connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+                                                   if fds else [])
+                except socket.error as e:
+                    if e.errno == 11:
+                        return -1
+                    raise
+                # the fds went with the first byte
+                out_queue.consume(sent)
+                total += sent
+                if fds:
+                    # the kernel has its own references now
+                    self.sent_fds += len(fds)
+                    self.closed_fds += release_fds(fds)
+        return total
 
     def roundtrip(self):
+        self.roundtrip_queue(self.default_queue)
+
+    def roundtrip_queue(self, queue):
+        """ wait until the compositor has handled every request so far, dispatching queue """
         ready = False
 
         def done(data):
             nonlocal ready
             ready = True
-        l = self.sync()
+        with self.request_lock:
+            l = self.sync()
+            l.queue = queue
         l.handle_done = done
         while not ready:
-            self.dispatch()
+            self.dispatch_queue(queue)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -147,8 +381,17 @@ class Display(WaylandObject):
             object_id = struct.unpack("I", data)
             return self, op, object_id
 
+    def open_fds(self):
+        """ how many fds the library holds open, received or waiting to be sent """
+        queued = sum(1 for fd in self.out_queue.queued_fds() if getattr(fd, "owned", True))
+        return len(self.incoming_fds) + queued
+
     def disconnect(self):
         self.connection.close()
+        for fds in self.out_queue.clear():
+            self.closed_fds += release_fds(fds)
+        self.closed_fds += release_fds(self.incoming_fds)
+        del self.incoming_fds[:]
 
     def sync(self):
         """ asynchronous roundtrip
@@ -166,10 +409,12 @@ class Display(WaylandObject):
         The callback_data passed in the callback is the event serial.
 
         """
-        new_id = self.display.next_id()
-        callback = Callback(self.display, new_id)
-        self.objects[new_id] = callback
-        self.display.out_queue.append((self.pack_arguments(0, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            callback = Callback(self.display, new_id)
+            callback.queue = self.queue
+            self.objects[new_id] = callback
+            self.display.out_queue.pack(self, 0, new_id)
         return callback
 
     def get_registry(self):
@@ -180,10 +425,12 @@ class Display(WaylandObject):
         compositor.
 
         """
-        new_id = self.display.next_id()
-        registry = Registry(self.display, new_id)
-        self.objects[new_id] = registry
-        self.display.out_queue.append((self.pack_arguments(1, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            registry = Registry(self.display, new_id)
+            registry.queue = self.queue
+            self.objects[new_id] = registry
+            self.display.out_queue.pack(self, 1, new_id)
         return registry
 
     def handle_error(self, object_id, code, message):
@@ -198,11 +445,9 @@ class Display(WaylandObject):
         of the error, for (debugging) convenience.
         
         """
-        print("Error {} on {} object: {}".format(code, self.objects[object_id].__class__.__name__, message))
-        print(self.objects.keys())
+        self.debug(self.objects.keys())
         self.disconnect()
-        import sys
-        sys.exit()
+        sys.exit("Error {} on {} object: {}".format(code, self.objects[object_id].__class__.__name__, message))
 
     # global error values
     INVALID_OBJECT = 0
@@ -231,7 +476,72 @@ class Display(WaylandObject):
     requests = ['sync', 'get_registry']
 
 
+class EventQueue(object):
+    """ a queue of events, like libwayland's wl_event_queue
+
+    Events of objects whose queue attribute is set to an EventQueue go to
+    it instead of the display's default queue.  Objects created by requests
+    or events of an object start on the same queue as it.  A thread handles
+    a queue with display.dispatch_queue and display.roundtrip_queue, e.g.
+    a renderer waiting for its frame callbacks:
+
+        queue = display.create_queue()
+        surface.queue = queue
+        callback = surface.frame()
+        surface.commit()
+        display.dispatch_queue(queue)
+
+    """
+    def __init__(self, display):
+        self.display = display
+        self.events = deque()
+
+
+class LatestConfigure(object):
+    """ a configure handler skipping the events a later queued one supersedes
+
+    A compositor resizing a window interactively may send configure events
+    faster than the client draws.  Objects count them as they are decoded
+    and as they are dispatched, and only the last one queued reaches the
+    application, which then reallocates its buffers once, for the latest
+    size.  A configure sequence ends with xdg_surface.configure, whose
+    serial is the one to acknowledge.
+
+    """
+    def __init__(self, obj, handler):
+        self.obj = obj
+        self.handler = handler
+
+    def __call__(self, *args):
+        obj = self.obj
+        obj.dispatched_configures += 1
+        if obj.dispatched_configures < obj.received_configures:
+            return
+        return self.handler(*args)
+
+
+class CollapsedConfigures(object):
+    """ a mixin for the xdg objects whose configure events, opcode 0, are collapsed
+
+    Set collapse_configures to False on an object, before its first event,
+    to handle every configure.  Lazy handlers see every configure too.
+
+    """
+    collapse_configures = True
+    # configure events decoded, and dispatched or skipped
+    received_configures = 0
+    dispatched_configures = 0
+
+    def bind_handlers(self):
+        handlers = super().bind_handlers()
+        handler = handlers[0]
+        if self.collapse_configures and handler is not ignored and type(handler) is not LazyHandler:
+            handlers = self.handlers = (LatestConfigure(self, handler),) + handlers[1:]
+        return handlers
+
+
 class Registry(WaylandObject):
+    interface = "wl_registry"
 
     def __init__(self, display, obj_id):
         WaylandObject.__init__(self, display, obj_id)
@@ -248,10 +558,12 @@ class Registry(WaylandObject):
         
         """
         if interface in self.display.global_templates:
-            new_id = self.display.next_id()
-            self.display.out_queue.append((self.pack_arguments(0, name, interface, version, new_id), ()))
+            with self.display.request_lock:
+                new_id = self.display.next_id()
+                self.display.out_queue.pack(self, 0, name, interface, version, new_id)
             self.global_objects[name] = new_id
             obj = self.display.global_templates[interface](self.display, new_id)
+            obj.queue = self.queue
             if interface in self.display.globals:
                 if isinstance(self.display.globals[interface], self.display.global_templates[interface]):
                     self.display.globals[interface] = [self.display.globals[interface]]
@@ -260,7 +572,7 @@ class Registry(WaylandObject):
                 self.display.globals[interface] = obj
             self.display.objects[new_id] = obj
         else:
-            print(interface, version)
+            self.display.debug(interface, version)
 
     def handle_global_remove(self, name):
         """ announce removal of global object
@@ -288,7 +600,8 @@ class Registry(WaylandObject):
                     self.display.globals[obj.interface] = self.display.globals[obj.interface][0]
             else:
                 del self.display.globals[obj.interface]
-        self.display.remove_obj(id_num)
+        # the object stays usable until it is destroyed or released
+        del self.global_objects[name]
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -305,6 +618,7 @@ class Registry(WaylandObject):
 
 
 class Callback(WaylandObject):
+    interface = "wl_callback"
 
     def handle_done(self, callback_data):
         """ done event
@@ -330,10 +644,12 @@ class Compositor(WaylandObject):
         Ask the compositor to create a new surface.
         
         """
-        new_id = self.display.next_id()
-        surface = Surface(self.display, new_id)
-        self.display.objects[new_id] = surface
-        self.display.out_queue.append((self.pack_arguments(0, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            surface = Surface(self.display, new_id)
+            surface.queue = self.queue
+            self.display.objects[new_id] = surface
+            self.display.out_queue.pack(self, 0, new_id)
         return surface
 
     def create_region(self):
@@ -342,10 +658,12 @@ class Compositor(WaylandObject):
         Ask the compositor to create a new region.
         
         """
-        new_id = self.display.next_id()
-        region = Region(self.display, new_id)
-        self.display.objects[new_id] = region
-        self.display.out_queue.append((self.pack_arguments(1, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            region = Region(self.display, new_id)
+            region.queue = self.queue
+            self.display.objects[new_id] = region
+            self.display.out_queue.pack(self, 1, new_id)
         return region
 
     events = []
@@ -353,6 +671,7 @@ class Compositor(WaylandObject):
 
 
 class ShmPool(WaylandObject):
+    interface = "wl_shm_pool"
 
     def create_buffer(self, offset, width, height, stride, format):
         """ create a buffer from the pool
@@ -370,10 +689,12 @@ class ShmPool(WaylandObject):
         a buffer from it.
         
         """
-        new_id = self.display.next_id()
-        buffer = Buffer(self.display, new_id)
-        self.display.objects[new_id] = buffer
-        self.display.out_queue.append((self.pack_arguments(0, new_id, offset, width, height, stride, format), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            buffer = Buffer(self.display, new_id)
+            buffer.queue = self.queue
+            self.display.objects[new_id] = buffer
+            self.display.out_queue.pack(self, 0, new_id, offset, width, height, stride, format)
         return buffer
 
     def destroy(self):
@@ -386,7 +707,7 @@ class ShmPool(WaylandObject):
         are gone.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1), ()))
+        self.display.out_queue.pack(self, 1)
         self.display.remove_object(self.obj_id)
 
     def resize(self, size):
@@ -398,7 +719,7 @@ class ShmPool(WaylandObject):
         used to make the pool bigger.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, size), ()))
+        self.display.out_queue.pack(self, 2, size)
 
     events = []
     requests = ['create_buffer', 'destroy', 'resize']
@@ -486,10 +807,12 @@ class Shm(WaylandObject):
         descriptor, to use as backing memory for the pool.
         
         """
-        new_id = self.display.next_id()
-        shm_pool = ShmPool(self.display, new_id)
-        self.display.objects[new_id] = shm_pool
-        self.display.out_queue.append((self.pack_arguments(0, new_id, size), (fd,)))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            shm_pool = ShmPool(self.display, new_id)
+            shm_pool.queue = self.queue
+            self.display.objects[new_id] = shm_pool
+            self.display.out_queue.write(self.pack_arguments(0, new_id, size), (fd,))
         return shm_pool
 
     def handle_format(self, format):
@@ -510,6 +833,8 @@ class Shm(WaylandObject):
 
 
 class Buffer(WaylandObject):
+    interface = "wl_buffer"
+
     def __init__(self, display, obj_id):
         WaylandObject.__init__(self, display, obj_id)
         self.busy = False
@@ -523,7 +848,7 @@ class Buffer(WaylandObject):
         For possible side-effects to a surface, see wl_surface.attach.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
         self.display.remove_object(self.obj_id)
 
     def handle_release(self):
@@ -550,11 +875,18 @@ class Buffer(WaylandObject):
 
 
 class DataOffer(WaylandObject):
+    interface = "wl_data_offer"
     INVALID_FINISH = 0
     INVALID_ACTION_MASK = 1
     INVALID_ACTION = 2
     INVALID_OFFER = 3
 
+    def __init__(self, display, obj_id):
+        WaylandObject.__init__(self, display, obj_id)
+        self.mime_types = []
+        self.source_actions = 0
+        self.action = 0
+
     def accept(self, serial, mime_type):
         """ accept one of the offered mime types
         
@@ -574,7 +906,7 @@ class DataOffer(WaylandObject):
         conjunction with wl_data_source.action for feedback.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial, mime_type), ()))
+        self.display.out_queue.pack(self, 0, serial, mime_type)
 
     def receive(self, mime_type, fd):
         """ request that the data is transferred
@@ -596,7 +928,17 @@ class DataOffer(WaylandObject):
         determine acceptance.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, mime_type), (fd,)))
+        self.display.out_queue.write(self.pack_arguments(1, mime_type), (fd,))
+
+    def fetch(self, mime_type, sink=None, callback=None):
+        """ receive the offered data without blocking
+
+        Creates the pipe for a receive request and streams its read end into
+        sink (a transfer.BufferSink by default) from the dispatch loop.  The
+        callback is called with the finished transfer.
+
+        """
+        return self.display.transfers.receive(self, mime_type, sink, callback)
 
     def destroy(self):
         """ destroy data offer
@@ -604,7 +946,7 @@ class DataOffer(WaylandObject):
         Destroy the data offer.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2), ()))
+        self.display.out_queue.pack(self, 2)
         self.display.remove_object(self.obj_id)
 
     def handle_offer(self, mime_type):
@@ -614,7 +956,7 @@ class DataOffer(WaylandObject):
         event per offered mime type.
         
         """
-        pass
+        self.mime_types.append(mime_type)
 
     def finish(self):
         """ the offer will no longer be used
@@ -632,7 +974,7 @@ class DataOffer(WaylandObject):
         wl_data_offer.action.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3), ()))
+        self.display.out_queue.pack(self, 3)
 
     def set_actions(self, dnd_actions, preferred_action):
         """ set the available/preferred drag-and-drop actions
@@ -670,7 +1012,7 @@ class DataOffer(WaylandObject):
         will be raised otherwise.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4, dnd_actions, preferred_action), ()))
+        self.display.out_queue.pack(self, 4, dnd_actions, preferred_action)
 
     def handle_source_actions(self, source_actions):
         """ notify the source-side available actions
@@ -680,7 +1022,7 @@ class DataOffer(WaylandObject):
         side changes its offered actions through wl_data_source.set_actions.
         
         """
-        pass
+        self.source_actions = source_actions
 
     def handle_action(self, dnd_action):
         """ notify the selected action
@@ -722,12 +1064,12 @@ class DataOffer(WaylandObject):
         must happen before the call to wl_data_offer.finish.
         
         """
-        pass
+        self.action = dnd_action
 
     def unpack_event(self, op, data, fds):
         if op == 0:
             length = struct.unpack("I", data[:4])[0]
-            mime = data[4:4+length].decode("utf-8")
+            mime = data[4:3+length].decode("utf-8")
             return self, op, (mime,)
         elif op == 1 or op == 2:
             return self, op, struct.unpack("I", data)
@@ -737,6 +1079,7 @@ class DataOffer(WaylandObject):
 
 
 class DataSource(WaylandObject):
+    interface = "wl_data_source"
     INVALID_ACTION_MASK = 0
     INVALID_SOURCE = 1
 
@@ -748,7 +1091,7 @@ class DataSource(WaylandObject):
         multiple types.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, mime_type), ()))
+        self.display.out_queue.pack(self, 0, mime_type)
 
     def destroy(self):
         """ destroy the data source
@@ -756,7 +1099,7 @@ class DataSource(WaylandObject):
         Destroy the data source.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1), ()))
+        self.display.out_queue.pack(self, 1)
         self.display.remove_object(self.obj_id)
 
     def handle_target(self, mime_type):
@@ -780,6 +1123,15 @@ class DataSource(WaylandObject):
         """
         pass
 
+    def serve(self, fd, data, callback=None):
+        """ write data to the fd of a send event without blocking
+
+        data may be bytes, a file object or an iterable of chunks; the fd is
+        closed once everything has been written.
+
+        """
+        return self.display.transfers.send(fd, data, callback)
+
     def handle_cancelled(self):
         """ selection was cancelled
         
@@ -825,7 +1177,7 @@ class DataSource(WaylandObject):
         for drag-and-drop will raise a protocol error.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, dnd_actions), ()))
+        self.display.out_queue.pack(self, 2, dnd_actions)
 
     def handle_dnd_drop_performed(self):
         """ the drag-and-drop operation physically finished
@@ -891,11 +1243,11 @@ class DataSource(WaylandObject):
     def unpack_event(self, op, data, fds):
         if op == 0:
             length = struct.unpack("I", data[:4])[0]
-            mime = data[4:length].decode("utf-8")
+            mime = data[4:3+length].decode("utf-8") if length else None
             return self, op, (mime,)
         elif op == 1:
             length = struct.unpack("I", data[:4])[0]
-            mime = data[4:length].decode("utf-8")
+            mime = data[4:3+length].decode("utf-8")
             return self, op, (mime, fds.pop(0))
         elif op == 2:
             return self, op, ()
@@ -911,6 +1263,7 @@ class DataSource(WaylandObject):
 
 
 class DataDevice(WaylandObject):
+    interface = "wl_data_device"
     ROLE = 0
 
     def start_drag(self, source, origin, icon, serial):
@@ -945,7 +1298,7 @@ class DataDevice(WaylandObject):
         undefined, and the wl_surface is unmapped.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, source, origin, icon, serial), ()))
+        self.display.out_queue.pack(self, 0, source, origin, icon, serial)
 
     def set_selection(self, source, serial):
         """ copy data to the selection
@@ -956,7 +1309,7 @@ class DataDevice(WaylandObject):
         To unset the selection, set the source to NULL.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, source, serial), ()))
+        self.display.out_queue.pack(self, 1, source, serial)
 
     def handle_data_offer(self, offer):
         """ introduce a new wl_data_offer
@@ -1048,28 +1401,29 @@ class DataDevice(WaylandObject):
         This request destroys the data device.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2), ()))
+        self.display.out_queue.pack(self, 2)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
             data_offer = DataOffer(self.display, struct.unpack("I", data)[0])
+            data_offer.queue = self.queue
             self.display.objects[data_offer.obj_id] = data_offer
             return self, op, (data_offer,)
         elif op == 1:
-            serial, s, x, y, o = struct.unpack("IIIII", data)
+            serial, s, x, y, o = struct.unpack("IIiiI", data)
             surface = self.display.objects[s]
-            offer = self.display.objects[o]
+            offer = self.display.objects.get(o)
             return self, op, (serial, surface, x/256, y/256, offer)
         elif op == 2:
             return self, op, ()
         elif op == 3:
-            t, x, y = struct.unpack("III", data)
+            t, x, y = struct.unpack("Iii", data)
             return self, op, (t, x/256, y/256)
         elif op == 4:
             return self, op, ()
         elif op == 5:
             offer = struct.unpack("I", data)[0]
-            return self, op, (self.display.objects[offer])
+            return self, op, (self.display.objects.get(offer),)
 
     events = ['data_offer', 'enter', 'leave', 'motion', 'drop', 'selection']
     requests = ['start_drag', 'set_selection', 'release']
@@ -1084,10 +1438,12 @@ class DataDeviceManager(WaylandObject):
         Create a new data source.
         
         """
-        new_id = self.display.next_id()
-        data_source = DataSource(self.display, new_id)
-        self.display.objects[new_id] = data_source
-        self.display.out_queue.append((self.pack_arguments(0, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            data_source = DataSource(self.display, new_id)
+            data_source.queue = self.queue
+            self.display.objects[new_id] = data_source
+            self.display.out_queue.pack(self, 0, new_id)
         return data_source
 
     def get_data_device(self, seat):
@@ -1096,10 +1452,12 @@ class DataDeviceManager(WaylandObject):
         Create a new data device for a given seat.
         
         """
-        new_id = self.display.next_id()
-        data_device = DataDevice(self.display, new_id)
-        self.display.objects[new_id] = data_device
-        self.display.out_queue.append((self.pack_arguments(1, new_id, seat), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            data_device = DataDevice(self.display, new_id)
+            data_device.queue = self.queue
+            self.display.objects[new_id] = data_device
+            self.display.out_queue.pack(self, 1, new_id, seat)
         return data_device
 
     # drag and drop actions
@@ -1127,10 +1485,12 @@ class Shell(WaylandObject):
         Only one shell surface can be associated with a given surface.
         
         """
-        new_id = self.display.next_id()
-        shell_surface = ShellSurface(self.display, new_id)
-        self.display.objects[new_id] = shell_surface
-        self.display.out_queue.append((self.pack_arguments(0, new_id, surface), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            shell_surface = ShellSurface(self.display, new_id)
+            shell_surface.queue = self.queue
+            self.display.objects[new_id] = shell_surface
+            self.display.out_queue.pack(self, 0, new_id, surface)
         return shell_surface
 
     events = []
@@ -1138,6 +1498,7 @@ class Shell(WaylandObject):
 
 
 class ShellSurface(WaylandObject):
+    interface = "wl_shell_surface"
 
     def pong(self, serial):
         """ respond to a ping event
@@ -1146,7 +1507,7 @@ class ShellSurface(WaylandObject):
         the client may be deemed unresponsive.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial), ()))
+        self.display.out_queue.pack(self, 0, serial)
 
     def move(self, seat, serial):
         """ start an interactive move
@@ -1158,7 +1519,7 @@ class ShellSurface(WaylandObject):
         the surface (e.g. fullscreen or maximized).
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, seat, serial), ()))
+        self.display.out_queue.pack(self, 1, seat, serial)
 
     # edge values for resizing
     NONE = 0
@@ -1181,7 +1542,7 @@ class ShellSurface(WaylandObject):
         the surface (e.g. fullscreen or maximized).
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, seat, serial, edges), ()))
+        self.display.out_queue.pack(self, 2, seat, serial, edges)
 
     def set_toplevel(self):
         """ make the surface a toplevel surface
@@ -1191,7 +1552,7 @@ class ShellSurface(WaylandObject):
         A toplevel surface is not fullscreen, maximized or transient.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3), ()))
+        self.display.out_queue.pack(self, 3)
 
     # details of transient behaviour
     INACTIVE = 0x1
@@ -1208,7 +1569,7 @@ class ShellSurface(WaylandObject):
         The flags argument controls details of the transient behaviour.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4, parent, x, y, flags), ()))
+        self.display.out_queue.pack(self, 4, parent, x, y, flags)
 
     # different method to set the surface fullscreen
     DEFAULT = 0
@@ -1254,7 +1615,7 @@ class ShellSurface(WaylandObject):
         be made fullscreen.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5, method, framerate, output), ()))
+        self.display.out_queue.pack(self, 5, method, framerate, output)
 
     def set_popup(self, seat, serial, parent, x, y, flags):
         """ make the surface a popup surface
@@ -1280,7 +1641,7 @@ class ShellSurface(WaylandObject):
         parent surface, in surface-local coordinates.
         
         """
-        self.display.out_queue.append((self.pack_arguments(6, seat, serial, parent, x, y, flags), ()))
+        self.display.out_queue.pack(self, 6, seat, serial, parent, x, y, flags)
 
     def set_maximized(self, output):
         """ make the surface a maximized surface
@@ -1305,7 +1666,7 @@ class ShellSurface(WaylandObject):
         The details depend on the compositor implementation.
         
         """
-        self.display.out_queue.append((self.pack_arguments(7, output), ()))
+        self.display.out_queue.pack(self, 7, output)
 
     def set_title(self, title):
         """ set surface title
@@ -1319,7 +1680,7 @@ class ShellSurface(WaylandObject):
         The string must be encoded in UTF-8.
         
         """
-        self.display.out_queue.append((self.pack_arguments(8, title), ()))
+        self.display.out_queue.pack(self, 8, title)
 
     def set_class(self, class_):
         """ set surface class
@@ -1332,7 +1693,7 @@ class ShellSurface(WaylandObject):
         the application's .desktop file as the class.
         
         """
-        self.display.out_queue.append((self.pack_arguments(9, class_), ()))
+        self.display.out_queue.pack(self, 9, class_)
 
     def handle_ping(self, serial):
         """ ping client
@@ -1390,6 +1751,8 @@ class ShellSurface(WaylandObject):
 
 
 class Surface(WaylandObject):
+    interface = "wl_surface"
+
     def __init__(self, display, obj_id):
         WaylandObject.__init__(self, display, obj_id)
         self.buffer = None
@@ -1404,7 +1767,7 @@ class Surface(WaylandObject):
         Deletes the surface and invalidates its object ID.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
         self.display.remove_object(self.obj_id)
 
     def attach(self, buffer, x, y):
@@ -1451,7 +1814,7 @@ class Surface(WaylandObject):
         following wl_surface.commit will remove the surface content.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, buffer, x, y), ()))
+        self.display.out_queue.pack(self, 1, buffer, x, y)
         self.buffer = buffer
 
     def damage(self, x, y, width, height):
@@ -1480,7 +1843,7 @@ class Surface(WaylandObject):
         and is probably the preferred and intuitive way of doing this.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 2, x, y, width, height)
 
     def frame(self):
         """ request a frame throttling hint
@@ -1519,10 +1882,12 @@ class Surface(WaylandObject):
         milliseconds, with an undefined base.
         
         """
-        new_id = self.display.next_id()
-        callback = Callback(self.display, new_id)
-        self.display.objects[new_id] = callback
-        self.display.out_queue.append((self.pack_arguments(3, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            callback = Callback(self.display, new_id)
+            callback.queue = self.queue
+            self.display.objects[new_id] = callback
+            self.display.out_queue.pack(self, 3, new_id)
         return callback
 
     def set_opaque_region(self, region):
@@ -1554,7 +1919,7 @@ class Surface(WaylandObject):
         region to be set to empty.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4, region), ()))
+        self.display.out_queue.pack(self, 4, region)
 
     def set_input_region(self, region):
         """ set input region
@@ -1583,7 +1948,7 @@ class Surface(WaylandObject):
         to infinite.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5, region), ()))
+        self.display.out_queue.pack(self, 5, region)
 
     def commit(self):
         """ commit pending surface state
@@ -1607,7 +1972,7 @@ class Surface(WaylandObject):
         Other interfaces may add further double-buffered surface state.
         
         """
-        self.display.out_queue.append((self.pack_arguments(6), ()))
+        self.display.out_queue.pack(self, 6)
 
     def handle_enter(self, output):
         """ surface enters an output
@@ -1665,7 +2030,7 @@ class Surface(WaylandObject):
         is raised.
         
         """
-        self.display.out_queue.append((self.pack_arguments(7, transform), ()))
+        self.display.out_queue.pack(self, 7, transform)
 
     def set_buffer_scale(self, scale):
         """ sets the buffer scaling factor
@@ -1695,7 +2060,7 @@ class Surface(WaylandObject):
         raised.
         
         """
-        self.display.out_queue.append((self.pack_arguments(8, scale), ()))
+        self.display.out_queue.pack(self, 8, scale)
 
     def damage_buffer(self, x, y, width, height):
         """ mark part of the surface damaged using buffer coordinates
@@ -1734,7 +2099,7 @@ class Surface(WaylandObject):
         after receiving the wl_surface.commit.
         
         """
-        self.display.out_queue.append((self.pack_arguments(9, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 9, x, y, width, height)
 
     def unpack_event(self, op, data, fds):
         return self, op, (self.display.objects[struct.unpack("I", data)[0]],)
@@ -1814,10 +2179,12 @@ class Seat(WaylandObject):
         never had the pointer capability.
         
         """
-        new_id = self.display.next_id()
-        pointer = Pointer(self.display, new_id, self)
-        self.display.objects[new_id] = pointer
-        self.display.out_queue.append((self.pack_arguments(0, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            pointer = Pointer(self.display, new_id, self)
+            pointer.queue = self.queue
+            self.display.objects[new_id] = pointer
+            self.display.out_queue.pack(self, 0, new_id)
         return pointer
 
     def get_keyboard(self):
@@ -1832,10 +2199,12 @@ class Seat(WaylandObject):
         never had the keyboard capability.
         
         """
-        new_id = self.display.next_id()
-        keyboard = Keyboard(self.display, new_id, self)
-        self.display.objects[new_id] = keyboard
-        self.display.out_queue.append((self.pack_arguments(1, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            keyboard = Keyboard(self.display, new_id, self)
+            keyboard.queue = self.queue
+            self.display.objects[new_id] = keyboard
+            self.display.out_queue.pack(self, 1, new_id)
         return keyboard
 
     def get_touch(self):
@@ -1850,10 +2219,12 @@ class Seat(WaylandObject):
         never had the touch capability.
         
         """
-        new_id = self.display.next_id()
-        touch = Touch(self.display, new_id, self)
-        self.display.objects[new_id] = touch
-        self.display.out_queue.append((self.pack_arguments(2, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            touch = Touch(self.display, new_id, self)
+            touch.queue = self.queue
+            self.display.objects[new_id] = touch
+            self.display.out_queue.pack(self, 2, new_id)
         return touch
 
     def handle_name(self, name):
@@ -1873,7 +2244,7 @@ class Seat(WaylandObject):
         use the seat object anymore.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3), ()))
+        self.display.out_queue.pack(self, 3)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -1910,6 +2281,7 @@ class Seat(WaylandObject):
 
 
 class Pointer(WaylandObject):
+    interface = "wl_pointer"
     ROLE = 0
 
     def __init__(self, display, obj_id, seat):
@@ -1952,7 +2324,7 @@ class Pointer(WaylandObject):
         undefined, and the wl_surface is unmapped.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial, surface, hotspot_x, hotspot_y), ()))
+        self.display.out_queue.pack(self, 0, serial, surface, hotspot_x, hotspot_y)
 
     def handle_enter(self, serial, surface, surface_x, surface_y):
         """ enter event
@@ -2053,7 +2425,7 @@ class Pointer(WaylandObject):
         wl_pointer_destroy() after using this request.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1), ()))
+        self.display.out_queue.pack(self, 1)
 
     def handle_frame(self):
         """ end of a pointer event sequence
@@ -2213,6 +2585,7 @@ class Pointer(WaylandObject):
 
 
 class Keyboard(WaylandObject):
+    interface = "wl_keyboard"
     SHIFT = 1
     CAPS_LOCK = 2
     CONTROL = 4
@@ -2239,11 +2612,11 @@ class Keyboard(WaylandObject):
         
         """
         if format == self.XKB_V1:
-            print(size)
+            self.display.debug(size)
             with os.fdopen(fd) as keymap:
                 keymap.seek(0)
                 self.keymap = keymap.read(size)
-                print(len(self.keymap))
+                self.display.debug(len(self.keymap))
             self.parse_keymap()
 
     def handle_enter(self, serial, surface, keys):
@@ -2302,7 +2675,7 @@ class Keyboard(WaylandObject):
 
     def release(self):
         """ release the keyboard object"""
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def handle_repeat_info(self, rate, delay):
         """ repeat rate and delay
@@ -2379,6 +2752,8 @@ class Keyboard(WaylandObject):
 
 
 class Touch(WaylandObject):
+    interface = "wl_touch"
+
     def __init__(self, display, obj_id, seat):
         WaylandObject.__init__(self, display, obj_id)
         self.seat = seat
@@ -2442,7 +2817,7 @@ class Touch(WaylandObject):
 
     def release(self):
         """ release the touch object"""
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def handle_shape(self, id, major, minor):
         """ update shape of touch point
@@ -2600,7 +2975,7 @@ class Output(WaylandObject):
         a higher detail image.
         
         """
-        print(factor)
+        self.display.debug(factor)
 
     def release(self):
         """ release the output object
@@ -2609,7 +2984,7 @@ class Output(WaylandObject):
         use the output object anymore.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -2633,6 +3008,7 @@ class Output(WaylandObject):
 
 
 class Region(WaylandObject):
+    interface = "wl_region"
 
     def destroy(self):
         """ destroy region
@@ -2640,7 +3016,7 @@ class Region(WaylandObject):
         Destroy the region.  This will invalidate the object ID.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
         self.display.remove_object(self.obj_id)
 
     def add(self, x, y, width, height):
@@ -2649,7 +3025,7 @@ class Region(WaylandObject):
         Add the specified rectangle to the region.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 1, x, y, width, height)
 
     def subtract(self, x, y, width, height):
         """ subtract rectangle from region
@@ -2657,7 +3033,7 @@ class Region(WaylandObject):
         Subtract the specified rectangle from the region.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 2, x, y, width, height)
 
     events = []
     requests = ['destroy', 'add', 'subtract']
@@ -2674,7 +3050,7 @@ class Subcompositor(WaylandObject):
         objects, wl_subsurface objects included.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
         self.display.remove_object(self.obj_id)
 
     BAD_SURFACE = 0
@@ -2691,10 +3067,12 @@ class Subcompositor(WaylandObject):
         error is raised.
         
         """
-        new_id = self.display.next_id()
-        subsurface = Subsurface(self.display, new_id)
-        self.display.objects[new_id] = subsurface
-        self.display.out_queue.append((self.pack_arguments(1, new_id, surface, parent), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            subsurface = Subsurface(self.display, new_id)
+            subsurface.queue = self.queue
+            self.display.objects[new_id] = subsurface
+            self.display.out_queue.pack(self, 1, new_id, surface, parent)
         return subsurface
 
     events = []
@@ -2702,6 +3080,7 @@ class Subcompositor(WaylandObject):
 
 
 class Subsurface(WaylandObject):
+    interface = "wl_subsurface"
 
     def destroy(self):
         """ remove sub-surface interface
@@ -2713,7 +3092,7 @@ class Subsurface(WaylandObject):
         a sub-surface. The wl_surface is unmapped.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
         self.display.remove_object(self.obj_id)
 
     BAD_SURFACE = 0
@@ -2739,7 +3118,7 @@ class Subsurface(WaylandObject):
         The initial position is 0, 0.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, x, y), ()))
+        self.display.out_queue.pack(self, 1, x, y)
 
     def place_above(self, sibling):
         """ restack the sub-surface
@@ -2761,7 +3140,7 @@ class Subsurface(WaylandObject):
         of its siblings and parent.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, sibling), ()))
+        self.display.out_queue.pack(self, 2, sibling)
 
     def place_below(self, sibling):
         """ restack the sub-surface
@@ -2770,7 +3149,7 @@ class Subsurface(WaylandObject):
         See wl_subsurface.place_above.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3, sibling), ()))
+        self.display.out_queue.pack(self, 3, sibling)
 
     def set_sync(self):
         """ set sub-surface to synchronized mode
@@ -2790,7 +3169,7 @@ class Subsurface(WaylandObject):
         See wl_subsurface for the recursive effect of this mode.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4), ()))
+        self.display.out_queue.pack(self, 4)
 
     def set_desync(self):
         """ set sub-surface to desynchronized mode
@@ -2816,7 +3195,7 @@ class Subsurface(WaylandObject):
         the cached state is applied on set_desync.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5), ()))
+        self.display.out_queue.pack(self, 5)
 
     events = []
     requests = ['destroy', 'set_position', 'place_above', 'place_below', 'set_sync', 'set_desync']
@@ -2870,7 +3249,7 @@ class ZxdgShellV6(WaylandObject):
         and will result in a protocol error.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def create_positioner(self):
         """ create a positioner object
@@ -2880,10 +3259,12 @@ class ZxdgShellV6(WaylandObject):
         and xdg_surface.get_popup for details.
 
         """
-        new_id = self.display.next_id()
-        g_positioner_v6 = ZxdgPositionerV6(self.display, new_id)
-        self.display.objects[new_id] = g_positioner_v6
-        self.display.out_queue.append((self.pack_arguments(1, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            g_positioner_v6 = ZxdgPositionerV6(self.display, new_id)
+            g_positioner_v6.queue = self.queue
+            self.display.objects[new_id] = g_positioner_v6
+            self.display.out_queue.pack(self, 1, new_id)
         return g_positioner_v6
 
     def get_xdg_surface(self, surface):
@@ -2902,10 +3283,12 @@ class ZxdgShellV6(WaylandObject):
         xdg_surface is and how it is used.
 
         """
-        new_id = self.display.next_id()
-        g_surface_v6 = ZxdgSurfaceV6(self.display, new_id)
-        self.display.objects[new_id] = g_surface_v6
-        self.display.out_queue.append((self.pack_arguments(2, new_id, surface), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            g_surface_v6 = ZxdgSurfaceV6(self.display, new_id)
+            g_surface_v6.queue = self.queue
+            self.display.objects[new_id] = g_surface_v6
+            self.display.out_queue.pack(self, 2, new_id, surface)
         return g_surface_v6
 
     def pong(self, serial):
@@ -2915,7 +3298,7 @@ class ZxdgShellV6(WaylandObject):
         the client may be deemed unresponsive. See xdg_shell.ping.
 
         """
-        self.display.out_queue.append((self.pack_arguments(3, serial), ()))
+        self.display.out_queue.pack(self, 3, serial)
 
     def handle_ping(self, serial):
         """ check if the client is alive
@@ -2943,6 +3326,7 @@ class ZxdgShellV6(WaylandObject):
 
 
 class ZxdgPositionerV6(WaylandObject):
+    interface = "zxdg_positioner_v6"
     INVALID_INPUT = 0
 
     def destroy(self):
@@ -2951,7 +3335,7 @@ class ZxdgPositionerV6(WaylandObject):
         Notify the compositor that the xdg_positioner will no longer be used.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def set_size(self, width, height):
         """ set the size of the to-be positioned rectangle
@@ -2963,7 +3347,7 @@ class ZxdgPositionerV6(WaylandObject):
         If a zero or negative size is set the invalid_input error is raised.
 
         """
-        self.display.out_queue.append((self.pack_arguments(1, width, height), ()))
+        self.display.out_queue.pack(self, 1, width, height)
 
     def set_anchor_rect(self, x, y, width, height):
         """ set the anchor rectangle within the parent surface
@@ -2980,7 +3364,7 @@ class ZxdgPositionerV6(WaylandObject):
         If a zero or negative size is set the invalid_input error is raised.
 
         """
-        self.display.out_queue.append((self.pack_arguments(2, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 2, x, y, width, height)
 
     NONE = 0
     TOP = 1
@@ -3003,7 +3387,7 @@ class ZxdgPositionerV6(WaylandObject):
         the invalid_input error is raised.
 
         """
-        self.display.out_queue.append((self.pack_arguments(3, anchor), ()))
+        self.display.out_queue.pack(self, 3, anchor)
 
     NONE = 0
     TOP = 1
@@ -3025,7 +3409,7 @@ class ZxdgPositionerV6(WaylandObject):
         invalid_input error is raised.
 
         """
-        self.display.out_queue.append((self.pack_arguments(4, gravity), ()))
+        self.display.out_queue.pack(self, 4, gravity)
 
     # constraint adjustments
     NONE = 0
@@ -3054,7 +3438,7 @@ class ZxdgPositionerV6(WaylandObject):
         The default adjustment is none.
 
         """
-        self.display.out_queue.append((self.pack_arguments(5, constraint_adjustment), ()))
+        self.display.out_queue.pack(self, 5, constraint_adjustment)
 
     def set_offset(self, x, y):
         """ set surface position offset
@@ -3072,14 +3456,15 @@ class ZxdgPositionerV6(WaylandObject):
         with some user interface element placed somewhere in the popup surface.
 
         """
-        self.display.out_queue.append((self.pack_arguments(6, x, y), ()))
+        self.display.out_queue.pack(self, 6, x, y)
 
     events = []
     requests = ['destroy', 'set_size', 'set_anchor_rect', 'set_anchor', 'set_gravity', 'set_constraint_adjustment',
                 'set_offset']
 
 
-class ZxdgSurfaceV6(WaylandObject):
+class ZxdgSurfaceV6(CollapsedConfigures, WaylandObject):
+    interface = "zxdg_surface_v6"
     NOT_CONSTRUCTED = 1
     ALREADY_CONSTRUCTED = 2
     UNCONFIGURED_BUFFER = 3
@@ -3091,7 +3476,7 @@ class ZxdgSurfaceV6(WaylandObject):
         after its role object has been destroyed.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def get_toplevel(self):
         """ assign the xdg_toplevel surface role
@@ -3103,10 +3488,12 @@ class ZxdgSurfaceV6(WaylandObject):
         xdg_toplevel is and how it is used.
 
         """
-        new_id = self.display.next_id()
-        g_toplevel_v6 = ZxdgToplevelV6(self.display, new_id)
-        self.display.objects[new_id] = g_toplevel_v6
-        self.display.out_queue.append((self.pack_arguments(1, new_id), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            g_toplevel_v6 = ZxdgToplevelV6(self.display, new_id)
+            g_toplevel_v6.queue = self.queue
+            self.display.objects[new_id] = g_toplevel_v6
+            self.display.out_queue.pack(self, 1, new_id)
         return g_toplevel_v6
 
     def get_popup(self, parent, positioner):
@@ -3119,10 +3506,12 @@ class ZxdgSurfaceV6(WaylandObject):
         xdg_popup is and how it is used.
 
         """
-        new_id = self.display.next_id()
-        g_popup_v6 = ZxdgPopupV6(self.display, new_id)
-        self.display.objects[new_id] = g_popup_v6
-        self.display.out_queue.append((self.pack_arguments(2, new_id, parent, positioner), ()))
+        with self.display.request_lock:
+            new_id = self.display.next_id()
+            g_popup_v6 = ZxdgPopupV6(self.display, new_id)
+            g_popup_v6.queue = self.queue
+            self.display.objects[new_id] = g_popup_v6
+            self.display.out_queue.pack(self, 2, new_id, parent, positioner)
         return g_popup_v6
 
     def set_window_geometry(self, x, y, width, height):
@@ -3154,7 +3543,7 @@ class ZxdgSurfaceV6(WaylandObject):
         subsurfaces.
 
         """
-        self.display.out_queue.append((self.pack_arguments(3, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 3, x, y, width, height)
 
     def ack_configure(self, serial):
         """ ack a configure event
@@ -3180,7 +3569,7 @@ class ZxdgSurfaceV6(WaylandObject):
         event the client really is responding to.
 
         """
-        self.display.out_queue.append((self.pack_arguments(4, serial), ()))
+        self.display.out_queue.pack(self, 4, serial)
 
     def handle_configure(self, serial):
         """ suggest a surface change
@@ -3206,13 +3595,16 @@ class ZxdgSurfaceV6(WaylandObject):
         self.ack_configure(serial)
 
     def unpack_event(self, op, data, fds):
+        self.received_configures += 1
         return self, op, struct.unpack("I", data)
 
     events = ['configure']
     requests = ['destroy', 'get_toplevel', 'get_popup', 'set_window_geometry', 'ack_configure']
 
 
-class ZxdgToplevelV6(WaylandObject):
+class ZxdgToplevelV6(CollapsedConfigures, WaylandObject):
+    interface = "zxdg_toplevel_v6"
+
     def destroy(self):
         """ destroy the xdg_toplevel
 
@@ -3221,7 +3613,7 @@ class ZxdgToplevelV6(WaylandObject):
         maximization, fullscreen, and so on, will be lost.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def set_parent(self, parent):
         """ set the parent of this surface
@@ -3235,7 +3627,7 @@ class ZxdgToplevelV6(WaylandObject):
         is raised.
 
         """
-        self.display.out_queue.append((self.pack_arguments(1, parent), ()))
+        self.display.out_queue.pack(self, 1, parent)
 
     def set_title(self, title):
         """ set surface title
@@ -3249,7 +3641,7 @@ class ZxdgToplevelV6(WaylandObject):
         The string must be encoded in UTF-8.
 
         """
-        self.display.out_queue.append((self.pack_arguments(2, title), ()))
+        self.display.out_queue.pack(self, 2, title)
 
     def set_app_id(self, app_id):
         """ set application ID
@@ -3276,7 +3668,7 @@ class ZxdgToplevelV6(WaylandObject):
         [0] http://standards.freedesktop.org/desktop-entry-spec/
 
         """
-        self.display.out_queue.append((self.pack_arguments(3, app_id), ()))
+        self.display.out_queue.pack(self, 3, app_id)
 
     def show_window_menu(self, seat, serial, x, y):
         """ show the window menu
@@ -3294,7 +3686,7 @@ class ZxdgToplevelV6(WaylandObject):
         like a button press, key press, or touch down event.
 
         """
-        self.display.out_queue.append((self.pack_arguments(4, seat, serial, x, y), ()))
+        self.display.out_queue.pack(self, 4, seat, serial, x, y)
 
     def move(self, seat, serial):
         """ start an interactive move
@@ -3317,7 +3709,7 @@ class ZxdgToplevelV6(WaylandObject):
         that the device focus will return when the move is completed.
 
         """
-        self.display.out_queue.append((self.pack_arguments(5, seat, serial), ()))
+        self.display.out_queue.pack(self, 5, seat, serial)
 
     # edge values for resizing
     NONE = 0
@@ -3365,7 +3757,7 @@ class ZxdgToplevelV6(WaylandObject):
         appropriate cursor image.
 
         """
-        self.display.out_queue.append((self.pack_arguments(6, seat, serial, edges), ()))
+        self.display.out_queue.pack(self, 6, seat, serial, edges)
 
     # types of state on the surface
     MAXIMIZED = 1
@@ -3412,7 +3804,7 @@ class ZxdgToplevelV6(WaylandObject):
         protocol error.
 
         """
-        self.display.out_queue.append((self.pack_arguments(7, width, height), ()))
+        self.display.out_queue.pack(self, 7, width, height)
 
     def set_min_size(self, width, height):
         """ set the minimum size
@@ -3453,7 +3845,7 @@ class ZxdgToplevelV6(WaylandObject):
         protocol error.
 
         """
-        self.display.out_queue.append((self.pack_arguments(8, width, height), ()))
+        self.display.out_queue.pack(self, 8, width, height)
 
     def set_maximized(self):
         """ maximize the window
@@ -3476,7 +3868,7 @@ class ZxdgToplevelV6(WaylandObject):
         a configure event with the "maximized" state.
 
         """
-        self.display.out_queue.append((self.pack_arguments(9), ()))
+        self.display.out_queue.pack(self, 9)
 
     def unset_maximized(self):
         """ unmaximize the window
@@ -3500,7 +3892,7 @@ class ZxdgToplevelV6(WaylandObject):
         emit a configure event without the "maximized" state.
 
         """
-        self.display.out_queue.append((self.pack_arguments(10), ()))
+        self.display.out_queue.pack(self, 10)
 
     def set_fullscreen(self, output):
         """ set the window as fullscreen on a monitor
@@ -3516,10 +3908,10 @@ class ZxdgToplevelV6(WaylandObject):
         black borders filling the rest of the output.
 
         """
-        self.display.out_queue.append((self.pack_arguments(11, output), ()))
+        self.display.out_queue.pack(self, 11, output)
 
     def unset_fullscreen(self):
-        self.display.out_queue.append((self.pack_arguments(12), ()))
+        self.display.out_queue.pack(self, 12)
 
     def set_minimized(self):
         """ set the window as minimized
@@ -3534,7 +3926,7 @@ class ZxdgToplevelV6(WaylandObject):
         similar compositor features.
 
         """
-        self.display.out_queue.append((self.pack_arguments(13), ()))
+        self.display.out_queue.pack(self, 13)
 
     def handle_configure(self, width, height, states):
         """ suggest a surface change
@@ -3560,7 +3952,7 @@ class ZxdgToplevelV6(WaylandObject):
         xdg_surface.configure and xdg_surface.ack_configure for details.
 
         """
-        print(width, height, states)
+        self.display.debug(width, height, states)
 
     def handle_close(self):
         """ surface wants to be closed
@@ -3575,12 +3967,13 @@ class ZxdgToplevelV6(WaylandObject):
         a dialog to ask the user to save their data, etc.
 
         """
-        print("Close!")
+        self.display.debug("Close!")
 
     def unpack_event(self, op, data, fds):
         if op == 0:
+            self.received_configures += 1
             width, height, length = struct.unpack("III", data[:12])
-            print(length, len(data))
+            self.display.debug(length, len(data))
             return self, op, (width, height, struct.unpack("{}I".format(length // 4), data[12:]))
         return self, op, ()
 
@@ -3590,7 +3983,8 @@ class ZxdgToplevelV6(WaylandObject):
                 'unset_fullscreen', 'set_minimized']
 
 
-class ZxdgPopupV6(WaylandObject):
+class ZxdgPopupV6(CollapsedConfigures, WaylandObject):
+    interface = "zxdg_popup_v6"
     INVALID_GRAB = 0
 
     def destroy(self):
@@ -3603,7 +3997,7 @@ class ZxdgPopupV6(WaylandObject):
         will be sent.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def grab(self, seat, serial):
         """ make the popup take an explicit grab
@@ -3651,7 +4045,7 @@ class ZxdgPopupV6(WaylandObject):
         will always have keyboard focus.
 
         """
-        self.display.out_queue.append((self.pack_arguments(1, seat, serial), ()))
+        self.display.out_queue.pack(self, 1, seat, serial)
 
     def handle_configure(self, x, y, width, height):
         """ configure the popup surface
@@ -3665,7 +4059,7 @@ class ZxdgPopupV6(WaylandObject):
         window geometry of the parent surface.
 
         """
-        print(x, y, width, height)
+        self.display.debug(x, y, width, height)
 
     def handle_popup_done(self):
         """ popup interaction is done
@@ -3679,6 +4073,7 @@ class ZxdgPopupV6(WaylandObject):
 
     def unpack_event(self, op, data, fds):
         if op == 0:
+            self.received_configures += 1
             return self, op, struct.unpack("iiii", data)
         return self, op, ()
 
@@ -0,0 +1,162 @@
+"""
+    Clipboard and drag-and-drop helper for wayland clients.
+"""
+
+import os
+
+from .transfer import BufferSink
+
+
+class Clipboard(object):
+    """ selection and drag-and-drop state of one seat
+
+    Tracks the current selection offer and the mime types it advertises,
+    caches received content per (offer, mime type) so repeated reads don't
+    round-trip through the source client, and serves our own selections
+    lazily: a provider is only evaluated when another client asks for it.
+
+    Providers map a mime type to bytes, str, a file object, an iterable of
+    chunks, or a callable taking the mime type and returning one of those.
+
+    """
+    def __init__(self, display, seat=None):
+        self.display = display
+        manager = display.globals["wl_data_device_manager"]
+        if seat is None:
+            seat = display.globals["wl_seat"]
+            if isinstance(seat, list):
+                seat = seat[0]
+        self.manager = manager
+        self.device = manager.get_data_device(seat)
+        self.device.handle_selection = self.handle_selection
+        self.device.handle_enter = self.handle_enter
+        self.device.handle_leave = self.handle_leave
+        self.device.handle_drop = self.handle_drop
+        self.offer = None
+        self.drag_offer = None
+        self.dropped = False
+        self.cache = {}
+        self.pending = {}
+        self.source = None
+        self.providers = {}
+
+    @property
+    def mime_types(self):
+        if self.source is not None:
+            return list(self.providers)
+        if self.offer is None:
+            return []
+        return self.offer.mime_types
+
+    def handle_selection(self, offer):
+        old = self.offer
+        self.offer = offer
+        if old is not None and old is not offer and old is not self.drag_offer:
+            self.forget(old)
+            old.destroy()
+
+    def handle_enter(self, serial, surface, x, y, offer):
+        self.drag_offer = offer
+        self.dropped = False
+
+    def handle_leave(self):
+        # after a drop the offer stays valid until the transfer is finished
+        if self.drag_offer is not None and not self.dropped:
+            self.forget(self.drag_offer)
+            self.drag_offer.destroy()
+            self.drag_offer = None
+
+    def handle_drop(self):
+        self.dropped = True
+
+    def finish_drop(self):
+        """ tell the source the drag-and-drop transfer is complete """
+        if self.drag_offer is not None:
+            self.drag_offer.finish()
+            self.forget(self.drag_offer)
+            self.drag_offer.destroy()
+            self.drag_offer = None
+
+    def forget(self, offer):
+        for key in [key for key in self.cache if key[0] is offer]:
+            del self.cache[key]
+
+    def read(self, mime_type, callback, offer=None):
+        """ fetch the selection (or the given offer) as mime_type
+
+        The callback is called with the content as bytes, or None if it
+        isn't available.  It may be called immediately when the content is
+        already known.
+
+        """
+        if offer is None:
+            if self.source is not None:
+                callback(self.provide(mime_type))
+                return
+            offer = self.offer
+        if offer is None or mime_type not in offer.mime_types:
+            callback(None)
+            return
+        key = (offer, mime_type)
+        if key in self.cache:
+            callback(self.cache[key])
+            return
+        if key in self.pending:
+            self.pending[key].append(callback)
+            return
+        self.pending[key] = [callback]
+
+        def done(transfer):
+            callbacks = self.pending.pop(key, ())
+            data = None
+            if transfer.error is None:
+                data = transfer.data
+                if offer is self.offer or offer is self.drag_offer:
+                    self.cache[key] = data
+            for c in callbacks:
+                c(data)
+        offer.fetch(mime_type, BufferSink(), done)
+
+    def provide(self, mime_type):
+        provider = self.providers.get(mime_type)
+        if callable(provider):
+            provider = provider(mime_type)
+        if provider is None or isinstance(provider, bytes):
+            return provider
+        if isinstance(provider, str):
+            return provider.encode("utf-8")
+        if hasattr(provider, "read"):
+            return provider.read()
+        return b"".join(c.encode("utf-8") if isinstance(c, str) else c for c in provider)
+
+    def set_selection(self, providers, serial):
+        """ make our own data the selection, or clear it with an empty dict """
+        self.clear_source()
+        if not providers:
+            self.device.set_selection(None, serial)
+            return
+        self.providers = dict(providers)
+        self.source = self.manager.create_data_source()
+        for mime_type in self.providers:
+            self.source.offer(mime_type)
+        self.source.handle_send = self.handle_send
+        self.source.handle_cancelled = self.handle_cancelled
+        self.device.set_selection(self.source, serial)
+
+    def handle_send(self, mime_type, fd):
+        provider = self.providers.get(mime_type)
+        if callable(provider):
+            provider = provider(mime_type)
+        if provider is None:
+            os.close(fd)
+            return
+        self.source.serve(fd, provider)
+
+    def handle_cancelled(self):
+        self.clear_source()
+
+    def clear_source(self):
+        if self.source is not None:
+            self.source.destroy()
+        self.source = None
+        self.providers = {}
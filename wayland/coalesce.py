@@ -0,0 +1,205 @@
+"""
+    Client side coalescing of double-buffered requests.
+
+    Requests like wl_surface.damage or wl_subsurface.set_position only
+    change pending state, which takes effect at the next wl_surface.commit.
+    A Coalescer attached to a client Display holds them back until a commit
+    is queued.  Damage rectangles of an object are merged into as few as
+    cover the same area, and for the other requests only the last value is
+    sent.  Requests held for an object that is destroyed before a commit
+    are dropped.
+
+    Only requests without object arguments are held: an object they named
+    could be destroyed before the commit that sends them.
+"""
+
+import threading
+
+from . import protocol
+
+INT_MAX = 2 ** 31 - 1
+
+# (interface, request) held back until a commit, and whether they add damage
+# (True) or replace the previous value (False)
+COALESCED = {
+    ("wl_surface", "damage"): True,
+    ("wl_surface", "damage_buffer"): True,
+    ("wl_surface", "set_buffer_transform"): False,
+    ("wl_surface", "set_buffer_scale"): False,
+    ("wl_subsurface", "set_position"): False,
+    ("zxdg_surface_v6", "set_window_geometry"): False,
+    ("zxdg_toplevel_v6", "set_max_size"): False,
+    ("zxdg_toplevel_v6", "set_min_size"): False,
+    ("xdg_surface", "set_window_geometry"): False,
+}
+
+DAMAGE = 1
+STATE = 2
+COMMIT = 3
+DESTROY = 4
+
+
+def request_kinds(interface):
+    """ the coalescing kind of every request of interface, by opcode, or None for the others """
+    messages = protocol.interfaces.get(interface)
+    if messages is None:
+        return ()
+    kinds = []
+    for name, signature in messages[protocol.REQUESTS]:
+        if (interface, name) in COALESCED:
+            kinds.append(DAMAGE if COALESCED[interface, name] else STATE)
+        elif (interface, name) == ("wl_surface", "commit"):
+            kinds.append(COMMIT)
+        elif name == "destroy":
+            kinds.append(DESTROY)
+        else:
+            kinds.append(None)
+    return tuple(kinds)
+
+
+def merge(a, b):
+    """ the rectangle covering exactly a and b, or None if their union is not one """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    if ax <= bx and ay <= by and bx + bw <= ax + aw and by + bh <= ay + ah:
+        return a
+    if bx <= ax and by <= ay and ax + aw <= bx + bw and ay + ah <= by + bh:
+        return b
+    if ax == bx and aw == bw and ay <= by + bh and by <= ay + ah:
+        y = min(ay, by)
+        return ax, y, aw, max(ay + ah, by + bh) - y
+    if ay == by and ah == bh and ax <= bx + bw and bx <= ax + aw:
+        x = min(ax, bx)
+        return x, ay, max(ax + aw, bx + bw) - x, ah
+    return None
+
+
+def add_damage(rectangles, rectangle, limit):
+    """ add a rectangle to a list of damage rectangles
+
+    Rectangles it touches or contains, or that contain it, are merged with
+    it as long as the result covers nothing more.  Past limit rectangles,
+    the list is replaced by their bounding box.
+
+    """
+    x, y, width, height = rectangle
+    if width <= 0 or height <= 0:
+        return
+    right = x + width
+    bottom = y + height
+    # most often it is inside one already, like the border of a redrawn widget
+    for left, top, other_width, other_height in rectangles:
+        if left <= x and top <= y and right <= left + other_width and bottom <= top + other_height:
+            return
+    i = 0
+    while i < len(rectangles):
+        merged = merge(rectangles[i], rectangle)
+        if merged is None:
+            i += 1
+            continue
+        # the larger rectangle may now merge with one skipped before
+        del rectangles[i]
+        rectangle = merged
+        i = 0
+    rectangles.append(rectangle)
+    if len(rectangles) > limit:
+        left = min(r[0] for r in rectangles)
+        top = min(r[1] for r in rectangles)
+        right = max(r[0] + r[2] for r in rectangles)
+        bottom = max(r[1] + r[3] for r in rectangles)
+        rectangles[:] = [(left, top, right - left, bottom - top)]
+
+
+class Coalescer(object):
+    """ hold back the double-buffered requests of a client Display until a commit
+
+    held maps every object with requests held to how many, their size in
+    bytes and a dict of them by opcode: a list of damage rectangles or the
+    last arguments.  elided_requests and elided_bytes count the requests
+    that were never sent.
+
+    """
+    # damage rectangles kept per object and request before they are merged
+    # into their bounding box
+    max_rectangles = 16
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = {}
+        self.elided_requests = 0
+        self.elided_bytes = 0
+
+    def attach(self, display):
+        """ coalesce the requests of display from now on
+
+        The pack method of its output arena is wrapped, so a Display
+        without a coalescer is not slowed down.
+
+        """
+        out_queue = display.out_queue
+        pack = out_queue.pack
+
+        def coalescing_pack(obj, opcode, *args):
+            cls = type(obj)
+            kinds = cls.__dict__.get("coalesced_kinds")
+            if kinds is None:
+                kinds = cls.coalesced_kinds = request_kinds(getattr(cls, "interface", None))
+            kind = kinds[opcode] if opcode < len(kinds) else None
+            if kind is None:
+                return pack(obj, opcode, *args)
+            if kind == COMMIT:
+                # queued under the lock, so no thread destroys their objects before
+                with self.lock:
+                    for held_obj, held_opcode, held_args in self.release():
+                        pack(held_obj, held_opcode, *held_args)
+            elif kind == DESTROY:
+                self.drop(obj)
+            else:
+                return self.hold(obj, opcode, kind, args)
+            pack(obj, opcode, *args)
+
+        out_queue.pack = coalescing_pack
+
+    def hold(self, obj, opcode, kind, args):
+        with self.lock:
+            pending = self.held.get(obj)
+            if pending is None:
+                # requests and bytes held, and the requests by opcode
+                pending = self.held[obj] = [0, 0, {}]
+            pending[0] += 1
+            pending[1] += 8 + 4 * len(args)
+            if kind == DAMAGE:
+                add_damage(pending[2].setdefault(opcode, []), tuple(args), self.max_rectangles)
+            else:
+                pending[2][opcode] = args
+
+    def release(self):
+        """ the (obj, opcode, args) of the requests to send before a commit, with the lock held
+
+        They are those held for every object, since a commit applies the
+        state of other surfaces too, like the position of its subsurfaces.
+
+        """
+        held = self.held
+        self.held = {}
+        requests = []
+        for obj, (count, size, pending) in held.items():
+            for opcode, value in pending.items():
+                if isinstance(value, list):
+                    requests.extend((obj, opcode, (x, y, min(width, INT_MAX), min(height, INT_MAX)))
+                                    for x, y, width, height in value)
+                else:
+                    requests.append((obj, opcode, value))
+            self.elided_requests += count
+            self.elided_bytes += size
+        self.elided_requests -= len(requests)
+        self.elided_bytes -= sum(8 + 4 * len(args) for obj, opcode, args in requests)
+        return requests
+
+    def drop(self, obj):
+        """ forget the requests held for obj, which is being destroyed """
+        with self.lock:
+            pending = self.held.pop(obj, None)
+            if pending is not None:
+                self.elided_requests += pending[0]
+                self.elided_bytes += pending[1]
@@ -0,0 +1,84 @@
+"""
+    Throttled configure events for xdg surfaces.
+
+    During an interactive resize a compositor wants a new size for a window
+    on every pointer motion, faster than the client can draw them.  A
+    Configurer keeps at most one configure sequence of a surface
+    outstanding: those asked for meanwhile are merged and held until the
+    client has acknowledged it with ack_configure and committed, then the
+    latest state is sent.  The client thus draws one size per frame, the
+    last one asked for.
+
+        class Toplevel(server.ZxdgToplevelV6):
+            def __init__(self, display, obj_id, xdg_surface):
+                super().__init__(display, obj_id)
+                self.xdg_surface = xdg_surface
+                self.configurer = Configurer(display, self.send_state)
+
+            def send_state(self, serial, width=0, height=0, states=()):
+                self.send_configure(width, height, states)
+                self.xdg_surface.send_configure(serial)
+
+        toplevel.configurer.configure(width=800, height=600)
+
+    The xdg surface's handle_ack_configure calls configurer.ack and its
+    wl_surface's handle_commit configurer.commit.  Clients collapse the
+    configure events they have queued too, see client.LatestConfigure.
+"""
+
+import threading
+
+
+class Configurer(object):
+    """ the configure sequences of an xdg surface, one outstanding at a time
+
+    send is called as send(serial, **state) to send a sequence, with the
+    keyword arguments of configure, merged.  outstanding is the serial
+    waiting for an ack and a commit, None if there is none, and held the
+    state to send once it is answered.  sent counts the sequences sent and
+    coalesced those merged into a later one.
+
+    """
+    def __init__(self, client, send):
+        self.client = client
+        self.send = send
+        self.lock = threading.Lock()
+        self.outstanding = None
+        self.acked = None
+        self.held = None
+        self.sent = 0
+        self.coalesced = 0
+
+    def configure(self, **state):
+        """ ask the client for state, returning the serial sent or None if it is held """
+        with self.lock:
+            if self.outstanding is None:
+                return self.send_state(state)
+            if self.held is None:
+                self.held = state
+            else:
+                self.held.update(state)
+                self.coalesced += 1
+            return None
+
+    def send_state(self, state):
+        serial = self.outstanding = self.client.get_serial()
+        self.acked = None
+        self.sent += 1
+        self.send(serial, **state)
+        return serial
+
+    def ack(self, serial):
+        """ the client acknowledged serial, for ack_configure """
+        with self.lock:
+            self.acked = serial
+
+    def commit(self):
+        """ the client committed its surface, sending the held state if it answered the outstanding one """
+        with self.lock:
+            if self.outstanding is None or self.acked != self.outstanding:
+                return
+            self.outstanding = self.acked = None
+            if self.held is not None:
+                state, self.held = self.held, None
+                self.send_state(state)
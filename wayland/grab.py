@@ -0,0 +1,288 @@
+"""
+    Interactive move and resize of windows, driven by the compositor.
+
+    When a client asks to be moved or resized, with the serial of the
+    button press that started it, the Grabber takes the pointer: until the
+    button is released its motion moves or resizes the window instead of
+    being hit-tested and sent to clients.  A moved window is placed again
+    in the output.Layout, which repaints only where it was and where it
+    is.  A resized window is asked for its new size at most once per
+    refresh of the output it is on, and is kept anchored to the edges not
+    being dragged as it commits bigger or smaller buffers.
+
+    The compositor tells the grabber about the pointer, and skips its own
+    handling of what the grabber consumed:
+
+        if not grabber.motion(x, y):
+            ...  # hit-test and send wl_pointer.motion
+        if not grabber.button(pressed):
+            ...  # send wl_pointer.button, then for a press:
+            grabber.pressed(client, serial)
+
+    from the xdg requests:
+
+        def handle_move(self, seat, serial):
+            grabber.move(self.display, self.surface, serial)
+
+        def handle_resize(self, seat, serial, edges):
+            grabber.resize(self.display, self.surface, serial, edges,
+                           lambda width, height: self.configurer.configure(width=width, height=height))
+
+    places the surfaces it commits with grabber.committed, naming the
+    configure serial each commit acknowledges, and runs
+    grabber.update with the layout's repaints:
+
+        while True:
+            timeouts = [t for t in (layout.timeout(), grabber.timeout()) if t is not None]
+            display.handle_requests(min(timeouts, default=None))
+            grabber.update()
+            layout.repaint()
+"""
+
+import time
+import threading
+
+# the edges of wl_shell_surface.resize, xdg_surface.resize_edge and zxdg_toplevel_v6.resize_edge
+TOP = 1
+BOTTOM = 2
+LEFT = 4
+RIGHT = 8
+
+
+class Grab(object):
+    """ a pointer grab, started at pointer position (x, y) """
+    def __init__(self, grabber, surface, x, y):
+        self.grabber = grabber
+        self.surface = surface
+        self.start_x = x
+        self.start_y = y
+        self.area = grabber.layout.surfaces[surface][0]
+
+    def motion(self, x, y, now):
+        pass
+
+    def update(self, now):
+        pass
+
+    def timeout(self, now):
+        return None
+
+    def end(self, now):
+        pass
+
+
+class MoveGrab(Grab):
+    """ moves a window with the pointer """
+    def motion(self, x, y, now):
+        left, top, width, height = self.area
+        self.grabber.layout.place(self.surface, left + x - self.start_x, top + y - self.start_y, width, height)
+
+
+class ResizeGrab(Grab):
+    """ resizes a window with the pointer, from its edges
+
+    configure(width, height) asks the client for a size, and may return
+    the serial of the configure sent, or None if it is held until the
+    client answers an earlier one, as configure.Configurer does.  wanted
+    is the size the pointer asks for, next_configure the time.monotonic()
+    before which no other is sent, serial the last serial configure
+    returned and held whether a size asked for after it was held.
+
+    """
+    def __init__(self, grabber, surface, x, y, edges, configure):
+        super().__init__(grabber, surface, x, y)
+        self.edges = edges
+        self.configure = configure
+        self.wanted = None
+        self.sent = self.area[2:]
+        self.serial = None
+        self.held = False
+        self.next_configure = 0
+        self.period = grabber.period(surface)
+
+    def motion(self, x, y, now):
+        left, top, width, height = self.area
+        dx = x - self.start_x
+        dy = y - self.start_y
+        if self.edges & LEFT:
+            width -= dx
+        elif self.edges & RIGHT:
+            width += dx
+        if self.edges & TOP:
+            height -= dy
+        elif self.edges & BOTTOM:
+            height += dy
+        self.wanted = (max(1, width), max(1, height))
+        self.update(now)
+
+    def update(self, now):
+        if self.wanted is None or self.wanted == self.sent or now < self.next_configure:
+            return
+        self.sent = self.wanted
+        self.next_configure = now + self.period
+        serial = self.configure(*self.wanted)
+        if serial is not None:
+            self.serial = serial
+            self.held = False
+        elif self.serial is not None:
+            # it goes out with a later serial, once the client answered this one
+            self.held = True
+
+    def timeout(self, now):
+        if self.wanted is None or self.wanted == self.sent:
+            return None
+        return max(0, self.next_configure - now)
+
+    def end(self, now):
+        # the last size asked for goes out right away
+        self.next_configure = 0
+        self.update(now)
+
+    def answered(self, width, height, serial):
+        """ whether a commit of a size, acknowledging serial, answers the last size asked for
+
+        Clients may choose another size than the one asked for, e.g. for
+        their size increments, so the serials tell.  When either is
+        unknown, any commit does.
+
+        """
+        if (width, height) == tuple(self.sent) or serial is None or self.serial is None:
+            return True
+        if self.held:
+            return serial > self.serial
+        return serial >= self.serial
+
+    def position(self, width, height):
+        """ where the window goes with a new size, keeping the edges not dragged in place """
+        left, top, start_width, start_height = self.area
+        if self.edges & LEFT:
+            left += start_width - width
+        if self.edges & TOP:
+            top += start_height - height
+        return left, top
+
+
+class Grabber(object):
+    """ the interactive grabs of a compositor's pointer, see the module
+
+    layout is the output.Layout the windows are placed in.  grab is the
+    active Grab, None when the pointer is not grabbed, and (x, y) the
+    last pointer position.  press is the (client, serial) of the button
+    press still held, which a move or resize request must name.
+    resizing maps the surfaces a ResizeGrab placed to it, until they
+    answer the last size it asked for.
+
+    """
+    # seconds between configures when the window is on no output
+    default_period = 1 / 60
+
+    def __init__(self, layout):
+        self.layout = layout
+        # configure may be called back into, e.g. by a client that commits at once
+        self.lock = threading.RLock()
+        self.grab = None
+        self.x = 0
+        self.y = 0
+        self.press = None
+        self.resizing = {}
+
+    def pressed(self, client, serial):
+        """ a button press was sent to a server.Client with serial """
+        with self.lock:
+            self.press = (client, serial)
+
+    def valid(self, client, serial):
+        return self.grab is None and self.press == (client, serial)
+
+    def move(self, client, surface, serial):
+        """ start moving surface, returning whether the serial allowed it """
+        with self.lock:
+            if not self.valid(client, serial) or surface not in self.layout.surfaces:
+                return False
+            self.forget(surface)
+            self.grab = MoveGrab(self, surface, self.x, self.y)
+            return True
+
+    def resize(self, client, surface, serial, edges, configure):
+        """ start resizing surface from edges, returning whether the serial allowed it """
+        with self.lock:
+            if not self.valid(client, serial) or surface not in self.layout.surfaces:
+                return False
+            self.forget(surface)
+            self.grab = ResizeGrab(self, surface, self.x, self.y, edges, configure)
+            self.resizing[surface] = self.grab
+            return True
+
+    def motion(self, x, y, now=None):
+        """ the pointer moved to (x, y), returning whether the grab took it """
+        with self.lock:
+            self.x = x
+            self.y = y
+            grab = self.grab
+            if grab is None:
+                return False
+            grab.motion(x, y, time.monotonic() if now is None else now)
+            return True
+
+    def button(self, pressed, now=None):
+        """ a button was pressed or released, returning whether the grab took it
+
+        Releasing the button ends the grab.
+
+        """
+        with self.lock:
+            grab = self.grab
+            if grab is None:
+                if not pressed:
+                    self.press = None
+                return False
+            if not pressed:
+                self.grab = None
+                self.press = None
+                grab.end(time.monotonic() if now is None else now)
+            return True
+
+    def committed(self, surface, width, height, serial=None):
+        """ place surface once it committed a new size, returning whether it was being resized
+
+        serial is the configure serial the commit acknowledges, if any.
+        Once the grab is over, the commit answering its last configure
+        ends the resize, whatever size the client chose, see
+        ResizeGrab.answered.  The other surfaces are the compositor's to
+        place.
+
+        """
+        with self.lock:
+            grab = self.resizing.get(surface)
+            if grab is None:
+                return False
+            if grab is not self.grab and grab.answered(width, height, serial):
+                del self.resizing[surface]
+            x, y = grab.position(width, height)
+            self.layout.place(surface, x, y, width, height)
+            return True
+
+    def forget(self, surface):
+        """ surface is gone, ending a grab of it """
+        with self.lock:
+            self.resizing.pop(surface, None)
+            if self.grab is not None and self.grab.surface is surface:
+                self.grab = None
+
+    def period(self, surface):
+        """ the refresh period of the fastest output surface is on """
+        periods = [output.period for output in self.layout.outputs_of(surface)]
+        return min(periods) if periods else self.default_period
+
+    def timeout(self, now=None):
+        """ seconds until update has a configure to send, None if it has none """
+        with self.lock:
+            if self.grab is None:
+                return None
+            return self.grab.timeout(time.monotonic() if now is None else now)
+
+    def update(self, now=None):
+        """ send the configure a resize held back, once it is due """
+        with self.lock:
+            if self.grab is not None:
+                self.grab.update(time.monotonic() if now is None else now)
@@ -0,0 +1,366 @@
+"""
+    The outputs of a compositor, each repainted on its own schedule.
+
+    An Output is a wl_output global: a monitor with a position in the
+    compositor's layout, a mode, a scale and a transform.  It collects the
+    damage of its area and the frame callbacks of the surfaces shown on
+    it, and repaints only when it has some, at most once per refresh
+    period of its own mode, so a 60Hz monitor next to a 144Hz one is not
+    redrawn, nor its clients woken, at 144Hz.
+
+    A Layout holds the outputs and the area of every surface shown, sends
+    wl_surface.enter and leave as surfaces and outputs move, and runs the
+    repaints that are due.  A compositor subclasses Output to draw in
+    render, and runs its loop like this:
+
+        while True:
+            display.handle_requests(layout.timeout())
+            layout.repaint()
+
+    Layout coordinates are logical pixels: an output covers its mode size
+    divided by its scale, turned by its transform.
+"""
+
+import time
+import threading
+
+from . import server
+from .coalesce import add_damage
+
+
+def intersection(a, b):
+    """ the rectangle common to a and b, or None """
+    left = max(a[0], b[0])
+    top = max(a[1], b[1])
+    right = min(a[0] + a[2], b[0] + b[2])
+    bottom = min(a[1] + a[3], b[1] + b[3])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right - left, bottom - top
+
+
+def milliseconds(now):
+    """ a wl_callback.done timestamp """
+    return int(now * 1000) & 0xffffffff
+
+
+class Output(object):
+    """ a wl_output global, see the module
+
+    proxies are the OutputProxy objects of every client that bound it.
+    damage is the list of rectangles to redraw, in layout coordinates, and
+    frames the callbacks to send done once they are.  next_repaint is the
+    time.monotonic() of the next repaint, None when there is nothing to
+    repaint, and last_repaint that of the previous one.
+
+    """
+    name = "wl_output"
+    version = 3
+    proxy = server.OutputProxy
+
+    # damage rectangles kept before they are merged into their bounding box
+    max_rectangles = 32
+    # what configure may change
+    settings = ("width", "height", "refresh", "x", "y", "scale", "transform", "make", "model",
+                "physical_width", "physical_height")
+
+    def __init__(self, layout, width, height, refresh=60000, x=0, y=0, scale=1, transform=0,
+                 make="python-wayland", model="headless", physical_width=0, physical_height=0):
+        self.layout = layout
+        self.display = layout.display
+        self.width = width
+        self.height = height
+        # in mHz, like wl_output.mode
+        self.refresh = refresh
+        self.x = x
+        self.y = y
+        self.scale = scale
+        self.transform = transform
+        self.make = make
+        self.model = model
+        self.physical_width = physical_width
+        self.physical_height = physical_height
+        self.proxies = []
+        self.damage = []
+        self.frames = []
+        self.next_repaint = None
+        self.last_repaint = None
+        self.repaints = 0
+
+    @property
+    def period(self):
+        """ seconds between two refreshes """
+        return 1000 / self.refresh
+
+    def area(self):
+        """ (x, y, width, height) of the output in the layout """
+        width, height = self.width, self.height
+        if self.transform & 1:
+            # turned by 90 or 270 degrees
+            width, height = height, width
+        return self.x, self.y, width // self.scale, height // self.scale
+
+    def setup(self, proxy):
+        with self.layout.lock:
+            self.proxies.append(proxy)
+            self.announce((proxy,))
+            # surfaces of the client already shown here
+            for surface, (area, outputs) in self.layout.surfaces.items():
+                if self in outputs and surface.display is proxy.display:
+                    surface.send_enter(proxy)
+
+    def announce(self, proxies):
+        """ send the state of the output to proxies, packed once for all of them """
+        broadcast = self.display.broadcast
+        broadcast(proxies, "geometry", self.x, self.y, self.physical_width, self.physical_height,
+                  server.OutputProxy.UNKNOWN, self.make, self.model, self.transform)
+        broadcast(proxies, "mode", server.OutputProxy.CURRENT, self.width, self.height, self.refresh)
+        # scale and done came with version 2
+        proxies = [proxy for proxy in proxies if proxy.version >= 2]
+        broadcast(proxies, "scale", self.scale)
+        broadcast(proxies, "done")
+
+    def configure(self, **changes):
+        """ change the mode, position, scale or transform, e.g. configure(width=2560, height=1440)
+
+        Takes the names of the constructor arguments.  Clients are sent
+        the new state, the output is repainted and surfaces are told if
+        they entered or left it.
+
+        """
+        with self.layout.lock:
+            for name, value in changes.items():
+                if name not in self.settings:
+                    raise TypeError("unknown output setting {}".format(name))
+                setattr(self, name, value)
+            self.announce(self.proxies)
+            self.layout.moved(self)
+
+    def release(self, proxy):
+        self.destroy(proxy)
+        proxy.display.send_delete_id(proxy.obj_id)
+
+    def destroy(self, proxy):
+        with self.layout.lock:
+            if proxy in self.proxies:
+                self.proxies.remove(proxy)
+
+    def update(self):
+        pass
+
+    def proxies_of(self, client):
+        """ the proxies of the output in a server.Client """
+        return [proxy for proxy in self.proxies if proxy.display is client]
+
+    def add_damage(self, rectangle, now=None):
+        """ redraw rectangle, in layout coordinates, at the next repaint """
+        with self.layout.lock:
+            rectangle = intersection(rectangle, self.area())
+            if rectangle is not None:
+                add_damage(self.damage, rectangle, self.max_rectangles)
+                self.schedule(now)
+
+    def add_frame(self, callback, now=None):
+        """ send done to a wl_callback at the next repaint """
+        with self.layout.lock:
+            self.frames.append(callback)
+            self.schedule(now)
+
+    def schedule(self, now=None):
+        """ repaint at the next refresh, with the layout lock held
+
+        That is right away if the last repaint was more than a period ago,
+        otherwise when the period since it ends, so repaints keep to the
+        refresh rate of the output.
+
+        """
+        if self.next_repaint is not None:
+            return
+        if now is None:
+            now = time.monotonic()
+        last = self.last_repaint
+        if last is None or now - last >= self.period:
+            self.next_repaint = now
+        else:
+            self.next_repaint = last + self.period
+
+    def repaint(self, now=None):
+        """ render the damage and send done to the frame callbacks """
+        if now is None:
+            now = time.monotonic()
+        with self.layout.lock:
+            damage, self.damage = self.damage, []
+            frames, self.frames = self.frames, []
+            scheduled = self.next_repaint
+            self.next_repaint = None
+            # keep to the refresh phase unless the repaint is late by a period
+            self.last_repaint = scheduled if scheduled is not None and now - scheduled < self.period else now
+            self.repaints += 1
+        if damage:
+            self.render(damage)
+        timestamp = milliseconds(now)
+        for callback in frames:
+            client = callback.display
+            if client.alive and callback.obj_id in client.objects:
+                callback.send_done(timestamp)
+                client.send_delete_id(callback.obj_id)
+
+    def render(self, damage):
+        """ draw the damaged rectangles, in layout coordinates
+
+        Compositors override this.  Called by repaint without any lock held.
+
+        """
+        pass
+
+
+class Layout(object):
+    """ the outputs of a compositor and the surfaces shown on them
+
+    surfaces maps every surface placed to its area in the layout and the
+    set of outputs it overlaps.  lock guards the layout and its outputs,
+    since surfaces are placed by the threads dispatching their clients.
+
+    """
+    def __init__(self, display):
+        self.display = display
+        self.lock = threading.RLock()
+        self.outputs = []
+        self.surfaces = {}
+
+    def add_output(self, output):
+        """ show output to the clients as a new global, returning its name """
+        with self.lock:
+            self.outputs.append(output)
+            name = self.display.add_global(output)
+            self.moved(output)
+        return name
+
+    def remove_output(self, output):
+        """ withdraw output, moving its waiting frame callbacks to the other outputs """
+        with self.lock:
+            self.display.remove_global(output)
+            self.outputs.remove(output)
+            for surface, (area, outputs) in self.surfaces.items():
+                if output in outputs:
+                    outputs.discard(output)
+                    for proxy in output.proxies_of(surface.display):
+                        surface.send_leave(proxy)
+            frames, output.frames = output.frames, []
+            output.next_repaint = None
+        for callback in frames:
+            self.add_frame(None, callback)
+
+    def moved(self, output):
+        """ recompute the surfaces on output after it changed, and repaint it all """
+        with self.lock:
+            output_area = output.area()
+            for surface, (area, outputs) in self.surfaces.items():
+                self.update_outputs(surface, area, outputs)
+            output.add_damage(output_area)
+
+    def place(self, surface, x, y, width, height):
+        """ show surface at (x, y) with a size, repainting where it was and where it is """
+        with self.lock:
+            area = (x, y, width, height)
+            previous = self.surfaces.get(surface)
+            if previous is None:
+                outputs = set()
+            else:
+                outputs = previous[1]
+                self.damage(*previous[0])
+            self.surfaces[surface] = (area, outputs)
+            self.update_outputs(surface, area, outputs)
+            self.damage(*area)
+
+    def remove(self, surface):
+        """ stop showing surface, e.g. when it is destroyed or unmapped """
+        with self.lock:
+            previous = self.surfaces.pop(surface, None)
+            if previous is not None:
+                self.damage(*previous[0])
+
+    def update_outputs(self, surface, area, outputs):
+        """ send enter and leave for the outputs surface newly overlaps or left, with the lock held """
+        current = {output for output in self.outputs if intersection(area, output.area()) is not None}
+        client = surface.display
+        for output in outputs - current:
+            for proxy in output.proxies_of(client):
+                surface.send_leave(proxy)
+        for output in current - outputs:
+            for proxy in output.proxies_of(client):
+                surface.send_enter(proxy)
+        outputs.clear()
+        outputs.update(current)
+
+    def outputs_of(self, surface):
+        """ the outputs surface is shown on """
+        with self.lock:
+            entry = self.surfaces.get(surface)
+            return set(entry[1]) if entry is not None else set()
+
+    def damage(self, x, y, width, height, now=None):
+        """ repaint a rectangle of the layout, on every output it overlaps """
+        with self.lock:
+            for output in self.outputs:
+                output.add_damage((x, y, width, height), now)
+
+    def damage_surface(self, surface, x, y, width, height, now=None):
+        """ repaint a rectangle of a placed surface, in its own coordinates """
+        with self.lock:
+            entry = self.surfaces.get(surface)
+            if entry is None:
+                return
+            area = entry[0]
+            rectangle = intersection((area[0] + x, area[1] + y, width, height), area)
+            if rectangle is not None:
+                self.damage(*rectangle, now=now)
+
+    def add_frame(self, surface, callback, now=None):
+        """ send done to callback, a frame callback of surface, when it is next shown
+
+        That is at the next repaint of the output showing most of the
+        surface, or of any output if it is not shown, or right away
+        without outputs.
+
+        """
+        with self.lock:
+            entry = self.surfaces.get(surface)
+            output = None
+            if entry is not None and entry[1]:
+                area = entry[0]
+                output = max(entry[1], key=lambda o: self.overlap(area, o))
+            elif self.outputs:
+                output = self.outputs[0]
+            if output is not None:
+                output.add_frame(callback, now)
+                return
+        if now is None:
+            now = time.monotonic()
+        callback.send_done(milliseconds(now))
+        callback.display.send_delete_id(callback.obj_id)
+
+    @staticmethod
+    def overlap(area, output):
+        common = intersection(area, output.area())
+        return common[2] * common[3] if common is not None else 0
+
+    def timeout(self, now=None):
+        """ seconds until the next repaint is due, None if none is scheduled """
+        with self.lock:
+            due = [output.next_repaint for output in self.outputs if output.next_repaint is not None]
+        if not due:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return max(0, min(due) - now)
+
+    def repaint(self, now=None):
+        """ repaint the outputs that are due, returning how many were """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            due = [output for output in self.outputs if output.next_repaint is not None and output.next_repaint <= now]
+        for output in due:
+            output.repaint(now)
+        return len(due)
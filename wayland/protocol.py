@@ -0,0 +1,229 @@
+"""
+    Wire signatures of the wayland core and xdg-shell interfaces.
+
+    Every interface maps to a tuple of its requests and a tuple of its events,
+    in opcode order, each a (name, signature) pair using the libwayland type
+    codes: i int, u uint, f fixed, s string, o object, n new_id, a array and
+    h fd, with ? marking a nullable string or object.
+
+    Also the limits of the wire format that both sides read with.
+"""
+
+import array
+import socket
+import struct
+
+interfaces = {
+    "wl_display": (
+        (("sync", "n"), ("get_registry", "n")),
+        (("error", "ous"), ("delete_id", "u"))),
+    "wl_registry": (
+        (("bind", "usun"),),
+        (("global", "usu"), ("global_remove", "u"))),
+    "wl_callback": (
+        (),
+        (("done", "u"),)),
+    "wl_compositor": (
+        (("create_surface", "n"), ("create_region", "n")),
+        ()),
+    "wl_shm_pool": (
+        (("create_buffer", "niiiiu"), ("destroy", ""), ("resize", "i")),
+        ()),
+    "wl_shm": (
+        (("create_pool", "nhi"),),
+        (("format", "u"),)),
+    "wl_buffer": (
+        (("destroy", ""),),
+        (("release", ""),)),
+    "wl_data_offer": (
+        (("accept", "u?s"), ("receive", "sh"), ("destroy", ""), ("finish", ""), ("set_actions", "uu")),
+        (("offer", "s"), ("source_actions", "u"), ("action", "u"))),
+    "wl_data_source": (
+        (("offer", "s"), ("destroy", ""), ("set_actions", "u")),
+        (("target", "?s"), ("send", "sh"), ("cancelled", ""), ("dnd_drop_performed", ""), ("dnd_finished", ""),
+         ("action", "u"))),
+    "wl_data_device": (
+        (("start_drag", "?oo?ou"), ("set_selection", "?ou"), ("release", "")),
+        (("data_offer", "n"), ("enter", "uoff?o"), ("leave", ""), ("motion", "uff"), ("drop", ""),
+         ("selection", "?o"))),
+    "wl_data_device_manager": (
+        (("create_data_source", "n"), ("get_data_device", "no")),
+        ()),
+    "wl_shell": (
+        (("get_shell_surface", "no"),),
+        ()),
+    "wl_shell_surface": (
+        (("pong", "u"), ("move", "ou"), ("resize", "ouu"), ("set_toplevel", ""), ("set_transient", "oiiu"),
+         ("set_fullscreen", "uu?o"), ("set_popup", "ouoiiu"), ("set_maximized", "?o"), ("set_title", "s"),
+         ("set_class", "s")),
+        (("ping", "u"), ("configure", "uii"), ("popup_done", ""))),
+    "wl_surface": (
+        (("destroy", ""), ("attach", "?oii"), ("damage", "iiii"), ("frame", "n"), ("set_opaque_region", "?o"),
+         ("set_input_region", "?o"), ("commit", ""), ("set_buffer_transform", "i"), ("set_buffer_scale", "i"),
+         ("damage_buffer", "iiii")),
+        (("enter", "o"), ("leave", "o"))),
+    "wl_seat": (
+        (("get_pointer", "n"), ("get_keyboard", "n"), ("get_touch", "n"), ("release", "")),
+        (("capabilities", "u"), ("name", "s"))),
+    "wl_pointer": (
+        (("set_cursor", "u?oii"), ("release", "")),
+        (("enter", "uoff"), ("leave", "uo"), ("motion", "uff"), ("button", "uuuu"), ("axis", "uuf"), ("frame", ""),
+         ("axis_source", "u"), ("axis_stop", "uu"), ("axis_discrete", "ui"))),
+    "wl_keyboard": (
+        (("release", ""),),
+        (("keymap", "uhu"), ("enter", "uoa"), ("leave", "uo"), ("key", "uuuu"), ("modifiers", "uuuuu"),
+         ("repeat_info", "ii"))),
+    "wl_touch": (
+        (("release", ""),),
+        (("down", "uuoiff"), ("up", "uui"), ("motion", "uiff"), ("frame", ""), ("cancel", ""), ("shape", "iff"),
+         ("orientation", "if"))),
+    "wl_output": (
+        (("release", ""),),
+        (("geometry", "iiiiissi"), ("mode", "uiii"), ("done", ""), ("scale", "i"))),
+    "wl_region": (
+        (("destroy", ""), ("add", "iiii"), ("subtract", "iiii")),
+        ()),
+    "wl_subcompositor": (
+        (("destroy", ""), ("get_subsurface", "noo")),
+        ()),
+    "wl_subsurface": (
+        (("destroy", ""), ("set_position", "ii"), ("place_above", "o"), ("place_below", "o"), ("set_sync", ""),
+         ("set_desync", "")),
+        ()),
+    "zxdg_shell_v6": (
+        (("destroy", ""), ("create_positioner", "n"), ("get_xdg_surface", "no"), ("pong", "u")),
+        (("ping", "u"),)),
+    "zxdg_positioner_v6": (
+        (("destroy", ""), ("set_size", "ii"), ("set_anchor_rect", "iiii"), ("set_anchor", "u"), ("set_gravity", "u"),
+         ("set_constraint_adjustment", "u"), ("set_offset", "ii")),
+        ()),
+    "zxdg_surface_v6": (
+        (("destroy", ""), ("get_toplevel", "n"), ("get_popup", "noo"), ("set_window_geometry", "iiii"),
+         ("ack_configure", "u")),
+        (("configure", "u"),)),
+    "zxdg_toplevel_v6": (
+        (("destroy", ""), ("set_parent", "?o"), ("set_title", "s"), ("set_app_id", "s"), ("show_window_menu", "ouii"),
+         ("move", "ou"), ("resize", "ouu"), ("set_max_size", "ii"), ("set_min_size", "ii"), ("set_maximized", ""),
+         ("unset_maximized", ""), ("set_fullscreen", "?o"), ("unset_fullscreen", ""), ("set_minimized", "")),
+        (("configure", "iia"), ("close", ""))),
+    "zxdg_popup_v6": (
+        (("destroy", ""), ("grab", "ou")),
+        (("configure", "iiii"), ("popup_done", ""))),
+    "xdg_shell": (
+        (("destroy", ""), ("use_unstable_version", "i"), ("get_xdg_surface", "no"), ("get_xdg_popup", "nooouii"),
+         ("pong", "u")),
+        (("ping", "u"),)),
+    "xdg_surface": (
+        (("destroy", ""), ("set_parent", "?o"), ("set_title", "s"), ("set_app_id", "s"), ("show_window_menu", "ouii"),
+         ("move", "ou"), ("resize", "ouu"), ("ack_configure", "u"), ("set_window_geometry", "iiii"),
+         ("set_maximized", ""), ("unset_maximized", ""), ("set_fullscreen", "?o"), ("unset_fullscreen", ""),
+         ("set_minimized", "")),
+        (("configure", "iiau"), ("close", ""))),
+    "xdg_popup": (
+        (("destroy", ""),),
+        (("popup_done", ""),)),
+}
+
+# interfaces of the objects created by new_id arguments, wl_registry.bind
+# carries its interface on the wire instead
+new_ids = {
+    ("wl_display", "sync"): "wl_callback",
+    ("wl_display", "get_registry"): "wl_registry",
+    ("wl_compositor", "create_surface"): "wl_surface",
+    ("wl_compositor", "create_region"): "wl_region",
+    ("wl_shm_pool", "create_buffer"): "wl_buffer",
+    ("wl_shm", "create_pool"): "wl_shm_pool",
+    ("wl_data_device", "data_offer"): "wl_data_offer",
+    ("wl_data_device_manager", "create_data_source"): "wl_data_source",
+    ("wl_data_device_manager", "get_data_device"): "wl_data_device",
+    ("wl_shell", "get_shell_surface"): "wl_shell_surface",
+    ("wl_surface", "frame"): "wl_callback",
+    ("wl_seat", "get_pointer"): "wl_pointer",
+    ("wl_seat", "get_keyboard"): "wl_keyboard",
+    ("wl_seat", "get_touch"): "wl_touch",
+    ("wl_subcompositor", "get_subsurface"): "wl_subsurface",
+    ("zxdg_shell_v6", "create_positioner"): "zxdg_positioner_v6",
+    ("zxdg_shell_v6", "get_xdg_surface"): "zxdg_surface_v6",
+    ("zxdg_surface_v6", "get_toplevel"): "zxdg_toplevel_v6",
+    ("zxdg_surface_v6", "get_popup"): "zxdg_popup_v6",
+    ("xdg_shell", "get_xdg_surface"): "xdg_surface",
+    ("xdg_shell", "get_xdg_popup"): "xdg_popup",
+}
+
+REQUESTS = 0
+EVENTS = 1
+
+# the most fds libwayland sends with one sendmsg, and so the most a reader
+# has to make room for in one recvmsg
+MAX_FDS = 28
+CONTROL_SIZE = socket.CMSG_SPACE(MAX_FDS * array.array("i").itemsize)
+# receive buffers start this small and grow while reads fill them
+MIN_READ = 4096
+MAX_READ = 65536
+
+
+def receive(connection, buffer, flags=0):
+    """ one recvmsg into buffer, returning (size, fds, truncated)
+
+    size is 0 at the end of the connection; BlockingIOError is raised when
+    nothing is available.  truncated tells that the kernel dropped fds
+    because the control buffer was too small.
+
+    """
+    size, ancdata, msg_flags, address = connection.recvmsg_into([buffer], CONTROL_SIZE, flags)
+    fds = array.array("i")
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    return size, fds, bool(msg_flags & socket.MSG_CTRUNC)
+
+
+def message(interface, direction, opcode):
+    """ the (name, signature) of a message, or None if it is unknown """
+    messages = interfaces.get(interface)
+    if messages is None or opcode >= len(messages[direction]):
+        return None
+    return messages[direction][opcode]
+
+
+def argument_types(signature):
+    return signature.replace("?", "")
+
+
+def count_fds(signature):
+    return signature.count("h")
+
+
+def unpack_arguments(signature, data, fds):
+    """ decode the wire arguments of a message
+
+    Objects and new ids are returned as ids, strings as str (or None),
+    fixed values as float and arrays as bytes.  fd arguments are read from
+    the front of the fds list without removing them.
+
+    """
+    args = []
+    offset = 0
+    fd_index = 0
+    for code in argument_types(signature):
+        if code in "uon":
+            args.append(struct.unpack_from("I", data, offset)[0])
+            offset += 4
+        elif code == "i":
+            args.append(struct.unpack_from("i", data, offset)[0])
+            offset += 4
+        elif code == "f":
+            args.append(struct.unpack_from("i", data, offset)[0] / 256)
+            offset += 4
+        elif code in "sa":
+            length = struct.unpack_from("I", data, offset)[0]
+            offset += 4
+            value = bytes(data[offset:offset+length])
+            offset += (length + 3) & ~3
+            if code == "s":
+                value = value[:-1].decode("utf-8") if length else None
+            args.append(value)
+        elif code == "h":
+            args.append(fds[fd_index] if fd_index < len(fds) else None)
+            fd_index += 1
+    return args
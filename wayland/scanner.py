@@ -91,24 +91,27 @@ def handle_request(request, index, wayland, server=False):
         if name == "id":
             name = (new_id.get("interface") or "wl_compositor")[3:]
         wayland.write("        {} = {}(self.display, new_id)\n".format(name, cls))
-    wayland.write("        self.display.out_queue.append((self.pack_arguments({}".format(index))
-    fds = []
+    fds = [arg for arg in arguments if arg.get("type") == "fd"]
+    if fds:
+        # fds go with the message as it is written, see arena.Arena
+        wayland.write("        self.display.out_queue.write(self.pack_arguments({}".format(index))
+    else:
+        wayland.write("        self.display.out_queue.pack(self, {}".format(index))
     for i, arg in enumerate(arguments):
         if arg.get("type") == "new_id":
             wayland.write(", new_id")
-        elif arg.get("type") == "fd":
-            fds.append(arg)
-            continue
-        else:
+        elif arg.get("type") != "fd":
             wayland.write(", {}".format(arg.get("name")))
-    wayland.write("), (")
-    for i, fd in enumerate(fds):
-        wayland.write(fd.get("name"))
-        if i < len(fds) - 1:
-            wayland.write(", ")
-        elif len(fds) == 1:
-            wayland.write(",")
-    wayland.write(")))\n")
+    if fds:
+        wayland.write("), (")
+        for i, fd in enumerate(fds):
+            wayland.write(fd.get("name"))
+            if i < len(fds) - 1:
+                wayland.write(", ")
+            elif len(fds) == 1:
+                wayland.write(",")
+        wayland.write(")")
+    wayland.write(")\n")
     if new_id is not None:
         wayland.write("        return {}\n".format(name))
 
@@ -0,0 +1,273 @@
+"""
+    Compositing on a render thread, from immutable scene snapshots.
+
+    The protocol side of a compositor describes what to show as a Scene:
+    its layers, bottom to top, each a buffer's pixels at a position, and
+    the damage since the previous scene.  Scenes are taken when clients
+    commit and published to a Renderer, which composites them into its
+    framebuffer on its own thread with NumPy.  Array copies release the
+    GIL, so a large blit does not hold up reading and dispatching client
+    requests, nor a busy client the blit.
+
+    Layers read the clients' shm memory directly, so a buffer is released
+    to its client only once no published scene uses it anymore and the
+    renderer is done drawing those that did.  Scenes published faster than
+    they are drawn are merged: the renderer draws the latest, with the
+    damage of all of them.
+
+        renderer = Renderer(1920, 1080)
+        # on every commit, from the thread dispatching the client
+        renderer.publish(Scene(tuple(layers), ((x, y, width, height),)))
+
+    A Layer of a wl_shm buffer views its pool with shm_pixels.
+
+    Given a concurrent.futures executor, the renderer splits the damage
+    into tiles and composites them in parallel.  ARGB8888 layers, whose
+    pixels are premultiplied, are blended over what is below them and
+    opaque XRGB8888 ones copied, starting from the topmost opaque layer
+    covering a tile.
+"""
+
+import sys
+import threading
+from collections import namedtuple
+
+import numpy
+
+from .coalesce import add_damage
+from .output import intersection
+
+# buffer is the server.Buffer to release once it is not drawn anymore,
+# pixels a (height, width, 4) uint8 array of its BGRA pixels, opaque
+# whether its alpha channel is to be ignored, as for XRGB8888
+Layer = namedtuple("Layer", "buffer pixels x y opaque")
+
+# layers is a tuple of Layer, bottom to top, and damage a tuple of
+# (x, y, width, height) rectangles of the framebuffer to redraw
+Scene = namedtuple("Scene", "layers damage")
+
+
+def shm_pixels(data, offset, width, height, stride):
+    """ a (height, width, 4) view of the pixels of a wl_shm buffer in pool memory data, without a copy """
+    return numpy.ndarray((height, width, 4), numpy.uint8, buffer=data, offset=offset, strides=(stride, 4, 1))
+
+
+def layer_area(layer):
+    height, width = layer.pixels.shape[:2]
+    return layer.x, layer.y, width, height
+
+
+def covers(area, rectangle):
+    return (area[0] <= rectangle[0] and area[1] <= rectangle[1] and
+            rectangle[0] + rectangle[2] <= area[0] + area[2] and rectangle[1] + rectangle[3] <= area[1] + area[3])
+
+
+def tiles(damage, width, height, size):
+    """ the part of damage in each size x size tile of a width x height framebuffer
+
+    Each is the bounding box of the damage in its tile, so tiles never
+    overlap and can be drawn at the same time.
+
+    """
+    boxes = {}
+    for rectangle in damage:
+        rectangle = intersection(rectangle, (0, 0, width, height))
+        if rectangle is None:
+            continue
+        x, y, w, h = rectangle
+        for top in range(y // size * size, y + h, size):
+            for left in range(x // size * size, x + w, size):
+                part = intersection(rectangle, (left, top, size, size))
+                if part is None:
+                    continue
+                box = boxes.get((left, top))
+                if box is not None:
+                    right = max(box[0] + box[2], part[0] + part[2])
+                    bottom = max(box[1] + box[3], part[1] + part[3])
+                    part = (min(box[0], part[0]), min(box[1], part[1]))
+                    part += (right - part[0], bottom - part[1])
+                boxes[left, top] = part
+    return list(boxes.values())
+
+
+class Renderer(object):
+    """ composite published scenes into framebuffer on a thread of its own
+
+    framebuffer is a (height, width, 4) uint8 array.  pending is the
+    scene to draw next, None if there is none, drawing the one being
+    drawn and current the last one drawn.  users counts the published
+    scenes not yet retired that use each buffer.  frames counts the
+    scenes drawn, and merged those superseded before they were.  error is
+    the exception the last scene that could not be drawn raised, e.g.
+    from a shm pool its client truncated, None if there was none.
+
+    """
+    # damage rectangles kept before they are merged into their bounding box
+    max_rectangles = 32
+    # side of the tiles composited in parallel
+    tile_size = 256
+
+    def __init__(self, width, height, executor=None):
+        self.framebuffer = numpy.zeros((height, width, 4), numpy.uint8)
+        self.executor = executor
+        self.condition = threading.Condition()
+        self.pending = None
+        self.drawing = None
+        self.current = None
+        self.users = {}
+        self.frames = 0
+        self.merged = 0
+        self.error = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def publish(self, scene):
+        """ draw scene next, instead of and with the damage of the one waiting if any """
+        with self.condition:
+            for buffer in {layer.buffer for layer in scene.layers}:
+                self.users[buffer] = self.users.get(buffer, 0) + 1
+            pending = self.pending
+            if pending is not None:
+                damage = list(pending.damage)
+                for rectangle in scene.damage:
+                    add_damage(damage, rectangle, self.max_rectangles)
+                scene = scene._replace(damage=tuple(damage))
+                self.merged += 1
+                self.retire(pending)
+            self.pending = scene
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                scene = self.drawing = self.pending
+                self.pending = None
+            error = None
+            try:
+                self.composite(scene)
+            except Exception as e:
+                error = e
+            finally:
+                # even if drawing failed, so that wait returns and buffers are released
+                with self.condition:
+                    previous, self.current = self.current, scene
+                    self.drawing = None
+                    if error is None:
+                        self.frames += 1
+                    else:
+                        self.error = error
+                    self.condition.notify_all()
+                    if previous is not None:
+                        self.retire(previous)
+            if error is None:
+                self.presented(scene)
+            else:
+                self.failed(scene, error)
+
+    def retire(self, scene):
+        """ scene will not be drawn again, with the condition held: release the buffers no other uses """
+        users = self.users
+        for buffer in {layer.buffer for layer in scene.layers}:
+            users[buffer] -= 1
+            if not users[buffer]:
+                del users[buffer]
+                self.release(buffer)
+
+    def release(self, buffer):
+        """ give buffer back to its client, called from the thread retiring its last scene """
+        client = buffer.display
+        if client.alive and client.objects.get(buffer.obj_id) is buffer:
+            buffer.send_release()
+
+    def composite(self, scene):
+        """ redraw the damage of scene into the framebuffer, tile by tile, from the render thread """
+        height, width = self.framebuffer.shape[:2]
+        parts = tiles(scene.damage, width, height, self.tile_size)
+        layers = [(layer, layer_area(layer)) for layer in scene.layers]
+        if self.executor is None or len(parts) < 2:
+            for part in parts:
+                self.composite_tile(layers, part)
+        else:
+            # NumPy releases the GIL while it copies and blends
+            for result in self.executor.map(lambda part: self.composite_tile(layers, part), parts):
+                pass
+
+    def composite_tile(self, layers, rectangle):
+        """ redraw a rectangle from layers, a list of (layer, area) bottom to top """
+        x, y, w, h = rectangle
+        target = self.framebuffer[y:y+h, x:x+w]
+        # nothing under an opaque layer covering the whole tile shows
+        first = 0
+        for i in range(len(layers) - 1, -1, -1):
+            layer, area = layers[i]
+            if layer.opaque and covers(area, rectangle):
+                first = i
+                break
+        else:
+            target[:] = 0
+        for layer, area in layers[first:]:
+            common = intersection(rectangle, area)
+            if common is None:
+                continue
+            left, top, w, h = common
+            sx, sy = left - layer.x, top - layer.y
+            source = layer.pixels[sy:sy+h, sx:sx+w]
+            destination = target[top-y:top-y+h, left-x:left-x+w]
+            if layer.opaque:
+                destination[:] = source
+                destination[..., 3] = 255
+                continue
+            # most tiles of a window are opaque or, around its shadow, empty
+            lowest = source[..., 3].min()
+            if lowest == 255:
+                destination[:] = source
+            elif lowest or source.any():
+                # premultiplied: source + destination * (1 - source alpha)
+                alpha = 255 - source[..., 3:4].astype(numpy.uint16)
+                blended = destination * alpha
+                blended += 127
+                blended //= 255
+                blended += source
+                numpy.minimum(blended, 255, out=blended)
+                destination[:] = blended
+
+    def presented(self, scene):
+        """ scene is in the framebuffer, e.g. to show it or send frame callbacks
+
+        Compositors override this.  Called from the render thread.
+
+        """
+        pass
+
+    def failed(self, scene, error):
+        """ composite raised error drawing scene, which is partly in the framebuffer
+
+        Compositors override this, e.g. to disconnect the client whose
+        buffer could not be read.  By default the error is printed.  Called
+        from the render thread, which goes on with the next scene.
+
+        """
+        sys.excepthook(type(error), error, error.__traceback__)
+
+    def wait(self, timeout=None):
+        """ wait until every published scene is drawn, returning whether they are """
+        with self.condition:
+            done = lambda: (self.pending is None and self.drawing is None) or not self.running
+            return self.condition.wait_for(done, timeout)
+
+    def close(self):
+        """ stop the render thread, releasing the buffers of the scenes left """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        with self.condition:
+            for scene in (self.pending, self.current):
+                if scene is not None:
+                    self.retire(scene)
+            self.pending = self.current = None
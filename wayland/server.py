@@ -30,152 +30,531 @@ import os
 import socket
 import array
 import select
+import time
 import struct
+import threading
+from collections import deque
 
 import mmap
 
-from .base import WaylandObject
+from . import protocol
+from .arena import Arena
+from .base import WaylandObject, Fd, ignored, release_fds, discard_fds
+from .trace import get_tracer, ignore
 
 
 class Display(object):
-    def __init__(self, *global_objects):
-        self.global_objects = global_objects
+    """ a compositor socket and its clients
+
+    Scheduling: handle_requests gives every ready client a turn of at most
+    message_budget requests or time_budget seconds, in an order that
+    rotates between calls.  Requests left over wait in the client for its
+    next turn, so one client flooding requests delays the others by one
+    turn at most.  Client.queueing_delay tells how long clients waited.
+
+    Threading: each client is dispatched by one thread at a time, under
+    its lock, and only that thread reads its connection, decodes its
+    requests and runs their handlers.  Different clients may be dispatched
+    concurrently, e.g. by handle_requests with an executor.  Any thread
+    may send events to any client and create objects in it: events are
+    appended to out_queue and sent by the thread flushing the client.
+    Global objects are shared by all clients, so their handlers must guard
+    state that several clients change, like DataDeviceManager does.
+
+    Globals: the global_objects given are named 0, 1, ... in order, and
+    add_global and remove_global change them at any time, e.g. on output
+    hotplug.  Names are never reused.  The registries of all clients are
+    tracked, so the change is announced to each of them without looking
+    through the objects of every client.
+
+    """
+    def __init__(self, *global_objects, trace=None, record=None):
+        # the live globals by name, and the removed ones that clients may
+        # still bind until they hear about the removal
+        self.globals = dict(enumerate(global_objects))
+        self.removed_globals = {}
+        self.next_name = len(global_objects)
+        # every client's wl_registry objects
+        self.registries = set()
+        self.tracer = get_tracer("server", trace)
+        # a capture.Recorder attached to every client
+        self.recorder = record
         self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        if os.getenv("XDG_RUNTIME_DIR") is None:
-            os.putenv("XDG_RUNTIME_DIR", "/tmp")
-        prefix = os.getenv("XDG_RUNTIME_DIR")
+        prefix = os.environ.setdefault("XDG_RUNTIME_DIR", "/tmp")
         display = 0
         while os.path.exists(os.path.join(prefix, "wayland-{}".format(display))):
             display += 1
-        os.putenv("WAYLAND_DISPLAY", "wayland-{}".format(display))
+        os.environ["WAYLAND_DISPLAY"] = "wayland-{}".format(display)
         self.path = os.path.join(prefix, "wayland-{}".format(display))
         self.server.bind(self.path)
         os.chmod(self.path, 0o666)
         self.server.listen(5)
+        # guards clients and connections
+        self.lock = threading.Lock()
         self.clients = []
         self.connections = []
-
-    def handle_requests(self):
-        for c in self.clients:
+        # rotates the order clients get their turns in
+        self.turn = 0
+        # events packed by broadcast, without their object id
+        self.encoded = {}
+
+    # requests and seconds of a client's turn, None for no limit
+    message_budget = 64
+    time_budget = 0.001
+    # how many packed events broadcast keeps for reuse
+    max_encoded = 1024
+    # how many removed globals stay bindable, oldest forgotten first
+    max_removed_globals = 64
+
+    @property
+    def global_objects(self):
+        """ the live globals, in the order they were added """
+        with self.lock:
+            return tuple(self.globals.values())
+
+    def add_global(self, global_object):
+        """ make global_object available to the clients, returning its name """
+        with self.lock:
+            name = self.next_name
+            self.next_name += 1
+            self.globals[name] = global_object
+            # under the lock, so a registry being created hears of it once, in order
+            self.broadcast(self.registries, "global", name, global_object.name, global_object.version)
+        return name
+
+    def remove_global(self, global_object):
+        """ withdraw global_object, returning its name
+
+        Clients are told with wl_registry.global_remove.  Proxies already
+        bound stay valid until their clients destroy them, and binds sent
+        before the client heard of the removal still succeed, for the last
+        max_removed_globals removed.  Raises ValueError if global_object
+        is not a global.
+
+        """
+        with self.lock:
+            name = next((name for name, o in self.globals.items() if o is global_object), None)
+            if name is None:
+                raise ValueError("not a global")
+            del self.globals[name]
+            self.removed_globals[name] = global_object
+            if len(self.removed_globals) > self.max_removed_globals:
+                del self.removed_globals[next(iter(self.removed_globals))]
+            self.broadcast(self.registries, "global_remove", name)
+        return name
+
+    def handle_requests(self, timeout=0, executor=None):
+        """ wait up to timeout for requests, then give every client that sent some a turn
+
+        With an executor, e.g. a concurrent.futures.ThreadPoolExecutor, the
+        ready clients are dispatched on it concurrently and this returns
+        once all of them are done.
+
+        """
+        with self.lock:
+            clients = list(self.clients)
+        # clients with requests left from their last turn do not wait
+        if any(c.throttled for c in clients):
+            timeout = 0
+        for c in clients:
             if c.out_queue:
                 c.flush()
-        connections = [c.connection for c in self.clients] + [self.server]
-        active, *_ = select.select(connections, [], [], 0)
+        by_connection = {c.connection: c for c in clients if c.alive}
+        # clients that did not take all their events yet
+        blocked = [connection for connection, c in by_connection.items() if c.out_queue]
+        active, writable, _ = select.select(list(by_connection) + [self.server], blocked, [], timeout)
+        for w in writable:
+            by_connection[w].flush()
+        now = time.monotonic()
         for a in active:
             if a is self.server:
-                connection = self.server.accept()[0]
-                self.connections.append(connection)
-                self.clients.append(Client(self, connection))
-            else:
-                self.clients[connections.index(a)].dispatch()
+                self.add_client(self.server.accept()[0])
+            elif by_connection[a].ready_since is None:
+                by_connection[a].ready_since = now
+        ready = [c for c in by_connection.values() if c.ready_since is not None]
+        if not ready:
+            return
+        self.turn += 1
+        first = self.turn % len(ready)
+        ready = ready[first:] + ready[:first]
+        if executor is None or len(ready) < 2:
+            for c in ready:
+                self.serve(c)
+        else:
+            for result in executor.map(self.serve, ready):
+                pass
+
+    def serve(self, client):
+        """ give client its turn """
+        start = time.monotonic()
+        client.queued(start - client.ready_since)
+        client.ready_since = None
+        deadline = None if self.time_budget is None else start + self.time_budget
+        client.dispatch(self.message_budget, deadline)
+        if client.throttled:
+            client.ready_since = time.monotonic()
+
+    def broadcast(self, objects, event, *args):
+        """ send the same event to each of objects, packing it only once
+
+        objects are server objects of one interface in different clients,
+        usually the proxies of a global, e.g. on an output mode change:
+
+            display.broadcast(output_proxies, "mode", OutputProxy.CURRENT, 1920, 1080, 60000)
+
+        Every client is queued a copy of the packed event with its own
+        object id in the header.  Object arguments have different ids in
+        every client, so they cannot be broadcast.  Returns how many
+        objects were sent the event.
+
+        """
+        tail = None
+        sent = 0
+        for obj in objects:
+            client = obj.display
+            if not client.alive:
+                continue
+            if tail is None:
+                tail = self.encode(obj, event, args)
+            client.out_queue.write(struct.pack("I", obj.obj_id) + tail)
+            sent += 1
+        return sent
+
+    def encode(self, obj, event, args):
+        """ event packed as obj would send it, without the object id """
+        try:
+            key = (type(obj), event, args)
+            tail = self.encoded.get(key)
+        except TypeError:
+            # arrays are lists
+            key = tail = None
+        if tail is None:
+            if any(isinstance(argument, WaylandObject) for argument in args):
+                raise TypeError("object arguments cannot be broadcast")
+            tail = obj.pack_arguments(obj.requests.index(event), *args)[4:]
+            if key is not None:
+                if len(self.encoded) >= self.max_encoded:
+                    self.encoded.clear()
+                self.encoded[key] = tail
+        return tail
+
+    def overflow(self, client):
+        """ client's queued events went over its limits, see Client.max_queued_bytes
+
+        Compositors override this to choose what to do with clients that
+        stop reading.  By default coalescable events are dropped first, and
+        if that is not enough the client is disconnected with a no_memory
+        error, like libwayland does.
+
+        """
+        client.drop_coalescable()
+        if client.over_limits():
+            client.post_no_memory()
+
+    def add_client(self, connection):
+        """ serve a connected socket, e.g. one end of a socketpair """
+        client = Client(self, connection)
+        if self.recorder is not None:
+            self.recorder.attach(client)
+        with self.lock:
+            self.connections.append(connection)
+            self.clients.append(client)
+        return client
+
+    def close(self):
+        for c in list(self.clients):
+            c.clean_up()
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
 
 
 class Client(WaylandObject):
+    interface = "wl_display"
+    side = "server"
+
+    # events that may queue up while the client does not read before
+    # Display.overflow is called
+    max_queued_bytes = 4 * 1024 * 1024
+    max_queued_messages = 64 * 1024
+    # received fds no request claimed yet before the client is disconnected
+    max_incoming_fds = 4 * protocol.MAX_FDS
+    # events of which only the latest of each object matters
+    coalescable = {("wl_pointer", "motion"), ("wl_data_device", "motion")}
+
     def __init__(self, display, connection):
         self.real_display = display
         self.connection = connection
+        # held while dispatching and flushing, see Display
+        self.lock = threading.RLock()
+        # guards open_ids and ids, objects may be created from any thread
+        self.id_lock = threading.Lock()
         self.open_ids = []
         self.current_serial = 0
-        self.ids = iter(range(1, 0xffffffff))
-        WaylandObject.__init__(self, self, self.next_id())
-        self.objects = {self.obj_id: self}
-        self.out_queue = []
-        self.event_queue = []
+        self.ids = iter(range(0xff000000, 0xffffffff))
+        WaylandObject.__init__(self, self, 1)
+        # a client that stops reading must not block the compositor
+        connection.setblocking(False)
+        self.tracer = display.tracer
+        if self.tracer is None:
+            self.debug = ignore
+            self.objects = {self.obj_id: self}
+            self.out_queue = Arena()
+        else:
+            self.debug = self.tracer.debug
+            self.out_queue = self.tracer.queue(protocol.EVENTS)
+            self.objects = self.tracer.objects(protocol.REQUESTS, {self.obj_id: self}, self.out_queue)
+        self.event_queue = deque()
         self.incoming_fds = []
         self.previous_data = ""
+        self.read_buffer = memoryview(bytearray(protocol.MIN_READ))
+        # recvmsg calls that returned something
+        self.reads = 0
+        # fds received, sent and closed by the library, see open_fds
+        self.received_fds = 0
+        self.sent_fds = 0
+        self.closed_fds = 0
         self.alive = True
+        # requests left and deadline of the current turn, see Display
+        self.budget = None
+        self.deadline = None
+        # whether the last turn ended with requests left in previous_data
+        self.throttled = False
+        # when the client became ready for its next turn, or None
+        self.ready_since = None
+        self.turns = 0
+        self.total_delay = 0
+        self.max_delay = 0
 
     def next_id(self):
-        if self.open_ids:
-            return self.open_ids.pop(0)
-        return next(self.ids)
+        with self.id_lock:
+            if self.open_ids:
+                return self.open_ids.pop(0)
+            return next(self.ids)
 
-    def dispatch(self):
-        self.flush()
-        if self.alive:
-            self.recv()
-        # self.dispatch_pending()
+    def dispatch(self, budget=None, deadline=None):
+        """ handle the client's requests
+
+        Without a budget or a deadline this handles what one read returns.
+        With either, it reads until the socket is empty, budget requests
+        were handled or the deadline on time.monotonic passed; requests
+        left over are handled first on the next call.
+
+        """
+        with self.lock:
+            self.flush()
+            self.budget = budget
+            self.deadline = deadline
+            try:
+                if self.throttled:
+                    self.throttled = False
+                    self.process(self.previous_data)
+                # until a short read, when the socket is empty
+                limited = budget is not None or deadline is not None
+                while self.alive and not self.throttled and self.recv() and limited:
+                    pass
+            finally:
+                self.budget = None
+                self.deadline = None
+            # self.dispatch_pending()
+
+    def queued(self, delay):
+        """ record that a turn started delay seconds after the client was ready """
+        self.turns += 1
+        self.total_delay += delay
+        self.max_delay = max(self.max_delay, delay)
+
+    def queueing_delay(self):
+        """ mean and longest seconds the client waited for its turns """
+        return (self.total_delay / self.turns if self.turns else 0), self.max_delay
 
     def dispatch_pending(self):
-        while self.event_queue:
-            obj, event, args = self.event_queue.pop(0)
-            method_name = "handle_" + obj.events[event]
-            getattr(obj, method_name)(*args)
+        queue = self.event_queue
+        while queue:
+            obj, op, args = queue.popleft()
+            (obj.handlers or obj.bind_handlers())[op](*args)
 
     def recv(self):
+        """ read from the socket once, returning whether the read filled the buffer """
+        buffer = self.read_buffer
         try:
-            fds = array.array("i")
-            data, ancdata, msg_flags, address = self.connection.recvmsg(1024, socket.CMSG_SPACE(16 * fds.itemsize))
-            for cmsg_level, cmsg_type, cmsg_data in ancdata:
-                if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
-                    fds.fromstring(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
-            self.incoming_fds.extend(fds)
-            if data:
-                self.decode(data)
+            size, fds, truncated = protocol.receive(self.connection, buffer)
         except socket.error as e:
             if e.errno == 11:
-                return
+                return False
             elif e.errno == 32:
                 self.clean_up()
             elif e.errno == 104:
                 self.clean_up()
             else:
                 raise
+            return False
+        self.reads += 1
+        if fds:
+            self.received_fds += len(fds)
+            self.incoming_fds.extend(map(Fd, fds))
+        if truncated:
+            self.debug("more than {} fds in one read, disconnecting".format(protocol.MAX_FDS))
+            self.clean_up()
+            return False
+        if not size:
+            self.clean_up()
+            return False
+        self.decode(bytes(buffer[:size]))
+        # fds sent with a partly sent flush come before the requests owning
+        # them, so they are kept until they are claimed or the client goes
+        if self.alive and len(self.incoming_fds) > self.max_incoming_fds:
+            self.debug("more than {} fds waiting for their requests, disconnecting".format(self.max_incoming_fds))
+            self.clean_up()
+            return False
+        if size < len(buffer):
+            return False
+        if len(buffer) < protocol.MAX_READ:
+            self.read_buffer = memoryview(bytearray(len(buffer) * 2))
+        return True
 
     def decode(self, data):
         if self.previous_data:
             data = self.previous_data + data
-        while len(data) >= 8:
+        self.process(data)
+
+    def process(self, data):
+        """ handle the complete requests in data, within the budget of the turn """
+        budget = self.budget
+        deadline = self.deadline
+        handled = 0
+        # until a handler disconnects the client
+        while len(data) >= 8 and self.alive:
             obj_id, sizeop = struct.unpack("II", data[:8])
             size = sizeop >> 16
             op = sizeop & 0xFFFF
 
             if len(data) < size:
                 break
+            # at least one request is handled past the deadline, so every turn makes progress
+            if ((budget is not None and budget <= 0) or
+                    (handled and deadline is not None and time.monotonic() > deadline)):
+                self.throttled = True
+                break
+            if budget is not None:
+                budget -= 1
+            handled += 1
             obj = self.objects.get(obj_id, None)
             if obj is not None:
+                handlers = obj.handlers or obj.bind_handlers()
+                if op < len(handlers) and handlers[op] is ignored:
+                    if self.incoming_fds:
+                        self.closed_fds += discard_fds(obj.interface, protocol.REQUESTS, op, self.incoming_fds)
+                    data = data[size:]
+                    continue
                 args = obj.unpack_event(op, data[8:size], self.incoming_fds)
-                if isinstance(args, bytes):
-                    print("Unhandled event: {} #{}".format(obj, op))
-                elif hasattr(obj.unpack_event, "base"):
-                    print("Unhandled event: {} all".format(obj, op))
+                if isinstance(args, bytes) or hasattr(obj.unpack_event, "base"):
+                    self.debug("Unhandled event: {} #{}".format(obj, op))
+                    if self.incoming_fds:
+                        self.closed_fds += discard_fds(obj.interface, protocol.REQUESTS, op, self.incoming_fds)
                 else:
-                    method_name = "handle_" + obj.events[op]
-                    getattr(obj, method_name)(*args)
+                    (obj.handlers or obj.bind_handlers())[op](*args)
                 data = data[size:]
             else:
                 raise Exception("Error: Bad Object {} ({})".format(obj_id, self.objects))
         self.previous_data = data
+        if budget is not None:
+            self.budget = budget
 
     def flush(self):
-        while self.out_queue:
-            data, fds = self.out_queue.pop(0)
-            try:
-                sent = self.connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
-                while sent < len(data):
-                    print(sent)
-                    sent += self.connection.send(data[sent:])
-                    # for fd in fds:
-                    #     os.close(fd)
-            except socket.error as e:
-                if e.errno == 11:
-                    print(e.args)
-                    self.out_queue.insert(0, (data, fds))
-                elif e.errno == 32:
-                    self.clean_up()
-                elif e.errno == 9:
-                    self.clean_up()
-                elif e.errno == 104:
-                    self.clean_up()
-                else:
+        """ send the queued events until the socket would block
+
+        Events that could not be sent stay queued in order, with the unsent
+        end of a partly sent one first, and the queue limits are checked.
+        Returns whether everything was sent.
+
+        """
+        with self.lock:
+            out_queue = self.out_queue
+            while out_queue and self.alive:
+                data, fds = out_queue.segment()
+                try:
+                    sent = self.connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+                                                   if fds else [])
+                except socket.error as e:
+                    if e.errno == 11:
+                        break
+                    elif e.errno in (9, 32, 104):
+                        self.clean_up()
+                        return False
                     raise
+                # the fds went with the first byte
+                out_queue.consume(sent)
+                if fds:
+                    # the kernel has its own references now
+                    self.sent_fds += len(fds)
+                    self.closed_fds += release_fds(fds)
+                if sent < len(data):
+                    self.debug(sent)
+                    break
+            if out_queue and self.alive and self.over_limits():
+                self.real_display.overflow(self)
+            return not out_queue
+
+    def over_limits(self):
+        return (self.out_queue.count > self.max_queued_messages or
+                len(self.out_queue) > self.max_queued_bytes)
+
+    def drop_coalescable(self):
+        """ drop every queued coalescable event but the latest of each object """
+        def choose(messages, buffer):
+            latest = set()
+            dropped = []
+            for offset, size, fds in reversed(messages):
+                if fds:
+                    continue
+                obj_id, sizeop = struct.unpack_from("II", buffer, offset)
+                obj = self.objects.get(obj_id)
+                entry = protocol.message(getattr(obj, "interface", None), protocol.EVENTS, sizeop & 0xffff)
+                if entry is None or (obj.interface, entry[0]) not in self.coalescable:
+                    continue
+                if (obj_id, entry[0]) in latest:
+                    dropped.append(offset)
+                else:
+                    latest.add((obj_id, entry[0]))
+            return dropped
+        return len(self.out_queue.drop(choose))
+
+    def post_no_memory(self):
+        """ disconnect with a no_memory error, dropping the queued events """
+        # all but the end of a partly sent one
+        for fds in self.out_queue.drop(lambda messages, buffer: [offset for offset, size, fds in messages]):
+            self.closed_fds += release_fds(fds)
+        self.send_error(self.obj_id, self.NO_MEMORY, "no memory")
+        try:
+            self.connection.send(self.out_queue.pending()[0])
+        except socket.error:
+            pass
+        self.clean_up()
+
+    def post_error(self, object_id, code, message):
+        """ disconnect with a protocol error, after sending what can be sent """
+        self.send_error(object_id, code, message)
+        self.flush()
+        self.clean_up()
+
+    def open_fds(self):
+        """ how many fds the library holds open, received or waiting to be sent """
+        queued = sum(1 for fd in self.out_queue.queued_fds() if getattr(fd, "owned", True))
+        return len(self.incoming_fds) + queued
 
     def clean_up(self):
+        self.alive = False
         self.connection.close()
-        if self in self.real_display.clients:
-            self.real_display.clients.remove(self)
-        if self.connection in self.real_display.connections:
-            self.real_display.connections.remove(self.connection)
+        for fds in self.out_queue.clear():
+            self.closed_fds += release_fds(fds)
+        self.closed_fds += release_fds(self.incoming_fds)
+        del self.incoming_fds[:]
+        with self.real_display.lock:
+            if self in self.real_display.clients:
+                self.real_display.clients.remove(self)
+            if self.connection in self.real_display.connections:
+                self.real_display.connections.remove(self.connection)
         if self.obj_id in self.objects:
             del self.objects[self.obj_id]
         for o in self.objects:
@@ -237,7 +616,7 @@ class Client(WaylandObject):
         of the error, for (debugging) convenience.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, object_id, code, message), ()))
+        self.display.out_queue.pack(self, 0, object_id, code, message)
 
     # global error values
     INVALID_OBJECT = 0
@@ -255,7 +634,7 @@ class Client(WaylandObject):
         
         """
         del self.objects[obj_id]
-        self.display.out_queue.append((self.pack_arguments(1, obj_id), ()))
+        self.display.out_queue.pack(self, 1, obj_id)
 
     def destroy(self):
         self.alive = False
@@ -266,10 +645,16 @@ class Client(WaylandObject):
 
 
 class Registry(WaylandObject):
+    interface = "wl_registry"
+
     def __init__(self, display, obj_id):
         WaylandObject.__init__(self, display, obj_id)
-        for i, o in enumerate(self.display.real_display.global_objects):
-            self.send_global(i, o.name, o.version)
+        real_display = self.display.real_display
+        with real_display.lock:
+            real_display.registries.add(self)
+            for name, o in real_display.globals.items():
+                # the same for every client, so packed once
+                real_display.broadcast((self,), "global", name, o.name, o.version)
 
     def handle_bind(self, name, obj_id, version):
         """ bind an object to the display
@@ -278,8 +663,16 @@ class Registry(WaylandObject):
         specified name as the identifier.
         
         """
-        real = self.display.real_display.global_objects[name]
-        print(real.name, real.version - version)
+        real_display = self.display.real_display
+        with real_display.lock:
+            real = real_display.globals.get(name)
+            if real is None:
+                # the client may not have heard of its removal yet
+                real = real_display.removed_globals.get(name)
+        if real is None:
+            self.display.post_error(self.obj_id, self.display.INVALID_OBJECT, "invalid global {}".format(name))
+            return
+        self.display.debug(real.name, real.version - version)
         self.display.objects[obj_id] = real.proxy(self.display, obj_id, version, real)
 
     def send_global(self, name, interface, version):
@@ -292,7 +685,7 @@ class Registry(WaylandObject):
         given version of the given interface.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, name, interface, version), ()))
+        self.display.out_queue.pack(self, 0, name, interface, version)
 
     def send_global_remove(self, name):
         """ announce removal of global object
@@ -309,7 +702,7 @@ class Registry(WaylandObject):
         the global going away and a client sending a request to it.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, name), ()))
+        self.display.out_queue.pack(self, 1, name)
 
     def unpack_event(self, opcode, data, fds):
         name, interface_length = struct.unpack("II", data[:8])
@@ -319,13 +712,16 @@ class Registry(WaylandObject):
         return name, obj_id, version
 
     def destroy(self):
-        pass
+        real_display = self.display.real_display
+        with real_display.lock:
+            real_display.registries.discard(self)
 
     events = ['bind']
     requests = ['global', 'global_remove']
 
 
 class Callback(WaylandObject):
+    interface = "wl_callback"
 
     def send_done(self, callback_data):
         """ done event
@@ -333,7 +729,7 @@ class Callback(WaylandObject):
         Notify the client when the related request is done.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, callback_data), ()))
+        self.display.out_queue.pack(self, 0, callback_data)
 
     def destroy(self):
         pass
@@ -343,6 +739,7 @@ class Callback(WaylandObject):
 
 
 class CompositorProxy(WaylandObject):
+    interface = "wl_compositor"
     version = 4
 
     def __init__(self, display, obj_id, version, compositor):
@@ -378,6 +775,8 @@ class CompositorProxy(WaylandObject):
 
 
 class ShmPool(WaylandObject):
+    interface = "wl_shm_pool"
+
     def __init__(self, display, obj_id):
         WaylandObject.__init__(self, display, obj_id)
 
@@ -439,6 +838,7 @@ class ShmPool(WaylandObject):
 
 
 class ShmProxy(WaylandObject):
+    interface = "wl_shm"
     version = 1
 
     # wl_shm error values
@@ -532,7 +932,7 @@ class ShmProxy(WaylandObject):
         argb8888 and xrgb8888.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, format), ()))
+        self.display.out_queue.pack(self, 0, format)
 
     def unpack_event(self, op, data, fds):
         pool_id, size = struct.unpack("II", data)
@@ -546,6 +946,7 @@ class ShmProxy(WaylandObject):
 
 
 class Buffer(WaylandObject):
+    interface = "wl_buffer"
 
     def handle_destroy(self):
         """ destroy a buffer
@@ -575,7 +976,7 @@ class Buffer(WaylandObject):
         optimization for GL(ES) compositors with wl_shm clients.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def unpack_event(self, op, data, fds):
         return ()
@@ -588,11 +989,23 @@ class Buffer(WaylandObject):
 
 
 class DataOffer(WaylandObject):
+    interface = "wl_data_offer"
     INVALID_FINISH = 0
     INVALID_ACTION_MASK = 1
     INVALID_ACTION = 2
     INVALID_OFFER = 3
 
+    def __init__(self, display, obj_id, source=None, version=1):
+        WaylandObject.__init__(self, display, obj_id)
+        self.source = source
+        self.version = version
+        self.accepted = None
+        self.dnd_actions = 0
+        self.preferred_action = 0
+        self.action = 0
+        if source is not None:
+            source.offers.append(self)
+
     def handle_accept(self, serial, mime_type):
         """ accept one of the offered mime types
         
@@ -612,7 +1025,9 @@ class DataOffer(WaylandObject):
         conjunction with wl_data_source.action for feedback.
         
         """
-        raise NotImplementedError("DataOffer: Accept")
+        self.accepted = mime_type
+        if self.source is not None and self.source.dragging:
+            self.source.send_target(mime_type)
 
     def handle_receive(self, mime_type, fd):
         """ request that the data is transferred
@@ -634,7 +1049,12 @@ class DataOffer(WaylandObject):
         determine acceptance.
         
         """
-        raise NotImplementedError("DataOffer: Recieve")
+        if self.source is None:
+            os.close(fd)
+            return
+        # the pipe goes straight to the source client, data never passes through the compositor,
+        # and is closed here once it is sent
+        self.source.send_send(mime_type, fd)
 
     def handle_destroy(self):
         """ destroy data offer
@@ -642,7 +1062,8 @@ class DataOffer(WaylandObject):
         Destroy the data offer.
         
         """
-        raise NotImplementedError("DataOffer: Destroy")
+        self.destroy()
+        self.display.send_delete_id(self.obj_id)
 
     def send_offer(self, mime_type):
         """ advertise offered mime type
@@ -651,7 +1072,7 @@ class DataOffer(WaylandObject):
         event per offered mime type.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, mime_type), ()))
+        self.display.out_queue.pack(self, 0, mime_type)
 
     def handle_finish(self):
         """ the offer will no longer be used
@@ -669,7 +1090,8 @@ class DataOffer(WaylandObject):
         wl_data_offer.action.
         
         """
-        raise NotImplementedError("DataOffer: Finish")
+        if self.source is not None:
+            self.source.send_dnd_finished()
 
 
     def handle_set_actions(self, dnd_actions, preferred_action):
@@ -708,7 +1130,9 @@ class DataOffer(WaylandObject):
         will be raised otherwise.
         
         """
-        raise NotImplementedError("DataOffer: Set Actions")
+        self.dnd_actions = dnd_actions
+        self.preferred_action = preferred_action
+        self.update_action()
 
     def send_source_actions(self, source_actions):
         """ notify the source-side available actions
@@ -718,7 +1142,7 @@ class DataOffer(WaylandObject):
         side changes its offered actions through wl_data_source.set_actions.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, source_actions), ()))
+        self.display.out_queue.pack(self, 1, source_actions)
 
     def send_action(self, dnd_action):
         """ notify the selected action
@@ -760,22 +1184,63 @@ class DataOffer(WaylandObject):
         must happen before the call to wl_data_offer.finish.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, dnd_action), ()))
+        self.display.out_queue.pack(self, 2, dnd_action)
+
+    def update_action(self):
+        if self.source is None or self.version < 3:
+            return
+        actions = self.source.dnd_actions & self.dnd_actions
+        if self.preferred_action & actions:
+            action = self.preferred_action
+        else:
+            action = 0
+            for candidate in (DataDeviceManagerProxy.COPY, DataDeviceManagerProxy.MOVE, DataDeviceManagerProxy.ASK):
+                if actions & candidate:
+                    action = candidate
+                    break
+        if action != self.action:
+            self.action = action
+            self.send_action(action)
+            self.source.send_action(action)
 
     def unpack_event(self, op, data, fds):
+        if op == 0:
+            serial, length = struct.unpack("II", data[:8])
+            if length == 0:
+                return serial, None
+            return serial, data[8:7+length].decode("utf-8")
+        elif op == 1:
+            length = struct.unpack("I", data[:4])[0]
+            return data[4:3+length].decode("utf-8"), fds.pop(0)
+        elif op in (2, 3):
+            return ()
+        elif op == 4:
+            return struct.unpack("II", data)
         return super().unpack_event(op, data, fds)[2]
 
     def destroy(self):
-        self.handle_destroy()
+        if self.source is not None and self in self.source.offers:
+            self.source.offers.remove(self)
+        self.source = None
 
     events = ['accept', 'receive', 'destroy', 'finish', 'set_actions']
     requests = ['offer', 'source_actions', 'action']
 
 
 class DataSource(WaylandObject):
+    interface = "wl_data_source"
     INVALID_ACTION_MASK = 0
     INVALID_SOURCE = 1
 
+    def __init__(self, display, obj_id, manager=None, version=1):
+        WaylandObject.__init__(self, display, obj_id)
+        self.manager = manager
+        self.version = version
+        self.mime_types = []
+        self.dnd_actions = 0
+        self.dragging = False
+        self.offers = []
+
     def handle_offer(self, mime_type):
         """ add an offered mime type
         
@@ -784,7 +1249,7 @@ class DataSource(WaylandObject):
         multiple types.
         
         """
-        raise NotImplementedError("DataSource: Offer")
+        self.mime_types.append(mime_type)
 
     def handle_destroy(self):
         """ destroy the data source
@@ -792,7 +1257,8 @@ class DataSource(WaylandObject):
         Destroy the data source.
         
         """
-        raise NotImplementedError("DataSource: Destroy")
+        self.destroy()
+        self.display.send_delete_id(self.obj_id)
 
     def send_target(self, mime_type):
         """ a target accepts an offered mime type
@@ -803,7 +1269,7 @@ class DataSource(WaylandObject):
         Used for feedback during drag-and-drop.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, mime_type), ()))
+        self.display.out_queue.pack(self, 0, mime_type)
 
     def send_send(self, mime_type, fd):
         """ send the data
@@ -813,7 +1279,7 @@ class DataSource(WaylandObject):
         close it.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, mime_type), (fd,)))
+        self.display.out_queue.write(self.pack_arguments(1, mime_type), (fd,))
 
     def send_cancelled(self):
         """ selection was cancelled
@@ -840,7 +1306,7 @@ class DataSource(WaylandObject):
         source.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2), ()))
+        self.display.out_queue.pack(self, 2)
 
     def handle_set_actions(self, dnd_actions):
         """ set the available drag-and-drop actions
@@ -860,7 +1326,10 @@ class DataSource(WaylandObject):
         for drag-and-drop will raise a protocol error.
         
         """
-        raise NotImplementedError("DataSource: Set Actions")
+        self.dnd_actions = dnd_actions
+        for offer in self.offers:
+            offer.send_source_actions(dnd_actions)
+            offer.update_action()
 
     def send_dnd_drop_performed(self):
         """ the drag-and-drop operation physically finished
@@ -876,7 +1345,7 @@ class DataSource(WaylandObject):
         not be destroyed here.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3), ()))
+        self.display.out_queue.pack(self, 3)
 
     def send_dnd_finished(self):
         """ the drag-and-drop operation concluded
@@ -889,7 +1358,7 @@ class DataSource(WaylandObject):
         source can now delete the transferred data.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4), ()))
+        self.display.out_queue.pack(self, 4)
 
     def send_action(self, dnd_action):
         """ notify the selected action
@@ -921,21 +1390,39 @@ class DataSource(WaylandObject):
         they reflect the current action.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5, dnd_action), ()))
+        self.display.out_queue.pack(self, 5, dnd_action)
 
     def unpack_event(self, op, data, fds):
+        if op == 0:
+            length = struct.unpack("I", data[:4])[0]
+            return data[4:3+length].decode("utf-8"),
+        elif op == 1:
+            return ()
+        elif op == 2:
+            return struct.unpack("I", data)
         return super().unpack_event(op, data, fds)[2]
 
     def destroy(self):
-        self.handle_destroy()
+        for offer in self.offers:
+            offer.source = None
+        self.offers = []
+        if self.manager is not None:
+            self.manager.source_destroyed(self)
 
     events = ['offer', 'destroy', 'set_actions']
     requests = ['target', 'send', 'cancelled', 'dnd_drop_performed', 'dnd_finished', 'action']
 
 
 class DataDevice(WaylandObject):
+    interface = "wl_data_device"
     ROLE = 0
 
+    def __init__(self, display, obj_id, manager=None, seat=None, version=1):
+        WaylandObject.__init__(self, display, obj_id)
+        self.manager = manager
+        self.seat = seat
+        self.version = version
+
     def handle_start_drag(self, source, origin, icon, serial):
         """ start drag-and-drop operation
         
@@ -968,7 +1455,7 @@ class DataDevice(WaylandObject):
         undefined, and the wl_surface is unmapped.
         
         """
-        raise NotImplementedError("DataDevice: Start Drag")
+        self.manager.start_drag(self, source, origin, icon, serial)
 
     def handle_set_selection(self, source, serial):
         """ copy data to the selection
@@ -979,9 +1466,9 @@ class DataDevice(WaylandObject):
         To unset the selection, set the source to NULL.
         
         """
-        raise NotImplementedError("DataDevice: Set Selection")
+        self.manager.set_selection(self.seat, source, serial)
 
-    def send_data_offer(self):
+    def send_data_offer(self, source=None):
         """ introduce a new wl_data_offer
         
         The data_offer event introduces a new wl_data_offer object,
@@ -994,9 +1481,9 @@ class DataDevice(WaylandObject):
         
         """
         new_id = self.display.next_id()
-        data_offer = DataOffer(self.display, new_id)
+        data_offer = DataOffer(self.display, new_id, source, self.version)
         self.display.objects[new_id] = data_offer
-        self.display.out_queue.append((self.pack_arguments(0, new_id), ()))
+        self.display.out_queue.pack(self, 0, new_id)
         return data_offer
 
     def send_enter(self, serial, surface, x, y, id):
@@ -1008,7 +1495,7 @@ class DataDevice(WaylandObject):
         coordinates.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, serial, surface, x, y, id), ()))
+        self.display.out_queue.pack(self, 1, serial, surface, x, y, id)
 
     def send_leave(self):
         """ end drag-and-drop session
@@ -1018,7 +1505,7 @@ class DataDevice(WaylandObject):
         wl_data_offer introduced at enter time at this point.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2), ()))
+        self.display.out_queue.pack(self, 2)
 
     def send_motion(self, time, x, y):
         """ drag-and-drop session motion
@@ -1029,7 +1516,7 @@ class DataDevice(WaylandObject):
         coordinates.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3, time, x, y), ()))
+        self.display.out_queue.pack(self, 3, time, x, y)
 
     def send_drop(self):
         """ end drag-and-drop session successfully
@@ -1049,7 +1536,7 @@ class DataDevice(WaylandObject):
         to cancel the operation.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4), ()))
+        self.display.out_queue.pack(self, 4)
 
     def send_selection(self, id):
         """ advertise new selection
@@ -1067,7 +1554,7 @@ class DataDevice(WaylandObject):
         this event.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5, id), ()))
+        self.display.out_queue.pack(self, 5, id)
 
     def handle_release(self):
         """ destroy data device
@@ -1075,19 +1562,40 @@ class DataDevice(WaylandObject):
         This request destroys the data device.
         
         """
-        raise NotImplementedError("DataDevice: Release")
+        self.destroy()
+        self.display.send_delete_id(self.obj_id)
+
+    def offer(self, source):
+        """ introduce a source to this client, returning the new offer """
+        offer = self.send_data_offer(source)
+        for mime_type in source.mime_types:
+            offer.send_offer(mime_type)
+        if self.version >= 3 and source.dragging:
+            offer.send_source_actions(source.dnd_actions)
+        return offer
 
     def unpack_event(self, op, data, fds):
+        if op == 0:
+            source, origin, icon, serial = struct.unpack("IIII", data)
+            return (self.display.objects.get(source), self.display.objects[origin],
+                    self.display.objects.get(icon), serial)
+        elif op == 1:
+            source, serial = struct.unpack("II", data)
+            return self.display.objects.get(source), serial
+        elif op == 2:
+            return ()
         return super().unpack_event(op, data, fds)[2]
 
     def destroy(self):
-        pass
+        if self.manager is not None:
+            self.manager.device_destroyed(self)
 
     events = ['start_drag', 'set_selection', 'release']
     requests = ['data_offer', 'enter', 'leave', 'motion', 'drop', 'selection']
 
 
 class DataDeviceManagerProxy(WaylandObject):
+    interface = "wl_data_device_manager"
 
     def __init__(self, display, obj_id, version, data_device_manager):
         super().__init__(display, obj_id)
@@ -1130,7 +1638,196 @@ class DataDeviceManagerProxy(WaylandObject):
     requests = []
 
 
+class DataDrag(object):
+    def __init__(self, device, source, origin, icon):
+        self.device = device
+        self.source = source
+        self.origin = origin
+        self.icon = icon
+        self.surface = None
+        self.targets = []
+
+
+class DataDeviceManager(object):
+    """ wl_data_device_manager global
+
+    Routes the selection and drag-and-drop sessions of every seat between
+    clients.  Receive requests on an offer are forwarded to the source
+    client with the receiving client's pipe, so the data itself never
+    passes through the compositor.
+
+    Compositors call set_keyboard_focus when a client gains keyboard focus,
+    and drag_motion, drag_drop and cancel_drag from their pointer handling
+    while a drag started by a client is active.  They may do so from any
+    thread.
+
+    """
+    name = "wl_data_device_manager"
+    version = 3
+    proxy = DataDeviceManagerProxy
+
+    def __init__(self, display):
+        self.display = display
+        # clients dispatched on different threads share this global
+        self.lock = threading.RLock()
+        self.devices = {}
+        self.selections = {}
+        self.focus = {}
+        self.drags = {}
+
+    def setup(self, proxy):
+        pass
+
+    def update(self):
+        pass
+
+    def destroy(self, proxy):
+        pass
+
+    def create_data_source(self, proxy, obj_id):
+        proxy.display.objects[obj_id] = DataSource(proxy.display, obj_id, self, proxy.version)
+
+    def get_data_device(self, proxy, obj_id, seat):
+        with self.lock:
+            device = DataDevice(proxy.display, obj_id, self, seat.seat, proxy.version)
+            proxy.display.objects[obj_id] = device
+            self.devices.setdefault(device.seat, []).append(device)
+            if self.selections.get(device.seat) is not None and device in self.selection_targets(device.seat):
+                self.send_selection(device)
+
+    def selection_targets(self, seat):
+        focus = self.focus.get(seat)
+        return [d for d in self.devices.get(seat, ()) if focus is None or d.display is focus]
+
+    def send_selection(self, device):
+        source = self.selections.get(device.seat)
+        if source is None:
+            device.send_selection(None)
+        else:
+            device.send_selection(device.offer(source))
+
+    def set_selection(self, seat, source, serial):
+        with self.lock:
+            old = self.selections.get(seat)
+            if old is source:
+                return
+            if old is not None:
+                old.send_cancelled()
+            self.selections[seat] = source
+            for device in self.selection_targets(seat):
+                self.send_selection(device)
+
+    def set_keyboard_focus(self, seat, client):
+        """ the keyboard focus of seat moved to client (a server.Client or None) """
+        with self.lock:
+            if self.focus.get(seat) is client:
+                return
+            self.focus[seat] = client
+            for device in self.devices.get(seat, ()):
+                if device.display is client:
+                    self.send_selection(device)
+
+    def start_drag(self, device, source, origin, icon, serial):
+        with self.lock:
+            self.cancel_drag(device.seat)
+            if source is not None:
+                source.dragging = True
+            self.drags[device.seat] = DataDrag(device, source, origin, icon)
+
+    def drag_motion(self, seat, surface, x, y, time):
+        """ move an active drag over surface, returns False when no drag is active """
+        with self.lock:
+            drag = self.drags.get(seat)
+            if drag is None:
+                return False
+            if surface is not drag.surface:
+                self.drag_leave(drag)
+                if surface is not None:
+                    self.drag_enter(seat, drag, surface, x, y)
+            else:
+                for device, offer in drag.targets:
+                    device.send_motion(time, float(x), float(y))
+            return True
+
+    def drag_enter(self, seat, drag, surface, x, y):
+        drag.surface = surface
+        client = surface.display
+        if drag.source is None and client is not drag.device.display:
+            return
+        serial = client.get_serial()
+        for device in self.devices.get(seat, ()):
+            if device.display is client:
+                offer = device.offer(drag.source) if drag.source is not None else None
+                device.send_enter(serial, surface, float(x), float(y), offer)
+                drag.targets.append((device, offer))
+                if offer is not None:
+                    offer.update_action()
+
+    def drag_leave(self, drag):
+        for device, offer in drag.targets:
+            device.send_leave()
+        if drag.targets and drag.source is not None:
+            drag.source.send_target(None)
+        drag.targets = []
+        drag.surface = None
+
+    def drag_drop(self, seat):
+        """ the implicit grab of the drag on seat was released """
+        with self.lock:
+            drag = self.drags.pop(seat, None)
+            if drag is None:
+                return
+            source = drag.source
+            accepted = [(device, offer) for device, offer in drag.targets
+                        if offer is None or (offer.accepted is not None and (offer.version < 3 or offer.action))]
+            if source is None or accepted:
+                for device, offer in accepted:
+                    device.send_drop()
+                if source is not None and source.version >= 3:
+                    source.send_dnd_drop_performed()
+            elif source is not None and source.version >= 3:
+                source.send_cancelled()
+            self.drag_leave(drag)
+            if source is not None:
+                source.dragging = False
+
+    def cancel_drag(self, seat):
+        with self.lock:
+            drag = self.drags.pop(seat, None)
+            if drag is None:
+                return
+            self.drag_leave(drag)
+            if drag.source is not None:
+                drag.source.dragging = False
+                if drag.source.version >= 3:
+                    drag.source.send_cancelled()
+
+    def source_destroyed(self, source):
+        with self.lock:
+            for seat, selection in list(self.selections.items()):
+                if selection is source:
+                    self.selections[seat] = None
+                    for device in self.selection_targets(seat):
+                        device.send_selection(None)
+            for seat, drag in list(self.drags.items()):
+                if drag.source is source:
+                    drag.source = None
+                    self.drags.pop(seat)
+                    self.drag_leave(drag)
+
+    def device_destroyed(self, device):
+        with self.lock:
+            if device in self.devices.get(device.seat, ()):
+                self.devices[device.seat].remove(device)
+            drag = self.drags.get(device.seat)
+            if drag is not None:
+                drag.targets = [(d, o) for d, o in drag.targets if d is not device]
+                if drag.device is device:
+                    self.cancel_drag(device.seat)
+
+
 class ShellProxy(WaylandObject):
+    interface = "wl_shell"
     version = 1
 
     ROLE = 0
@@ -1164,6 +1861,7 @@ class ShellProxy(WaylandObject):
 
 
 class ShellSurface(WaylandObject):
+    interface = "wl_shell_surface"
 
     def handle_pong(self, serial):
         """ respond to a ping event
@@ -1367,7 +2065,7 @@ class ShellSurface(WaylandObject):
         requests. A client is expected to reply with a pong request.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial), ()))
+        self.display.out_queue.pack(self, 0, serial)
 
     def send_configure(self, edges, width, height):
         """ suggest resize
@@ -1391,7 +2089,7 @@ class ShellSurface(WaylandObject):
         in surface-local coordinates.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, edges, width, height), ()))
+        self.display.out_queue.pack(self, 1, edges, width, height)
 
     def send_popup_done(self):
         """ popup interaction is done
@@ -1401,7 +2099,7 @@ class ShellSurface(WaylandObject):
         to the client owning the popup surface.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2), ()))
+        self.display.out_queue.pack(self, 2)
 
     def unpack_event(self, op, data, fds):
         if op == 1:
@@ -1428,6 +2126,7 @@ class ShellSurface(WaylandObject):
 
 
 class Surface(WaylandObject):
+    interface = "wl_surface"
 
     # wl_surface error values
     INVALID_SCALE = 0
@@ -1648,7 +2347,7 @@ class Surface(WaylandObject):
         Note that a surface may be overlapping with zero or more outputs.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, output), ()))
+        self.display.out_queue.pack(self, 0, output)
 
     def send_leave(self, output):
         """ surface leaves an output
@@ -1658,7 +2357,7 @@ class Surface(WaylandObject):
         of an output.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, output), ()))
+        self.display.out_queue.pack(self, 1, output)
 
     def handle_set_buffer_transform(self, transform):
         """ sets the buffer transformation
@@ -1803,6 +2502,7 @@ class Surface(WaylandObject):
 
 
 class SeatProxy(WaylandObject):
+    interface = "wl_seat"
     version = 6
 
     # seat capability bitmask
@@ -1845,7 +2545,7 @@ class SeatProxy(WaylandObject):
         keyboard and touch capabilities, respectively.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, capabilities), ()))
+        self.display.out_queue.pack(self, 0, capabilities)
 
     def handle_get_pointer(self, id):
         """ return pointer object
@@ -1897,7 +2597,7 @@ class SeatProxy(WaylandObject):
         the seat configuration used by the compositor.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, name), ()))
+        self.display.out_queue.pack(self, 1, name)
 
     def handle_release(self):
         """ release the seat object
@@ -1922,6 +2622,7 @@ class SeatProxy(WaylandObject):
 
 
 class Pointer(WaylandObject):
+    interface = "wl_pointer"
     ROLE = 0
 
     buttons = [0, 272, 274, 273]
@@ -1975,7 +2676,7 @@ class Pointer(WaylandObject):
         an appropriate pointer image with the set_cursor request.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial, surface, surface_x, surface_y), ()))
+        self.display.out_queue.pack(self, 0, serial, surface, surface_x, surface_y)
 
     def send_leave(self, serial, surface):
         """ leave event
@@ -1987,7 +2688,7 @@ class Pointer(WaylandObject):
         for the new focus.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, serial, surface), ()))
+        self.display.out_queue.pack(self, 1, serial, surface)
 
     def send_motion(self, time, surface_x, surface_y):
         """ pointer motion event
@@ -1997,7 +2698,7 @@ class Pointer(WaylandObject):
         focused surface.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, time, surface_x, surface_y), ()))
+        self.display.out_queue.pack(self, 2, time, surface_x, surface_y)
 
     # physical button state
     RELEASED = 0
@@ -2022,7 +2723,7 @@ class Pointer(WaylandObject):
         protocol.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3, serial, time, button, state), ()))
+        self.display.out_queue.pack(self, 3, serial, time, button, state)
 
     # axis types
     VERTICAL_SCROLL = 0
@@ -2049,7 +2750,7 @@ class Pointer(WaylandObject):
         scroll distance.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4, time, axis, value), ()))
+        self.display.out_queue.pack(self, 4, time, axis, value)
 
     def handle_release(self):
         """ release the pointer object
@@ -2102,7 +2803,7 @@ class Pointer(WaylandObject):
         groups.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5), ()))
+        self.display.out_queue.pack(self, 5)
 
     # axis source types
     WHEEL = 0
@@ -2140,7 +2841,7 @@ class Pointer(WaylandObject):
         not guaranteed.
         
         """
-        self.display.out_queue.append((self.pack_arguments(6, axis_source), ()))
+        self.display.out_queue.pack(self, 6, axis_source)
 
     def send_axis_stop(self, time, axis):
         """ axis stop event
@@ -2161,7 +2862,7 @@ class Pointer(WaylandObject):
         preceding wl_pointer.axis event.
         
         """
-        self.display.out_queue.append((self.pack_arguments(7, time, axis), ()))
+        self.display.out_queue.pack(self, 7, time, axis)
 
     def send_axis_discrete(self, axis, discrete):
         """ axis click event
@@ -2194,7 +2895,7 @@ class Pointer(WaylandObject):
         not guaranteed.
         
         """
-        self.display.out_queue.append((self.pack_arguments(8, axis, discrete), ()))
+        self.display.out_queue.pack(self, 8, axis, discrete)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -2215,6 +2916,7 @@ class Pointer(WaylandObject):
 
 
 class Keyboard(WaylandObject):
+    interface = "wl_keyboard"
 
     # keyboard mapping format
     NO_KEYMAP = 0
@@ -2227,7 +2929,7 @@ class Keyboard(WaylandObject):
         memory-mapped to provide a keyboard mapping description.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, format, size), (fd,)))
+        self.display.out_queue.write(self.pack_arguments(0, format, size), (fd,))
 
     def send_enter(self, serial, surface, keys):
         """ enter event
@@ -2236,7 +2938,7 @@ class Keyboard(WaylandObject):
         surface.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, serial, surface, keys), ()))
+        self.display.out_queue.pack(self, 1, serial, surface, keys)
 
     def send_leave(self, serial, surface):
         """ leave event
@@ -2248,7 +2950,7 @@ class Keyboard(WaylandObject):
         for the new focus.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, serial, surface), ()))
+        self.display.out_queue.pack(self, 2, serial, surface)
 
     # physical key state
     RELEASED = 0
@@ -2262,7 +2964,7 @@ class Keyboard(WaylandObject):
         granularity, with an undefined base.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3, serial, time, key, state), ()))
+        self.display.out_queue.pack(self, 3, serial, time, key, state)
 
     def send_modifiers(self, serial, mods_depressed, mods_latched, mods_locked, group):
         """ modifier and group state
@@ -2271,7 +2973,7 @@ class Keyboard(WaylandObject):
         changed, and it should update its local state.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4, serial, mods_depressed, mods_latched, mods_locked, group), ()))
+        self.display.out_queue.pack(self, 4, serial, mods_depressed, mods_latched, mods_locked, group)
 
     def handle_release(self):
         """ release the keyboard object"""
@@ -2294,7 +2996,7 @@ class Keyboard(WaylandObject):
         of wl_keyboard.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5, rate, delay), ()))
+        self.display.out_queue.pack(self, 5, rate, delay)
 
     def unpack_event(self, op, data, fds):
         return ()
@@ -2307,6 +3009,7 @@ class Keyboard(WaylandObject):
 
 
 class Touch(WaylandObject):
+    interface = "wl_touch"
 
     def send_down(self, serial, time, surface, id, x, y):
         """ touch down event and beginning of a touch sequence
@@ -2317,7 +3020,7 @@ class Touch(WaylandObject):
         reused in the future.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial, time, surface, id, x, y), ()))
+        self.display.out_queue.pack(self, 0, serial, time, surface, id, x, y)
 
     def send_up(self, serial, time, id):
         """ end of a touch event sequence
@@ -2327,7 +3030,7 @@ class Touch(WaylandObject):
         reused in a future touch down event.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, serial, time, id), ()))
+        self.display.out_queue.pack(self, 1, serial, time, id)
 
     def send_motion(self, time, id, x, y):
         """ update of touch point coordinates
@@ -2335,7 +3038,7 @@ class Touch(WaylandObject):
         A touch point has changed coordinates.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, time, id, x, y), ()))
+        self.display.out_queue.pack(self, 2, time, id, x, y)
 
     def send_frame(self):
         """ end of touch frame event
@@ -2350,7 +3053,7 @@ class Touch(WaylandObject):
         previously known state.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3), ()))
+        self.display.out_queue.pack(self, 3)
 
     def send_cancel(self):
         """ touch session cancelled
@@ -2363,7 +3066,7 @@ class Touch(WaylandObject):
         this surface may reuse the touch point ID.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4), ()))
+        self.display.out_queue.pack(self, 4)
 
     def handle_release(self):
         """ release the touch object"""
@@ -2399,7 +3102,7 @@ class Touch(WaylandObject):
         shape if it did not receive this event.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5, id, major, minor), ()))
+        self.display.out_queue.pack(self, 5, id, major, minor)
 
     def send_orientation(self, id, orientation):
         """ update orientation of touch point
@@ -2429,7 +3132,7 @@ class Touch(WaylandObject):
         orientation reports.
         
         """
-        self.display.out_queue.append((self.pack_arguments(6, id, orientation), ()))
+        self.display.out_queue.pack(self, 6, id, orientation)
 
     def unpack_event(self, op, data, fds):
         return super().unpack_event(op, data, fds)[2]
@@ -2442,6 +3145,7 @@ class Touch(WaylandObject):
 
 
 class OutputProxy(WaylandObject):
+    interface = "wl_output"
     version = 3
 
     # subpixel geometry information
@@ -2476,7 +3180,7 @@ class OutputProxy(WaylandObject):
         any of the properties change.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, x, y, physical_width, physical_height, subpixel, make, model, transform), ()))
+        self.display.out_queue.pack(self, 0, x, y, physical_width, physical_height, subpixel, make, model, transform)
 
     # mode information
     CURRENT = 0x1
@@ -2500,7 +3204,7 @@ class OutputProxy(WaylandObject):
         or transformed, as described in wl_output.transform.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, flags, width, height, refresh), ()))
+        self.display.out_queue.pack(self, 1, flags, width, height, refresh)
 
     def send_done(self):
         """ sent all information about output
@@ -2512,7 +3216,7 @@ class OutputProxy(WaylandObject):
         atomic, even if they happen via multiple events.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2), ()))
+        self.display.out_queue.pack(self, 2)
 
     def send_scale(self, factor):
         """ output scaling properties
@@ -2537,7 +3241,7 @@ class OutputProxy(WaylandObject):
         a higher detail image.
         
         """
-        self.display.out_queue.append((self.pack_arguments(3, factor), ()))
+        self.display.out_queue.pack(self, 3, factor)
 
     def handle_release(self):
         """ release the output object
@@ -2559,6 +3263,7 @@ class OutputProxy(WaylandObject):
 
 
 class Region(WaylandObject):
+    interface = "wl_region"
 
     def handle_destroy(self):
         """ destroy region
@@ -2598,6 +3303,7 @@ class Region(WaylandObject):
 
 
 class SubcompositorProxy(WaylandObject):
+    interface = "wl_subcompositor"
     version = 1
 
     def __init__(self, display, obj_id, version, subcompositor):
@@ -2647,6 +3353,7 @@ class SubcompositorProxy(WaylandObject):
 
 
 class Subsurface(WaylandObject):
+    interface = "wl_subsurface"
 
     def handle_destroy(self):
         """ remove sub-surface interface
@@ -2806,6 +3513,7 @@ class Subsurface(WaylandObject):
 
 
 class ZxdgShellV6Proxy(WaylandObject):
+    interface = "zxdg_shell_v6"
     version = 1
 
     ROLE = 0
@@ -2886,7 +3594,7 @@ class ZxdgShellV6Proxy(WaylandObject):
         always respond to any xdg_shell object it created.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial), ()))
+        self.display.out_queue.pack(self, 0, serial)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -2907,6 +3615,7 @@ class ZxdgShellV6Proxy(WaylandObject):
 
 
 class ZxdgPositionerV6(WaylandObject):
+    interface = "zxdg_positioner_v6"
     INVALID_INPUT = 0
 
     def handle_destroy(self):
@@ -3063,6 +3772,7 @@ class ZxdgPositionerV6(WaylandObject):
 
 
 class ZxdgSurfaceV6(WaylandObject):
+    interface = "zxdg_surface_v6"
     NOT_CONSTRUCTED = 1
     ALREADY_CONSTRUCTED = 2
     UNCONFIGURED_BUFFER = 3
@@ -3178,7 +3888,7 @@ class ZxdgSurfaceV6(WaylandObject):
         to one, it is free to discard all but the last event it received.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial), ()))
+        self.display.out_queue.pack(self, 0, serial)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -3201,6 +3911,8 @@ class ZxdgSurfaceV6(WaylandObject):
 
 
 class ZxdgToplevelV6(WaylandObject):
+    interface = "zxdg_toplevel_v6"
+
     def handle_destroy(self):
         """ destroy the xdg_toplevel
 
@@ -3548,7 +4260,7 @@ class ZxdgToplevelV6(WaylandObject):
         xdg_surface.configure and xdg_surface.ack_configure for details.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0, width, height, states), ()))
+        self.display.out_queue.pack(self, 0, width, height, states)
 
     def send_close(self):
         """ surface wants to be closed
@@ -3563,7 +4275,7 @@ class ZxdgToplevelV6(WaylandObject):
         a dialog to ask the user to save their data, etc.
 
         """
-        self.display.out_queue.append((self.pack_arguments(1), ()))
+        self.display.out_queue.pack(self, 1)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -3598,6 +4310,7 @@ class ZxdgToplevelV6(WaylandObject):
 
 
 class ZxdgPopupV6(WaylandObject):
+    interface = "zxdg_popup_v6"
     INVALID_GRAB = 0
 
     def handle_destroy(self):
@@ -3672,7 +4385,7 @@ class ZxdgPopupV6(WaylandObject):
         window geometry of the parent surface.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 0, x, y, width, height)
 
     def send_popup_done(self):
         """ popup interaction is done
@@ -3682,7 +4395,7 @@ class ZxdgPopupV6(WaylandObject):
         point.
 
         """
-        self.display.out_queue.append((self.pack_arguments(1), ()))
+        self.display.out_queue.pack(self, 1)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -3727,6 +4440,7 @@ class ZxdgPopupV6(WaylandObject):
 
 
 class XdgShellProxy(WaylandObject):
+    interface = "xdg_shell"
     # latest protocol version
     CURRENT = 5
     ROLE = 0
@@ -3813,7 +4527,7 @@ class XdgShellProxy(WaylandObject):
         always respond to any xdg_shell object it created.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial), ()))
+        self.display.out_queue.pack(self, 0, serial)
 
     def handle_pong(self, serial):
         """ respond to a ping event
@@ -3844,6 +4558,8 @@ class XdgShellProxy(WaylandObject):
 
 
 class XdgSurface(WaylandObject):
+    interface = "xdg_surface"
+
     def handle_destroy(self):
         """ Destroy the xdg_surface
 
@@ -4033,7 +4749,7 @@ class XdgSurface(WaylandObject):
         event it received.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0, width, height, states, serial), ()))
+        self.display.out_queue.pack(self, 0, width, height, states, serial)
 
     def handle_ack_configure(self, serial):
         """ ack a configure event
@@ -4187,7 +4903,7 @@ class XdgSurface(WaylandObject):
         a dialog to ask the user to save their data...
 
         """
-        self.display.out_queue.append((self.pack_arguments(1), ()))
+        self.display.out_queue.pack(self, 1)
 
     def unpack_event(self, op, data, fds):
         if op == 0:
@@ -4235,6 +4951,8 @@ class XdgSurface(WaylandObject):
 
 
 class XdgPopup(WaylandObject):
+    interface = "xdg_popup"
+
     def handle_destroy(self):
         """ remove xdg_popup interface
 
@@ -4255,7 +4973,7 @@ class XdgPopup(WaylandObject):
         point.
 
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def unpack_event(self, op, data, fds):
         return ()
@@ -0,0 +1,386 @@
+"""
+    Server side surfaces with sub-surfaces.
+
+    Surface implements the double-buffered state of wl_surface and the
+    sub-surface tree of wl_subcompositor.  A surface's children are kept
+    in its stack, bottom to top with the surface itself among them, and
+    their positions and stacking order change when the parent's state is
+    applied.  A synchronized sub-surface caches its commits until its
+    parent's state is applied, then applies them right after it, so the
+    whole tree changes at once.  The position of every surface relative
+    to the root of its tree is cached, and recomputed only for the
+    subtree whose position changed.
+
+    Compositors subclass Surface, create it in their wl_compositor
+    create_surface, and use Subcompositor as their wl_subcompositor
+    global.  Two methods are theirs to override: applied, called with
+    every state that becomes current, and damaged, called on the root of
+    a tree with the rectangles that changed, so only the changed subtree
+    is repainted:
+
+        class WindowSurface(subsurface.Surface):
+            def applied(self, state):
+                for callback in state.frames:
+                    layout.add_frame(self.root(), callback)
+
+            def damaged(self, rectangles):
+                for rectangle in rectangles:
+                    layout.damage_surface(self, *rectangle)
+"""
+
+from . import server
+
+# a region request that was not made
+UNCHANGED = object()
+
+
+class State(object):
+    """ what one commit of a surface applies
+
+    buffer and its attach offset (x, y) are set when attached is,
+    damage is in surface and buffer_damage in buffer coordinates, frames
+    are the server.Callback objects to send done once the state is shown.
+    The other attributes are None or UNCHANGED when not requested.
+
+    """
+    def __init__(self):
+        self.attached = False
+        self.buffer = None
+        self.x = 0
+        self.y = 0
+        self.damage = []
+        self.buffer_damage = []
+        self.frames = []
+        self.scale = None
+        self.transform = None
+        self.opaque_region = UNCHANGED
+        self.input_region = UNCHANGED
+
+    def merge(self, newer):
+        """ add the state of a later commit on top of this one """
+        if newer.attached:
+            self.attached = True
+            self.buffer = newer.buffer
+            self.x += newer.x
+            self.y += newer.y
+        self.damage.extend(newer.damage)
+        self.buffer_damage.extend(newer.buffer_damage)
+        self.frames.extend(newer.frames)
+        for name in ("scale", "transform"):
+            if getattr(newer, name) is not None:
+                setattr(self, name, getattr(newer, name))
+        for name in ("opaque_region", "input_region"):
+            if getattr(newer, name) is not UNCHANGED:
+                setattr(self, name, getattr(newer, name))
+
+
+class Surface(server.Surface):
+    """ a wl_surface that may have sub-surfaces, see the module
+
+    buffer, scale, transform and size (width, height) are the current
+    state, subsurface its Subsurface role, if any, and stack the
+    surface and its children, bottom to top.
+
+    """
+    def __init__(self, display, obj_id):
+        super().__init__(display, obj_id)
+        self.pending = State()
+        # commits of a synchronized sub-surface waiting for its parent
+        self.cached = None
+        self.buffer = None
+        self.scale = 1
+        self.transform = 0
+        self.size = (0, 0)
+        self.subsurface = None
+        self.stack = [self]
+        # the stack to apply with the next state, once a child was restacked
+        self.pending_stack = None
+        self.cached_origin = None
+
+    def handle_attach(self, buffer, x, y):
+        self.pending.attached = True
+        self.pending.buffer = buffer
+        self.pending.x += x
+        self.pending.y += y
+
+    def handle_damage(self, x, y, width, height):
+        self.pending.damage.append((x, y, width, height))
+
+    def handle_damage_buffer(self, x, y, width, height):
+        self.pending.buffer_damage.append((x, y, width, height))
+
+    def handle_frame(self, callback):
+        frame = server.Callback(self.display, callback)
+        self.display.objects[callback] = frame
+        self.pending.frames.append(frame)
+
+    def handle_set_opaque_region(self, region):
+        self.pending.opaque_region = region
+
+    def handle_set_input_region(self, region):
+        self.pending.input_region = region
+
+    def handle_set_buffer_scale(self, scale):
+        if scale < 1:
+            self.display.post_error(self.obj_id, self.INVALID_SCALE, "buffer scale {} is not positive".format(scale))
+            return
+        self.pending.scale = scale
+
+    def handle_set_buffer_transform(self, transform):
+        if not 0 <= transform <= 7:
+            self.display.post_error(self.obj_id, self.INVALID_TRANSFORM,
+                                    "invalid buffer transform {}".format(transform))
+            return
+        self.pending.transform = transform
+
+    def handle_commit(self):
+        state = self.pending
+        self.pending = State()
+        if self.synchronized():
+            if self.cached is None:
+                self.cached = state
+            else:
+                self.cached.merge(state)
+            return
+        if self.cached is not None:
+            self.cached.merge(state)
+            state, self.cached = self.cached, None
+        self.apply(state)
+
+    def handle_destroy(self):
+        self.destroy()
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        if self.subsurface is not None:
+            self.subsurface.unmap()
+        # the sub-surfaces are unmapped with their parent
+        for child in self.children():
+            child.subsurface.parent = None
+            child.invalidate_origin()
+        self.stack = [self]
+        self.pending_stack = None
+
+    @property
+    def parent(self):
+        return self.subsurface.parent if self.subsurface is not None else None
+
+    def children(self):
+        return [surface for surface in self.stack if surface is not self]
+
+    def root(self):
+        surface = self
+        while surface.parent is not None:
+            surface = surface.parent
+        return surface
+
+    def synchronized(self):
+        """ whether the surface or one of its ancestors is a synchronized sub-surface """
+        role = self.subsurface
+        while role is not None:
+            if role.sync:
+                return True
+            role = role.parent.subsurface if role.parent is not None else None
+        return False
+
+    def origin(self):
+        """ the position of the surface relative to the root of its tree """
+        if self.cached_origin is None:
+            parent = self.parent
+            if parent is None:
+                self.cached_origin = (0, 0)
+            else:
+                x, y = parent.origin()
+                self.cached_origin = (x + self.subsurface.x, y + self.subsurface.y)
+        return self.cached_origin
+
+    def invalidate_origin(self):
+        """ forget the origins of the surface and its subtree, after it moved """
+        self.cached_origin = None
+        for child in self.children():
+            child.invalidate_origin()
+
+    def walk(self):
+        """ the surfaces of the subtree, bottom to top """
+        for surface in self.stack:
+            if surface is self:
+                yield self
+            else:
+                yield from surface.walk()
+
+    def extents(self):
+        """ (x, y, width, height) of every surface of the subtree, relative to the root """
+        rectangles = []
+        for surface in self.walk():
+            x, y = surface.origin()
+            width, height = surface.size
+            if width and height:
+                rectangles.append((x, y, width, height))
+        return rectangles
+
+    def buffer_size(self, buffer):
+        """ the (width, height) of a buffer, in pixels """
+        return getattr(buffer, "width", 0), getattr(buffer, "height", 0)
+
+    def apply(self, state):
+        """ make state current, then what the parent's commit changed in the children """
+        damage = []
+        x, y = self.origin()
+        if state.scale is not None:
+            self.scale = state.scale
+        if state.transform is not None:
+            self.transform = state.transform
+        if state.attached:
+            self.buffer = state.buffer
+        size = (0, 0)
+        if self.buffer is not None:
+            width, height = self.buffer_size(self.buffer)
+            if self.transform & 1:
+                width, height = height, width
+            size = (width // self.scale, height // self.scale)
+        if size != self.size:
+            if self.size[0] and self.size[1]:
+                damage.append((x, y) + self.size)
+            self.size = size
+            if size[0] and size[1]:
+                damage.append((x, y) + size)
+        else:
+            damage.extend((x + dx, y + dy, width, height) for dx, dy, width, height in state.damage)
+            # buffer damage is close enough once scaled, transforms are left to the renderer
+            scale = self.scale
+            damage.extend((x + dx // scale, y + dy // scale, -(-width // scale), -(-height // scale))
+                          for dx, dy, width, height in state.buffer_damage)
+        if self.pending_stack is not None:
+            self.stack, self.pending_stack = self.pending_stack, None
+            damage.extend(rectangle for child in self.children() for rectangle in child.extents())
+        for child in self.children():
+            role = child.subsurface
+            if role.pending_position is not None:
+                damage.extend(child.extents())
+                (role.x, role.y), role.pending_position = role.pending_position, None
+                child.invalidate_origin()
+                damage.extend(child.extents())
+            if child.cached is not None and child.synchronized():
+                cached, child.cached = child.cached, None
+                child.apply(cached)
+        self.applied(state)
+        if damage:
+            self.root().damaged(damage)
+
+    def applied(self, state):
+        """ state just became current, e.g. take its buffer and frame callbacks """
+        pass
+
+    def damaged(self, rectangles):
+        """ the rectangles of the tree rooted at this surface that changed, relative to it """
+        pass
+
+
+class Subsurface(server.Subsurface):
+    """ the sub-surface role of a Surface
+
+    (x, y) is the position in the parent applied by its last commit, and
+    pending_position the one set since.  parent is None once the parent
+    was destroyed.
+
+    """
+    def __init__(self, display, obj_id, surface, parent):
+        super().__init__(display, obj_id)
+        self.surface = surface
+        self.parent = parent
+        self.x = 0
+        self.y = 0
+        self.pending_position = None
+        self.sync = True
+        surface.subsurface = self
+        surface.invalidate_origin()
+        # a new sub-surface goes on top of its siblings, once the parent commits
+        stack = parent.pending_stack if parent.pending_stack is not None else list(parent.stack)
+        stack.append(surface)
+        parent.pending_stack = stack
+
+    def handle_set_position(self, x, y):
+        self.pending_position = (x, y)
+
+    def handle_place_above(self, sibling):
+        self.restack(sibling, 1)
+
+    def handle_place_below(self, sibling):
+        self.restack(sibling, 0)
+
+    def restack(self, sibling, after):
+        parent = self.parent
+        if parent is None:
+            return
+        stack = parent.pending_stack if parent.pending_stack is not None else list(parent.stack)
+        if sibling is self.surface or sibling not in stack:
+            self.display.post_error(self.obj_id, self.BAD_SURFACE,
+                                    "wl_surface {} is not a sibling or the parent".format(sibling.obj_id))
+            return
+        stack.remove(self.surface)
+        stack.insert(stack.index(sibling) + after, self.surface)
+        parent.pending_stack = stack
+
+    def handle_set_sync(self):
+        self.sync = True
+
+    def handle_set_desync(self):
+        self.sync = False
+        surface = self.surface
+        if surface.cached is not None and not surface.synchronized():
+            cached, surface.cached = surface.cached, None
+            surface.apply(cached)
+
+    def unmap(self):
+        """ take the surface out of its parent's tree """
+        surface = self.surface
+        parent = self.parent
+        if parent is not None:
+            damage = surface.extents()
+            for stack in (parent.stack, parent.pending_stack):
+                if stack is not None and surface in stack:
+                    stack.remove(surface)
+            if damage:
+                parent.root().damaged(damage)
+        self.parent = None
+        surface.subsurface = None
+        surface.cached = None
+        surface.invalidate_origin()
+
+    def handle_destroy(self):
+        self.destroy()
+        self.display.send_delete_id(self.obj_id)
+
+    def destroy(self):
+        if self.surface.subsurface is self:
+            self.unmap()
+
+
+class Subcompositor(object):
+    """ the wl_subcompositor global, for Surface objects """
+    name = "wl_subcompositor"
+    version = 1
+    proxy = server.SubcompositorProxy
+
+    def __init__(self, display):
+        self.display = display
+
+    def get_subsurface(self, proxy, obj_id, surface, parent):
+        client = proxy.display
+        ancestor = parent
+        while ancestor is not None and ancestor is not surface:
+            ancestor = ancestor.parent
+        if surface.subsurface is not None or ancestor is surface:
+            client.post_error(proxy.obj_id, proxy.BAD_SURFACE,
+                              "wl_surface {} cannot be a sub-surface of {}".format(surface.obj_id, parent.obj_id))
+            return
+        client.objects[obj_id] = Subsurface(client, obj_id, surface, parent)
+
+    def setup(self, proxy):
+        pass
+
+    def update(self):
+        pass
+
+    def destroy(self, proxy):
+        pass
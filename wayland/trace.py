@@ -0,0 +1,181 @@
+"""
+    Protocol message tracing in the format of libwayland's WAYLAND_DEBUG.
+
+    A tracer is chosen when a client Display or a server Client is created.
+    Traced connections get an object table that hooks unpack_event of every
+    object added to it, and an output arena that logs every message queued
+    in it; connections without a tracer keep a plain dict and Arena, so the
+    message paths cost nothing extra when tracing is off.
+"""
+
+import os
+import sys
+import time
+import struct
+
+from . import protocol
+from .arena import Arena
+
+
+def enabled(side):
+    """ whether WAYLAND_DEBUG asks for tracing on side, "client" or "server" """
+    value = os.getenv("WAYLAND_DEBUG", "")
+    return "1" in value or side in value
+
+
+def get_tracer(side, trace=None):
+    """ the Tracer of a new connection, or None
+
+    trace may be a Tracer, a stream to write to, True or False.  When it is
+    None the WAYLAND_DEBUG environment variable decides.
+
+    """
+    if trace is None:
+        trace = enabled(side)
+    if trace is False:
+        return None
+    if trace is True:
+        return Tracer()
+    if isinstance(trace, Tracer):
+        return trace
+    return Tracer(trace)
+
+
+def ignore(*args):
+    pass
+
+
+def interface_of(obj):
+    return getattr(obj, "interface", None) or "[unknown]"
+
+
+class Tracer(object):
+    """ write one line per message: [timestamp] interface@id.message(args)
+
+    Messages we send are prefixed with " -> ", like libwayland does.  The
+    timestamp is in milliseconds with microsecond precision.
+
+    """
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, line, now=None):
+        if now is None:
+            now = int(time.time() * 1000000)
+        stream = self.stream if self.stream is not None else sys.stderr
+        stream.write("[{:7d}.{:03d}] {}\n".format(now // 1000 & 0xffffffff, now % 1000, line))
+
+    def debug(self, *args):
+        self.write(" ".join(str(a) for a in args))
+
+    def format_arguments(self, objects, interface, name, signature, args):
+        text = []
+        for code, value in zip(protocol.argument_types(signature), args):
+            if code == "f":
+                text.append("{:f}".format(value))
+            elif code == "s":
+                text.append("nil" if value is None else '"{}"'.format(value))
+            elif code == "o":
+                text.append("nil" if not value else "{}@{}".format(interface_of(objects.get(value)), value))
+            elif code == "n":
+                text.append("new id {}@{}".format(protocol.new_ids.get((interface, name), "[unknown]"), value))
+            elif code == "a":
+                text.append("array[{}]".format(len(value)))
+            elif code == "h":
+                text.append("fd {}".format(value))
+            else:
+                text.append(str(value))
+        return ", ".join(text)
+
+    def message(self, objects, obj_id, opcode, data, fds, direction, sent=False, now=None):
+        """ log one message given its target, opcode and undecoded arguments """
+        interface = interface_of(objects.get(obj_id))
+        prefix = " -> " if sent else ""
+        entry = protocol.message(interface, direction, opcode)
+        if entry is None:
+            self.write("{}{}@{}.[{}]({} bytes)".format(prefix, interface, obj_id, opcode, len(data)), now)
+            return
+        name, signature = entry
+        try:
+            args = protocol.unpack_arguments(signature, data, fds)
+        except struct.error:
+            self.write("{}{}@{}.{}(malformed, {} bytes)".format(prefix, interface, obj_id, name, len(data)), now)
+            return
+        self.write("{}{}@{}.{}({})".format(
+            prefix, interface, obj_id, name, self.format_arguments(objects, interface, name, signature, args)), now)
+
+    def objects(self, direction, objects, queue):
+        return TracedObjects(self, direction, objects, queue)
+
+    def queue(self, direction):
+        return TracedQueue(self, direction)
+
+
+class TracedObjects(dict):
+    """ object table logging the messages received by its objects """
+    def __init__(self, tracer, direction, objects, queue):
+        dict.__init__(self)
+        self.tracer = tracer
+        self.direction = direction
+        self.queue = queue
+        queue.objects = self
+        for obj_id, obj in objects.items():
+            self[obj_id] = obj
+
+    def __setitem__(self, obj_id, obj):
+        if "unpack_event" not in vars(obj):
+            unpack_event = obj.unpack_event
+
+            def traced(op, data, fds):
+                self.tracer.message(self, obj.obj_id, op, data, fds, self.direction)
+                return unpack_event(op, data, fds)
+            obj.unpack_event = traced
+        dict.__setitem__(self, obj_id, obj)
+        if self.queue.pending:
+            self.queue.log_pending()
+
+
+class TracedQueue(Arena):
+    """ output arena logging the messages queued in it
+
+    Objects often send events from their constructor, before they are added
+    to the object table.  Those messages are logged once the next object is
+    added, with the time they were queued.
+
+    """
+    def __init__(self, tracer, direction):
+        Arena.__init__(self)
+        self.tracer = tracer
+        self.direction = direction
+        self.objects = {}
+        self.pending = []
+
+    def pack(self, obj, opcode, *args):
+        # packed into bytes first, so write can log them
+        self.write(obj.pack_arguments(opcode, *args))
+
+    def write(self, data, fds=()):
+        now = int(time.time() * 1000000)
+        fds = list(fds)
+        offset = 0
+        while offset + 8 <= len(data):
+            obj_id, sizeop = struct.unpack_from("II", data, offset)
+            size = sizeop >> 16
+            if size < 8:
+                break
+            message = (obj_id, sizeop & 0xffff, data[offset+8:offset+size], fds, now)
+            if self.pending or obj_id not in self.objects:
+                self.pending.append(message)
+            else:
+                self.log(message)
+            offset += size
+        Arena.write(self, data, fds)
+
+    def log(self, message):
+        obj_id, opcode, data, fds, now = message
+        self.tracer.message(self.objects, obj_id, opcode, data, fds, self.direction, True, now)
+
+    def log_pending(self):
+        pending, self.pending = self.pending, []
+        for message in pending:
+            self.log(message)
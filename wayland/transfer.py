@@ -0,0 +1,355 @@
+"""
+    Non-blocking data transfers for wl_data_offer.receive and wl_data_source.send.
+
+    A TransferManager owns the pipe ends of every running transfer and moves
+    data in bounded chunks whenever the file descriptors become ready, so a
+    large clipboard or drag-and-drop payload never stalls the dispatch loop.
+"""
+
+import os
+import errno
+import fcntl
+import select
+import stat
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 4 * 1024 * 1024
+# chunks moved per readiness notification, so one transfer can't starve the loop
+CHUNKS_PER_PUMP = 16
+
+
+def set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def is_regular_file(fd):
+    try:
+        return stat.S_ISREG(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+
+class BufferSink(object):
+    """ collect received data in memory
+
+    Data is kept as a list of chunks until it grows past spool_size, then it
+    is moved to an anonymous temporary file and the remainder of the transfer
+    is spliced straight into that file.
+
+    """
+    def __init__(self, spool_size=SPOOL_SIZE):
+        self.spool_size = spool_size
+        self.chunks = []
+        self.size = 0
+        self.file = None
+
+    def write(self, data):
+        if self.file is not None:
+            self.file.write(data)
+        elif self.size + len(data) > self.spool_size:
+            self.file = tempfile.TemporaryFile(buffering=0)
+            for chunk in self.chunks:
+                self.file.write(chunk)
+            self.chunks = []
+            self.file.write(data)
+        else:
+            self.chunks.append(data)
+        self.size += len(data)
+
+    def wrote(self, count):
+        self.size += count
+
+    def fileno(self):
+        if self.file is None:
+            return None
+        return self.file.fileno()
+
+    def getvalue(self):
+        if self.file is None:
+            return b"".join(self.chunks)
+        self.file.seek(0)
+        data = self.file.read()
+        self.file.seek(0, os.SEEK_END)
+        return data
+
+    def close(self):
+        pass
+
+
+class FileSink(object):
+    """ write received data to a file
+
+    Accepts a path or a file object.  When the target is a regular file the
+    transfer uses splice so the data never passes through Python.
+
+    """
+    def __init__(self, target):
+        if isinstance(target, (str, bytes, os.PathLike)):
+            self.file = open(target, "wb", buffering=0)
+            self.owned = True
+        else:
+            self.file = target
+            self.owned = False
+            if hasattr(self.file, "flush"):
+                self.file.flush()
+        self.size = 0
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = self.file.write(view)
+            view = view[written:]
+        self.size += len(data)
+
+    def wrote(self, count):
+        self.size += count
+
+    def fileno(self):
+        fd = self.file.fileno()
+        if is_regular_file(fd):
+            return fd
+        return None
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+
+
+class Transfer(object):
+    def __init__(self, manager, fd, callback):
+        self.manager = manager
+        self.fd = fd
+        self.callback = callback
+        self.done = False
+        self.error = None
+
+    def fileno(self):
+        return self.fd
+
+    def pump(self):
+        """ move what the fd is ready for, returning whether the transfer finished
+
+        Receive and Send override this.
+
+        """
+
+    def finish(self, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self.manager.remove(self)
+        os.close(self.fd)
+        self.close()
+        if self.callback is not None:
+            self.callback(self)
+
+    def close(self):
+        pass
+
+    def cancel(self):
+        self.finish(errno.ECANCELED)
+
+
+class Receive(Transfer):
+    """ read the read end of a wl_data_offer.receive pipe into a sink """
+    def __init__(self, manager, fd, sink, callback):
+        Transfer.__init__(self, manager, fd, callback)
+        self.sink = sink
+        self.splice = hasattr(os, "splice")
+
+    @property
+    def data(self):
+        return self.sink.getvalue()
+
+    def pump(self):
+        for i in range(CHUNKS_PER_PUMP):
+            target = self.sink.fileno() if self.splice else None
+            try:
+                if target is not None:
+                    count = os.splice(self.fd, target, CHUNK_SIZE, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                    if count:
+                        self.sink.wrote(count)
+                else:
+                    data = os.read(self.fd, CHUNK_SIZE)
+                    count = len(data)
+                    if count:
+                        self.sink.write(data)
+            except BlockingIOError:
+                return False
+            except OSError as e:
+                if target is not None and e.errno in (errno.EINVAL, errno.ENOSYS):
+                    self.splice = False
+                    continue
+                self.finish(e.errno)
+                return True
+            if not count:
+                self.finish()
+                return True
+        return False
+
+    def close(self):
+        self.sink.close()
+
+
+class Send(Transfer):
+    """ write bytes, a file or an iterable of chunks to a wl_data_source.send fd """
+    def __init__(self, manager, fd, data, callback):
+        Transfer.__init__(self, manager, fd, callback)
+        self.file = None
+        self.chunks = None
+        self.view = memoryview(b"")
+        self.sendfile = hasattr(os, "sendfile")
+        self.sent = 0
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self.view = memoryview(data)
+        elif hasattr(data, "fileno"):
+            self.file = data
+            self.offset = data.tell() if hasattr(data, "tell") else 0
+        else:
+            self.chunks = iter(data)
+
+    def next_chunk(self):
+        if self.chunks is None:
+            return False
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunk:
+                self.view = memoryview(chunk)
+                return True
+        self.chunks = None
+        return False
+
+    def send_file(self):
+        in_fd = self.file.fileno()
+        if self.sendfile:
+            try:
+                count = os.sendfile(self.fd, in_fd, self.offset, CHUNK_SIZE)
+                self.offset += count
+                self.sent += count
+                return count
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+                self.sendfile = False
+        data = os.pread(in_fd, CHUNK_SIZE, self.offset)
+        if data:
+            self.view = memoryview(data)
+            self.offset += len(data)
+        return len(data)
+
+    def pump(self):
+        try:
+            for i in range(CHUNKS_PER_PUMP):
+                if not self.view:
+                    if self.file is not None:
+                        if not self.send_file():
+                            self.finish()
+                            return True
+                        continue
+                    elif not self.next_chunk():
+                        self.finish()
+                        return True
+                written = os.write(self.fd, self.view[:CHUNK_SIZE])
+                self.view = self.view[written:]
+                self.sent += written
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            self.finish(e.errno)
+            return True
+        return False
+
+
+class TransferManager(object):
+    """ the set of running transfers of a client display
+
+    Transfers are driven by poll(), which Display.dispatch calls while it
+    waits for the connection to become readable, or by an asyncio event loop
+    after attach().
+
+    """
+    def __init__(self, display):
+        self.display = display
+        self.readers = {}
+        self.writers = {}
+        self.loop = None
+
+    def __len__(self):
+        return len(self.readers) + len(self.writers)
+
+    def receive(self, offer, mime_type, sink=None, callback=None):
+        read_fd, write_fd = os.pipe2(os.O_CLOEXEC)
+        # the write end belongs to the source client, it must stay blocking,
+        # and the display closes our copy once it is sent
+        set_nonblocking(read_fd)
+        offer.receive(mime_type, write_fd)
+        transfer = Receive(self, read_fd, sink if sink is not None else BufferSink(), callback)
+        self.add(transfer)
+        self.display.flush()
+        return transfer
+
+    def send(self, fd, data, callback=None):
+        set_nonblocking(fd)
+        transfer = Send(self, fd, data, callback)
+        self.add(transfer)
+        return transfer
+
+    def add(self, transfer):
+        if isinstance(transfer, Receive):
+            self.readers[transfer.fd] = transfer
+            if self.loop is not None:
+                self.loop.add_reader(transfer.fd, transfer.pump)
+        else:
+            self.writers[transfer.fd] = transfer
+            if self.loop is not None:
+                self.loop.add_writer(transfer.fd, transfer.pump)
+
+    def remove(self, transfer):
+        if self.readers.pop(transfer.fd, None) is not None and self.loop is not None:
+            self.loop.remove_reader(transfer.fd)
+        if self.writers.pop(transfer.fd, None) is not None and self.loop is not None:
+            self.loop.remove_writer(transfer.fd)
+
+    def attach(self, loop):
+        """ drive transfers from an asyncio event loop """
+        self.loop = loop
+        for fd, transfer in self.readers.items():
+            loop.add_reader(fd, transfer.pump)
+        for fd, transfer in self.writers.items():
+            loop.add_writer(fd, transfer.pump)
+
+    def poll(self, timeout=0, fds=()):
+        """ pump every ready transfer, returning which of fds are readable """
+        readers = list(fds)
+        if self.loop is None:
+            readers.extend(self.readers)
+            writers = list(self.writers)
+        else:
+            writers = []
+        try:
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+        except InterruptedError:
+            return []
+        ready = []
+        for r in readable:
+            transfer = self.readers.get(r)
+            if transfer is not None:
+                transfer.pump()
+            else:
+                ready.append(r)
+        for w in writable:
+            transfer = self.writers.get(w)
+            if transfer is not None:
+                transfer.pump()
+        return ready
+
+    def run(self, timeout=None):
+        """ block until every transfer has finished """
+        while self:
+            self.poll(timeout)
@@ -47,7 +47,7 @@ class XdgShell(WaylandObject):
         and will result in a protocol error.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def use_unstable_version(self, version):
         """ enable use of this unstable version
@@ -59,7 +59,7 @@ class XdgShell(WaylandObject):
         the xdg-shell protocol is stable.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, version), ()))
+        self.display.out_queue.pack(self, 1, version)
 
     def get_xdg_surface(self, surface):
         """ create a shell surface from a surface
@@ -76,7 +76,7 @@ class XdgShell(WaylandObject):
         """
         new_id = self.display.next_id()
         _surface = XdgSurface(self.display, new_id)
-        self.display.out_queue.append((self.pack_arguments(2, new_id, surface), ()))
+        self.display.out_queue.pack(self, 2, new_id, surface)
         return _surface
 
     def get_xdg_popup(self, surface, parent, seat, serial, x, y):
@@ -97,7 +97,7 @@ class XdgShell(WaylandObject):
         """
         new_id = self.display.next_id()
         _popup = XdgPopup(self.display, new_id)
-        self.display.out_queue.append((self.pack_arguments(3, new_id, surface, parent, seat, serial, x, y), ()))
+        self.display.out_queue.pack(self, 3, new_id, surface, parent, seat, serial, x, y)
         return _popup
 
     def handle_ping(self, serial):
@@ -125,7 +125,7 @@ class XdgShell(WaylandObject):
         the client may be deemed unresponsive.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4, serial), ()))
+        self.display.out_queue.pack(self, 4, serial)
 
     events = ['ping']
     requests = ['destroy', 'use_unstable_version', 'get_xdg_surface', 'get_xdg_popup', 'pong']
@@ -141,7 +141,7 @@ class XdgSurface(WaylandObject):
         maximization, fullscreen, and so on, will be lost.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def set_parent(self, parent):
         """ set the parent of this surface
@@ -155,7 +155,7 @@ class XdgSurface(WaylandObject):
         is raised.
         
         """
-        self.display.out_queue.append((self.pack_arguments(1, parent), ()))
+        self.display.out_queue.pack(self, 1, parent)
 
     def set_title(self, title):
         """ set surface title
@@ -169,7 +169,7 @@ class XdgSurface(WaylandObject):
         The string must be encoded in UTF-8.
         
         """
-        self.display.out_queue.append((self.pack_arguments(2, title), ()))
+        self.display.out_queue.pack(self, 2, title)
 
     def set_app_id(self, app_id):
         """ set application ID
@@ -196,7 +196,7 @@ class XdgSurface(WaylandObject):
         [0] http://standards.freedesktop.org/desktop-entry-spec/
         
         """
-        self.display.out_queue.append((self.pack_arguments(3, app_id), ()))
+        self.display.out_queue.pack(self, 3, app_id)
 
     def show_window_menu(self, seat, serial, x, y):
         """ show the window menu
@@ -214,7 +214,7 @@ class XdgSurface(WaylandObject):
         like a button press, key press, or touch down event.
         
         """
-        self.display.out_queue.append((self.pack_arguments(4, seat, serial, x, y), ()))
+        self.display.out_queue.pack(self, 4, seat, serial, x, y)
 
     def move(self, seat, serial):
         """ start an interactive move
@@ -237,7 +237,7 @@ class XdgSurface(WaylandObject):
         that the device focus will return when the move is completed.
         
         """
-        self.display.out_queue.append((self.pack_arguments(5, seat, serial), ()))
+        self.display.out_queue.pack(self, 5, seat, serial)
 
     # edge values for resizing
     NONE = 0
@@ -285,7 +285,7 @@ class XdgSurface(WaylandObject):
         appropriate cursor image.
         
         """
-        self.display.out_queue.append((self.pack_arguments(6, seat, serial, edges), ()))
+        self.display.out_queue.pack(self, 6, seat, serial, edges)
 
     # types of state on the surface
     MAXIMIZED = 1
@@ -348,7 +348,7 @@ class XdgSurface(WaylandObject):
         configure event the client is responding to.
         
         """
-        self.display.out_queue.append((self.pack_arguments(7, serial), ()))
+        self.display.out_queue.pack(self, 7, serial)
 
     def set_window_geometry(self, x, y, width, height):
         """ set the new window geometry
@@ -380,7 +380,7 @@ class XdgSurface(WaylandObject):
         The width and height must be greater than zero.
         
         """
-        self.display.out_queue.append((self.pack_arguments(8, x, y, width, height), ()))
+        self.display.out_queue.pack(self, 8, x, y, width, height)
 
     def set_maximized(self):
         """ maximize the window
@@ -403,7 +403,7 @@ class XdgSurface(WaylandObject):
         a configure event with the "maximized" state.
         
         """
-        self.display.out_queue.append((self.pack_arguments(9), ()))
+        self.display.out_queue.pack(self, 9)
 
     def unset_maximized(self):
         """ unmaximize the window
@@ -427,7 +427,7 @@ class XdgSurface(WaylandObject):
         emit a configure event without the "maximized" state.
         
         """
-        self.display.out_queue.append((self.pack_arguments(10), ()))
+        self.display.out_queue.pack(self, 10)
 
     def set_fullscreen(self, output):
         """ set the window as fullscreen on a monitor
@@ -443,10 +443,10 @@ class XdgSurface(WaylandObject):
         black borders filling the rest of the output.
         
         """
-        self.display.out_queue.append((self.pack_arguments(11, output), ()))
+        self.display.out_queue.pack(self, 11, output)
 
     def unset_fullscreen(self):
-                self.display.out_queue.append((self.pack_arguments(12), ()))
+                self.display.out_queue.pack(self, 12)
 
     def set_minimized(self):
         """ set the window as minimized
@@ -461,7 +461,7 @@ class XdgSurface(WaylandObject):
         similar compositor features.
         
         """
-        self.display.out_queue.append((self.pack_arguments(13), ()))
+        self.display.out_queue.pack(self, 13)
 
     def handle_close(self):
         """ surface wants to be closed
@@ -494,7 +494,7 @@ class XdgPopup(WaylandObject):
         will be sent.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     def handle_popup_done(self):
         """ popup interaction is done
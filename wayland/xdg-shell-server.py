@@ -110,7 +110,7 @@ class XdgShell(WaylandObject):
         always respond to any xdg_shell object it created.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, serial), ()))
+        self.display.out_queue.pack(self, 0, serial)
 
     def handle_pong(self, serial):
         """ respond to a ping event
@@ -316,7 +316,7 @@ class XdgSurface(WaylandObject):
         event it received.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0, width, height, states, serial), ()))
+        self.display.out_queue.pack(self, 0, width, height, states, serial)
 
     def handle_ack_configure(self, serial):
         """ ack a configure event
@@ -470,7 +470,7 @@ class XdgSurface(WaylandObject):
         a dialog to ask the user to save their data...
         
         """
-        self.display.out_queue.append((self.pack_arguments(1), ()))
+        self.display.out_queue.pack(self, 1)
 
     events = ['destroy', 'set_parent', 'set_title', 'set_app_id', 'show_window_menu', 'move', 'resize', 'ack_configure', 'set_window_geometry', 'set_maximized', 'unset_maximized', 'set_fullscreen', 'unset_fullscreen', 'set_minimized']
     requests = ['configure', 'close']
@@ -498,7 +498,7 @@ class XdgPopup(WaylandObject):
         point.
         
         """
-        self.display.out_queue.append((self.pack_arguments(0), ()))
+        self.display.out_queue.pack(self, 0)
 
     events = ['destroy']
     requests = ['popup_done']